@@ -43,6 +43,8 @@ ORCHESTRATOR_CONTAINER_NAME="orchestrator"
 
 DOCKER_RUN_FLAGS="--rm \
                   -v /var/run/docker.sock:/var/run/docker.sock \
+                  -v ORCHESTRATOR_DATA:/app/data \
+                  -e TASK_STORE_PATH=/app/data/tasks.sqlite \
                   -e LLM_SERVER_DOCKER_IMAGE=$LLM_IMAGE \
                   -e IMAGE_SERVER_DOCKER_IMAGE=$IMAGE_SERVER_IMAGE \
                   --network $NETWORK"
@@ -103,6 +105,7 @@ echo "Got up to date images, Making volumes...."
 
 docker volume inspect HF >/dev/null 2>&1 || docker volume create HF
 docker volume inspect COMFY >/dev/null 2>&1 || docker volume create COMFY
+docker volume inspect ORCHESTRATOR_DATA >/dev/null 2>&1 || docker volume create ORCHESTRATOR_DATA
 
 docker network inspect $NETWORK >/dev/null 2>&1 || docker network create $NETWORK
 
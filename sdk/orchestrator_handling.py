@@ -1,6 +1,11 @@
 import httpx
 from loguru import logger
 import asyncio
+import json
+
+LONG_POLL_SECONDS = 30
+# Tasks that finished without scores: the check errored, or ran past its deadline
+UNSCORED_STATUSES = ("Failed", "Expired")
 
 
 async def handle_none_task_id(response: httpx.Response):
@@ -12,23 +17,50 @@ async def handle_none_task_id(response: httpx.Response):
         logger.error("Checking server seems broke, please check!")
 
 
+async def _stream_task_result(client: httpx.AsyncClient, task_id: str, url: str) -> dict:
+    """Wait for the task on the orchestrator's server-sent events stream, which pushes the result as soon as it's ready"""
+    async with client.stream("GET", url.rstrip("/") + "/task-events", params={"task_ids": [task_id]}, timeout=None) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            task_response_json = json.loads(line[len("data:"):])
+            status = task_response_json.get("status")
+            logger.info(f"Task {task_id} status: {status}")
+            # A finished task's result can come in a later event than its status, keep reading until it's there
+            if status == "Missing" or (status != "Processing" and task_response_json.get("result") is not None):
+                return task_response_json
+    raise httpx.RemoteProtocolError(f"Task event stream for {task_id} closed before the task finished")
+
+
+async def _long_poll_task_result(client: httpx.AsyncClient, task_id: str, url: str) -> dict:
+    check = 0
+    while True:
+        check += 1
+        logger.info(f"Waiting for task {task_id} to be done - check number: {check}")
+        task_response = await client.get(
+            url.rstrip("/") + f"/check-task/{task_id}", params={"wait": LONG_POLL_SECONDS}, timeout=LONG_POLL_SECONDS + 10
+        )
+        task_response.raise_for_status()
+        task_response_json = task_response.json()
+
+        if task_response_json.get("status") != "Processing":
+            return task_response_json
+
+
 async def handle_task_id(response: httpx.Response, task_id: str, url: str):
 
     async with httpx.AsyncClient() as client:
-        check = 0
-        while True:
-            check += 1
-            logger.info(f"Waiting for task {task_id} to be done - check number: {check}")
-            await asyncio.sleep(1)
-            task_response = await client.get(url.rstrip("/") + f"/check-task/{task_id}")
-            task_response.raise_for_status()
-            task_response_json = task_response.json()
-
-            if task_response_json.get("status") != "Processing":
-                if task_response_json.get("status") == "Failed":
-                    logger.error(f"Task {task_id} failed: {task_response_json.get('error')}")
-                    return None
-                break
+        try:
+            task_response_json = await _stream_task_result(client, task_id, url)
+        except httpx.HTTPError as e:
+            logger.warning(f"Couldn't stream events for task {task_id} ({e}), falling back to long polling")
+            task_response_json = await _long_poll_task_result(client, task_id, url)
+
+        status = task_response_json.get("status")
+        if status in UNSCORED_STATUSES:
+            logger.error(f"Task {task_id} {status.lower()}: {(task_response_json.get('result') or {}).get('error_message')}")
+            return None
 
         logger.info(f"Task {task_id} is done: {task_response_json}")
-        return task_response_json.get("result", {}), 0
\ No newline at end of file
+        return task_response_json.get("result", {}), 0
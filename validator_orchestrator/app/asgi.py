@@ -1,14 +1,91 @@
 from fastapi import FastAPI
+import asyncio
 import contextlib
+import functools
 from app.settings import settings
-from app.checking.endpoints import router as checking_router
+from app.checking.endpoints import router as checking_router, process_check_result
+from app.checking import worker_pool
+from app.checking.registry import checker_registry
+from app.checking.score_memo import score_memo
+from app.checking.prompt_cache import prompt_cache
+from app.checking.task_manager import task_manager
+from app.checking.task_persistence import SQLiteTaskStore
+from app.core import models
+from app.core import metrics
+from app.core import timeouts
+from app.core import tracing
+from app.core.docker_client import docker_client
+from app.core.http_clients import http_clients
 from app import server_management
+from datetime import datetime
+from loguru import logger
+
+
+def _requeue_checks(check_worker_pool: worker_pool.CheckWorkerPool, checks: list[tuple[str, models.CheckResultsRequest]]) -> None:
+    for task_id, request in checks:
+        if not check_worker_pool.submit(task_id, request):
+            task_manager.complete_task(
+                task_id,
+                models.TaskStatus.Failed,
+                models.TaskResult(error_message="Check queue was full when requeueing after restart", timestamp=datetime.now()),
+            )
+    logger.info(f"Requeued {len(checks)} checks from before the restart")
+
+
+def _register_metric_collectors(check_worker_pool: worker_pool.CheckWorkerPool, server_manager: server_management.ServerManager) -> None:
+    metrics.queue_depth.set_function(lambda: check_worker_pool.queue_depth)
+    metrics.queue_group_depth.set_collector(lambda: {(server, model or ""): depth for (server, model), depth in check_worker_pool.group_depths().items()})
+    metrics.busy_workers.set_function(lambda: check_worker_pool.busy_workers)
+    metrics.workers.set_function(lambda: check_worker_pool.num_workers)
+    metrics.http_pool_connections.set_collector(http_clients.pool_stats)
+    metrics.upstream_timeout_seconds.set_collector(timeouts.upstream_latency.timeouts)
+    metrics.gpu_memory_reserved_mib.set_collector(server_manager.planner.reserved_mib)
+    metrics.prompt_cache_bytes.set_function(lambda: prompt_cache.size_bytes)
+    metrics.score_memo_entries.set_function(lambda: len(score_memo))
+    metrics.task_store_size.set_function(lambda: len(task_manager.task_status))
+    metrics.task_store_evictions_total.set_collector(
+        lambda: {("expired",): task_manager.evicted_expired, ("capacity",): task_manager.evicted_capacity}
+    )
 
 
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI):
+    tracing.configure(buffer_size=settings.trace_buffer_size, otlp_endpoint=settings.otlp_traces_endpoint, service_name="validator_orchestrator")
+    if tracing.exporter is not None:
+        tracing.exporter.start()
+
+    checker_registry.load()
+    http_clients.start()
+
     app.state.server_manager = server_management.ServerManager()
+    container_watcher = asyncio.create_task(app.state.server_manager.watch_containers())
+    app.state.check_worker_pool = worker_pool.CheckWorkerPool(
+        handler=functools.partial(process_check_result, server_manager=app.state.server_manager),
+        num_workers=settings.check_workers,
+        max_queue_size=settings.max_queued_checks,
+        max_group_wait_seconds=settings.max_group_wait_seconds,
+        is_warm=app.state.server_manager.is_warm,
+    )
+    app.state.check_worker_pool.start()
+    _register_metric_collectors(app.state.check_worker_pool, app.state.server_manager)
+
+    task_store = None
+    if settings.task_store_path:
+        task_store = SQLiteTaskStore(settings.task_store_path, flush_interval_seconds=settings.task_store_flush_interval_seconds)
+        _requeue_checks(app.state.check_worker_pool, task_manager.attach_store(task_store))
+        task_store.start()
+
     yield
+    await app.state.check_worker_pool.stop()
+    container_watcher.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await container_watcher
+    if task_store is not None:
+        await task_store.close()
+    if tracing.exporter is not None:
+        await tracing.exporter.close()
+    await http_clients.close()
+    await docker_client.close()
     # NOTE: Is this needed?
     # await app.state.server_manager.stop_server()
 
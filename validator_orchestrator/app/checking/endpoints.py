@@ -1,17 +1,31 @@
-from fastapi import APIRouter, BackgroundTasks, HTTPException
-from typing import Dict
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from typing import AsyncIterator, Dict, List
 from uuid import uuid4
 from app.core import models
+from app.core import constants as cst
+from app.core import metrics
+from app.core import timeouts
+from app.core import tracing
 from app.checking import scoring
+from app.checking import worker_pool
+from app.checking.functions import text
+from app.checking.registry import checker_registry
+from app.checking.score_memo import request_key, result_for_request, score_memo
 from app import server_management
 from fastapi import Depends
 from app.core import dependencies
 from loguru import logger
+from pydantic import ValidationError
 import traceback
 from datetime import datetime
 from app.checking.task_manager import task_manager
 from app.settings import settings
 import asyncio
+import contextlib
+import httpx
+import json
+import time
 
 router = APIRouter(
     prefix="",
@@ -19,9 +33,6 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-global_async_lock = asyncio.Lock()
-
-
 def _get_llm_server_docker_flags(task_config: models.OrchestratorServerConfig) -> str:
     if task_config.server_needed != models.ServerType.LLM:
         logger.info("Server needed is not LLM, so no docker flags needed")
@@ -57,82 +68,301 @@ async def root() -> Dict[str, str]:
     return {"message": "Hello World"}
 
 
+def _validate_checker(request: models.CheckResultsRequest) -> None:
+    try:
+        checker_registry.validate(request.server_config)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def _set_deadline(request: models.CheckResultsRequest) -> None:
+    if request.deadline is None:
+        request.deadline = time.time() + (request.timeout_seconds or settings.check_timeout_seconds)
+
+
+def _complete_from_memo(task_id: str, request: models.CheckResultsRequest) -> bool:
+    """Answer an exact repeat of a recent check straight away, without queueing it"""
+    memoised = score_memo.lookup(request_key(request))
+    if memoised is None:
+        return False
+    task_manager.complete_task(task_id, models.TaskStatus.Success, result_for_request(memoised, request))
+    return True
+
+
 @router.post("/check-result")
 async def check_result(
     request: models.CheckResultsRequest,
-    background_tasks: BackgroundTasks,
-    server_manager: server_management.ServerManager = Depends(dependencies.get_server_manager),
+    check_worker_pool: worker_pool.CheckWorkerPool = Depends(dependencies.get_check_worker_pool),
 ) -> models.CheckResultResponse:
-    if task_manager.current_task_id is not None:
-        return models.CheckResultResponse(
-            task_id=task_manager.current_task_id,
-            status=models.TaskStatus.Busy,
-        )
-
+    _validate_checker(request)
+    _set_deadline(request)
     task_id = str(uuid4())
-    task_manager.current_task_id = task_id
-    task_manager.task_status[task_id] = models.TaskStatus.Processing
-    background_tasks.add_task(process_check_result, task_id, request, server_manager)
+    task_manager.add_task(task_id, request)
+    if _complete_from_memo(task_id, request):
+        return models.CheckResultResponse(task_id=task_id, status=models.TaskStatus.Success)
+    if not check_worker_pool.submit(task_id, request):
+        task_manager.clear_and_return_task_status_and_result(task_id)
+        return models.CheckResultResponse(task_id=None, status=models.TaskStatus.Busy)
+
     return models.CheckResultResponse(task_id=task_id, status=models.TaskStatus.Processing)
 
 
+@router.post("/check-results")
+async def check_results(
+    requests: List[models.CheckResultsRequest],
+    check_worker_pool: worker_pool.CheckWorkerPool = Depends(dependencies.get_check_worker_pool),
+) -> models.CheckResultsBatchResponse:
+    for request in requests:
+        _validate_checker(request)
+        _set_deadline(request)
+    task_ids = [str(uuid4()) for _ in requests]
+    checks_to_queue = []
+    for task_id, request in zip(task_ids, requests):
+        task_manager.add_task(task_id, request)
+        if not _complete_from_memo(task_id, request):
+            checks_to_queue.append((task_id, request))
+    if not check_worker_pool.submit_batch(checks_to_queue):
+        for task_id in task_ids:
+            task_manager.clear_and_return_task_status_and_result(task_id)
+        return models.CheckResultsBatchResponse(batch_id=None, task_ids=[], status=models.TaskStatus.Busy)
+
+    batch_id = str(uuid4())
+    task_manager.add_batch(batch_id, task_ids)
+    return models.CheckResultsBatchResponse(batch_id=batch_id, task_ids=task_ids, status=models.TaskStatus.Processing)
+
+
+async def _swap_server(task_config: models.OrchestratorServerConfig, server_manager: server_management.ServerManager) -> None:
+    server_needed = task_config.server_needed
+    load_model_config = task_config.load_model_config
+
+    flags = _get_llm_server_docker_flags(task_config)
+    load_model_config["extra-docker-flags"] = flags
+    await server_manager.start_server(server_needed, load_model_config)
+
+    if load_model_config is not None:
+        # TODO: Why is this needed? Slows down checking *alot*
+        # if task_manager.last_task_type != task_config.task:
+        #     load_model_config_dumped["force_reload"] = True
+        if server_needed != models.ServerType.LLM:
+            # TODO: I'm pretty sure no one uses this any more lol
+            await server_manager.load_model(load_model_config, server_name=server_needed.value)
+
+
+def _server_may_be_down(error: Exception) -> bool:
+    """Whether a check's error means the server might have died under it. A slow server is still up"""
+    return isinstance(error, httpx.TransportError) and not isinstance(error, httpx.TimeoutException)
+
+
+def _expired(error: Exception, deadline: float | None) -> bool:
+    """Whether a check failed because it ran out of time (upstream timeouts are cut short at the deadline too)"""
+    if isinstance(error, (asyncio.TimeoutError, timeouts.DeadlineExceeded)):
+        return True
+    return deadline is not None and time.time() >= deadline
+
+
+async def _score_check(request: models.CheckResultsRequest, server_manager: server_management.ServerManager) -> models.TaskResult:
+    task_config = request.server_config
+    logger.info("Checking a result for server: !... 🫡")
+    logger.debug(f"Config: {task_config}")
+    server_needed = task_config.server_needed
+    logger.info(f"Server needed: {server_needed}")
+
+    checker = checker_registry.get(task_config.checking_function)
+    # CPU only checkers don't need the server, so they don't wait for (or cause) a swap
+    server_gate = (
+        server_manager.use_server(task_config, swap=lambda: _swap_server(task_config, server_manager))
+        if checker.needs_server
+        else contextlib.nullcontext()
+    )
+    async with server_gate:
+        task_manager.last_task_type = task_config.task
+
+        async with checker.semaphore if checker.semaphore is not None else contextlib.nullcontext():
+            with tracing.span("score_results"):
+                return await scoring.score_results(
+                    results=request.query_results,
+                    task_config=task_config,
+                    payload=request.payload,
+                )
+
+
 async def process_check_result(
     task_id: str,
     request: models.CheckResultsRequest,
     server_manager: server_management.ServerManager,
 ):
-    async with global_async_lock:
+    task_config: models.OrchestratorServerConfig = request.server_config
+    memo_key = request_key(request)
+    # An identical check may have finished while this one was queued, or be running right now
+    memoised = score_memo.get(memo_key)
+    if memoised is not None:
+        task_manager.complete_task(task_id, models.TaskStatus.Success, result_for_request(memoised, request))
+        return
+    if score_memo.join(memo_key, task_id, request):
+        return
+
+    started_at = time.perf_counter()
+    status, result = models.TaskStatus.Failed, None
+    try:
+        with tracing.start_trace("check", task_id=task_id, task=task_config.task, checking_function=task_config.checking_function) as trace:
+            try:
+                with timeouts.deadline(request.deadline):
+                    if timeouts.expired():
+                        raise timeouts.DeadlineExceeded("The check expired before it started")
+                    # Cancelled when the deadline passes, whichever stage it's at
+                    result = await asyncio.wait_for(_score_check(request, server_manager), timeout=timeouts.remaining())
+
+                status = models.TaskStatus.Success
+            except Exception as e:
+                if _expired(e, request.deadline):
+                    status = models.TaskStatus.Expired
+                    error_message = f"Task {task_id} expired: {str(e) or 'it ran past its deadline'}"
+                else:
+                    if _server_may_be_down(e):
+                        # The server might have died under us, make the next check bring it back up
+                        server_manager.invalidate(task_config.server_needed.value)
+                    status = models.TaskStatus.Failed
+                    error_message = f"Error processing task {task_id}: {str(e)}"
+                error_traceback = traceback.format_exc()
+                logger.error(f"{error_message}\n{error_traceback}")
+                result = models.TaskResult(
+                    error_message=error_message,
+                    traceback=error_traceback,
+                    timestamp=datetime.now(),
+                )
+
+        result.trace = trace.to_model()
+        task_manager.complete_task(task_id, status, result)
+    finally:
+        if result is None:
+            # Cancelled (e.g. the worker is stopping) or worse: the checks following this one mustn't wait on it forever
+            result = models.TaskResult(error_message=f"Task {task_id}, which this check followed, didn't finish", timestamp=datetime.now())
+        for follower_task_id, follower_request in score_memo.finish(memo_key, status, result):
+            task_manager.complete_task(follower_task_id, status, result_for_request(result, follower_request))
+
+    metrics.checks_total.inc(task=task_config.task, checking_function=task_config.checking_function, status=status.value)
+    metrics.check_duration_seconds.observe(time.perf_counter() - started_at, task=task_config.task, checking_function=task_config.checking_function)
+    for score in (result.node_scores or {}).values():
+        metrics.check_scores.observe(score, task=task_config.task, checking_function=task_config.checking_function)
+
+
+async def _ndjson_lines(body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    buffer = b""
+    async for data in body:
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+@router.post("/check-result-stream")
+async def check_result_stream(
+    http_request: Request,
+    server_manager: server_management.ServerManager = Depends(dependencies.get_server_manager),
+    check_worker_pool: worker_pool.CheckWorkerPool = Depends(dependencies.get_check_worker_pool),
+) -> models.StreamCheckResponse:
+    """
+    Check a text response while it's uploaded, as newline delimited JSON: a `StreamCheckHeader` line, then each
+    chunk of the miner's response (as in `formatted_response`) on its own line. The response is verified a window
+    of tokens at a time, and the verdict is returned as soon as it fails, without reading the rest of the upload.
+
+    The server is only held while a window is verified, not while waiting on the upload, so a slow upload can't
+    hold up swaps. Streamed checks take a place in the check queue while they run, and are Busy when it's full.
+    """
+    lines = _ndjson_lines(http_request.stream())
+    try:
+        header = models.StreamCheckHeader.model_validate_json(await anext(lines))
+    except (StopAsyncIteration, ValidationError) as e:
+        raise HTTPException(status_code=422, detail=f"The first line must be the check's header: {e}")
+    task_config = header.server_config
+    if task_config.checking_function not in cst.STREAMABLE_CHECKING_FUNCTIONS:
+        raise HTTPException(status_code=422, detail=f"Only {list(cst.STREAMABLE_CHECKING_FUNCTIONS)} checks can be streamed")
+    if task_config.server_needed != models.ServerType.LLM:
+        raise HTTPException(status_code=422, detail=f"Streamed checks need server {models.ServerType.LLM.value}")
+
+    if not check_worker_pool.reserve_stream():
+        return models.StreamCheckResponse(
+            status=models.TaskStatus.Busy,
+            result=models.TaskResult(error_message="The check queue is full", timestamp=datetime.now()),
+            tokens_verified=0,
+            rejected_early=False,
+        )
+
+    started_at = time.perf_counter()
+    deadline = time.time() + (header.timeout_seconds or settings.check_timeout_seconds)
+    rejected_early = False
+    check = text.StreamingTextCheck(header.payload, task_config)
+
+    def use_server():
+        task_manager.last_task_type = task_config.task
+        return server_manager.use_server(task_config, swap=lambda: _swap_server(task_config, server_manager))
+
+    async def run_check() -> float:
+        nonlocal rejected_early
+        async for line in lines:
+            if not check.add_chunk(json.loads(line)):
+                rejected_early = True
+                break
+            if check.window_ready:
+                async with use_server():
+                    with tracing.span("verify_window", tokens=len(check.messages)):
+                        verified = await check.verify_window()
+                if not verified:
+                    rejected_early = True
+                    break
+        if check.rejected or not check.messages:
+            # Scored 0 without the server, so don't wait for (or cause) a swap to it
+            return await check.finish()
+        async with use_server():
+            with tracing.span("finish", rejected_early=rejected_early):
+                return await check.finish()
+
+    with tracing.start_trace("stream_check", task=task_config.task, checking_function=task_config.checking_function) as trace:
         try:
-            logger.info("Checking a result for server: !... 🫡")
-            task_config: models.OrchestratorServerConfig = request.server_config
-            logger.debug(f"Config: {task_config}")
-            server_needed = task_config.server_needed
-            logger.info(f"Server needed: {server_needed}")
-
-            load_model_config = task_config.load_model_config
-
-            flags = _get_llm_server_docker_flags(task_config)
-            load_model_config["extra-docker-flags"] = flags
-            await server_manager.start_server(server_needed, load_model_config)
-
-            if load_model_config is not None:
-                # TODO: Why is this needed? Slows down checking *alot*
-                # if task_manager.last_task_type != task_config.task:
-                #     load_model_config_dumped["force_reload"] = True
-                if server_needed != models.ServerType.LLM:
-                    # TODO: I'm pretty sure no one uses this any more lol
-                    await server_manager.load_model(load_model_config, server_name=server_needed.value)
-
-            task_manager.last_task_type = task_config.task
-
-            result = await scoring.score_results(
-                result=request.result,
-                task_config=task_config,
-                payload=request.payload,
-            )
-
-            task_manager.task_status[task_id] = models.TaskStatus.Success
-            task_manager.task_results[task_id] = result
+            with timeouts.deadline(deadline):
+                score = await asyncio.wait_for(run_check(), timeout=timeouts.remaining())
+
+            status = models.TaskStatus.Success
+            result = models.TaskResult(node_scores={header.node_id: score}, timestamp=datetime.now())
         except Exception as e:
-            error_message = f"Error processing task {task_id}: {str(e)}"
+            if _expired(e, deadline):
+                status = models.TaskStatus.Expired
+                error_message = f"Streamed check expired: {str(e) or 'it ran past its deadline'}"
+            else:
+                if _server_may_be_down(e):
+                    server_manager.invalidate(task_config.server_needed.value)
+                status = models.TaskStatus.Failed
+                error_message = f"Error processing streamed check: {str(e)}"
             error_traceback = traceback.format_exc()
             logger.error(f"{error_message}\n{error_traceback}")
-            task_manager.task_status[task_id] = models.TaskStatus.Failed
-            task_manager.task_results[task_id] = models.TaskResult(
-                error=error_message,
-                traceback=error_traceback,
-                timestamp=datetime.now(),
-                result=None,
-            )
+            result = models.TaskResult(error_message=error_message, traceback=error_traceback, timestamp=datetime.now())
         finally:
-            task_manager.current_task_id = None
+            check_worker_pool.release_stream()
+
+    result.trace = trace.to_model()
+    verdict = "rejected_early" if rejected_early else "rejected" if check.rejected else "accepted"
+    if status == models.TaskStatus.Success:
+        metrics.stream_checks_total.inc(verdict=verdict)
+        metrics.stream_check_tokens_verified.observe(check.tokens_verified)
+    metrics.checks_total.inc(task=task_config.task, checking_function=task_config.checking_function, status=status.value)
+    metrics.check_duration_seconds.observe(time.perf_counter() - started_at, task=task_config.task, checking_function=task_config.checking_function)
+    return models.StreamCheckResponse(status=status, result=result, tokens_verified=check.tokens_verified, rejected_early=rejected_early)
 
 
 @router.get("/check-task/{task_id}", response_model=models.CheckTaskResponse)
-async def check_task(task_id: str) -> models.CheckTaskResponse:
+async def check_task(
+    task_id: str,
+    wait: float = Query(default=0, ge=0, le=cst.MAX_TASK_WAIT_SECONDS, description="Seconds to wait for the task to finish before responding"),
+) -> models.CheckTaskResponse:
     if task_id not in task_manager.task_status and task_id not in task_manager.task_results:
         raise HTTPException(status_code=404, detail="Task not found (or Task result got expired)")
 
+    if wait > 0 and task_manager.task_is_processing(task_id):
+        await task_manager.wait_for_any_task([task_id], timeout=wait)
+
     if task_manager.task_is_processing(task_id):
         return models.CheckTaskResponse(task_id=task_id, status=task_manager.task_status[task_id], result=None)
     else:
@@ -143,9 +373,104 @@ async def check_task(task_id: str) -> models.CheckTaskResponse:
     raise HTTPException(status_code=500, detail="Task retrieval failed... how?")
 
 
+def _task_event(response: models.CheckTaskResponse) -> str:
+    return f"event: {response.status.value}\ndata: {response.model_dump_json()}\n\n"
+
+
+def _finished_task_event(task_id: str) -> str:
+    status, result = task_manager.clear_and_return_task_status_and_result(task_id)
+    return _task_event(models.CheckTaskResponse(task_id=task_id, status=status or models.TaskStatus.Missing, result=result))
+
+
+async def _stream_task_events(task_ids: List[str]) -> AsyncIterator[str]:
+    pending = []
+    for task_id in task_ids:
+        if task_id not in task_manager.task_status and task_id not in task_manager.task_results:
+            yield _task_event(models.CheckTaskResponse(task_id=task_id, status=models.TaskStatus.Missing))
+        elif not task_manager.task_is_processing(task_id):
+            # Already done (e.g. answered from the score memo), so its only event carries the result
+            yield _finished_task_event(task_id)
+        else:
+            yield _task_event(models.CheckTaskResponse(task_id=task_id, status=models.TaskStatus.Processing))
+            pending.append(task_id)
+
+    while pending:
+        for task_id in [task_id for task_id in pending if not task_manager.task_is_processing(task_id)]:
+            pending.remove(task_id)
+            yield _finished_task_event(task_id)
+
+        if pending:
+            await task_manager.wait_for_any_task(pending, timeout=cst.TASK_EVENTS_KEEPALIVE_SECONDS)
+            if all(task_manager.task_is_processing(task_id) for task_id in pending):
+                yield ": keepalive\n\n"
+
+
+@router.get("/task-events")
+async def task_events(task_ids: List[str] = Query(...)) -> StreamingResponse:
+    """
+    Server-sent events for the given tasks: their current status straight away, then the final
+    status & result of each one as soon as it finishes. The stream closes once all of them are done.
+    """
+    return StreamingResponse(_stream_task_events(task_ids), media_type="text/event-stream")
+
+
+@router.get("/check-batch/{batch_id}", response_model=models.CheckBatchResponse)
+async def check_batch(batch_id: str) -> models.CheckBatchResponse:
+    if batch_id not in task_manager.batches:
+        raise HTTPException(status_code=404, detail="Batch not found (or its results got expired)")
+
+    if task_manager.batch_is_processing(batch_id):
+        task_ids = task_manager.batches[batch_id]
+        return models.CheckBatchResponse(
+            batch_id=batch_id,
+            status=models.TaskStatus.Processing,
+            statuses={task_id: task_manager.task_status.get(task_id, models.TaskStatus.Missing) for task_id in task_ids},
+            results={task_id: task_manager.task_results[task_id] for task_id in task_ids if task_id in task_manager.task_results},
+        )
+
+    statuses, results = task_manager.clear_and_return_batch(batch_id)
+    return models.CheckBatchResponse(batch_id=batch_id, status=models.TaskStatus.Success, statuses=statuses, results=results)
+
+
 @router.get("/all-task-status")
-async def task_statuses() -> models.AllTaskStatusResponse:
-    return models.AllTaskStatusResponse(tasks=task_manager.task_status)
+async def task_statuses(
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=100, ge=1, le=cst.MAX_TASK_STATUS_PAGE_SIZE),
+    status: models.TaskStatus | None = None,
+) -> models.AllTaskStatusResponse:
+    tasks, total = task_manager.list_task_statuses(offset=offset, limit=limit, status=status)
+    return models.AllTaskStatusResponse(tasks=tasks, total=total, offset=offset, limit=limit, stats=task_manager.stats())
+
+
+@router.get("/queue-status")
+async def queue_status(
+    check_worker_pool: worker_pool.CheckWorkerPool = Depends(dependencies.get_check_worker_pool),
+) -> models.QueueStatusResponse:
+    return check_worker_pool.status()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/debug/traces")
+async def slowest_traces(limit: int = Query(default=20, ge=1, le=1000)) -> List[models.CheckTrace]:
+    """The slowest of the most recently finished checks, with a timing for each stage"""
+    return tracing.trace_buffer.slowest(limit)
+
+
+@router.get("/checkers")
+async def checkers() -> Dict[str, models.CheckerProfileResponse]:
+    """The registered checking functions & the resources each of them needs"""
+    return {
+        name: models.CheckerProfileResponse(
+            server_needed=profile.server_needed,
+            max_concurrency=profile.max_concurrency,
+            batched=profile.batched,
+        )
+        for name, profile in checker_registry.profiles().items()
+    }
 
 
 @router.get("/version")
@@ -1,5 +1,5 @@
 from app.checking.functions.image_based import check_image_result
-from app.checking.functions.text import check_text_result
+from app.checking.functions.text import check_text_result, check_text_results
 
 
-__all__ = ["check_text_result", "check_image_result"]
+__all__ = ["check_text_result", "check_text_results", "check_image_result"]
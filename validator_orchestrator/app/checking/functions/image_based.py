@@ -1,8 +1,12 @@
 from app.core import models
+from app.core import timeouts
+from app.core import tracing
+from app.core.http_clients import http_clients
 from typing import Dict, Any, Union
-import httpx
 from app.core import utility_models
 from app.checking import utils as checking_utils
+from app.checking.registry import checker
+from app.settings import settings
 import xgboost as xgb
 from loguru import logger
 
@@ -32,13 +36,17 @@ def _get_image_similarity(
 
 async def _query_endpoint_for_image_response(endpoint: str, data: Dict[str, Any], server_name: str) -> utility_models.ImageResponseBody:
     url = f"http://{server_name}:{AI_SERVER_PORT}" + "/" + endpoint.lstrip("/")
-    async with httpx.AsyncClient(timeout=60 * 2) as client:
-        logger.info(f"Querying : {url}")
-        response = await client.post(url, json=data)
-        logger.info(response.status_code)
-        return utility_models.ImageResponseBody(**response.json())
+    client = http_clients.client(server_name)
+    logger.info(f"Querying : {url}")
+    with timeouts.upstream_call(server_name, "/" + endpoint.lstrip("/"), default_timeout=60 * 2) as timeout:
+        response = await client.post(url, json=data, timeout=timeout)
+    logger.info(response.status_code)
+    response.raise_for_status()
+    return utility_models.ImageResponseBody(**response.json())
 
 
+# The image server can't handle concurrent requests well
+@checker(server_needed=models.ServerType.IMAGE, max_concurrency=settings.image_server_concurrency)
 async def check_image_result(result: models.QueryResult, payload: dict, task_config: models.OrchestratorServerConfig) -> Union[float, None]:
     image_response_body = utility_models.ImageResponseBody(**result.formatted_response)
 
@@ -46,18 +54,20 @@ async def check_image_result(result: models.QueryResult, payload: dict, task_con
         logger.error(f"For some reason Everything is none! {image_response_body}")
         return 0
 
-    expected_image_response = await _query_endpoint_for_image_response(task_config.endpoint, payload, task_config.server_needed.value)
+    with tracing.span("image_regeneration"):
+        expected_image_response = await _query_endpoint_for_image_response(task_config.endpoint, payload, task_config.server_needed.value)
 
+    # Our own regeneration failing says nothing about the miner, so fail the check rather than score it
     if expected_image_response.clip_embeddings is None:
-        logger.error(f"For some reason Everything is none! {expected_image_response}")
-        return None
+        raise ValueError(f"The {task_config.server_needed.value} regenerated no clip embeddings: {expected_image_response}")
 
     if expected_image_response.is_nsfw != image_response_body.is_nsfw:
         return 0
 
     else:
-        return _get_image_similarity(
-            image_response_body,
-            expected_image_response,
-            images_are_same_classifier,
-        )
+        with tracing.span("xgboost_similarity"):
+            return _get_image_similarity(
+                image_response_body,
+                expected_image_response,
+                images_are_same_classifier,
+            )
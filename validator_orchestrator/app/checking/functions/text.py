@@ -1,23 +1,50 @@
 from app.core import models
-from typing import Union
+from app.core import metrics
+from app.core import timeouts
+from app.core import tracing
+from app.core.http_clients import http_clients
+from app.checking.tokenization import LocalTokenizer, tokenizer_cache
+from app.checking import prompt_cache as prompt_cache_module
+from app.checking.model_metadata import model_metadata_cache
+from app.checking.prompt_cache import prompt_cache
+from app.settings import TextVerificationMode, TokenizerMode, settings
+from app.checking.registry import checker
+from typing import Any, Awaitable, ContextManager, Dict, Union
 import json
 import random
-from loguru import logger
 import httpx
+from loguru import logger
 from typing import List
+import asyncio
 import math
+import numpy as np
 
 
 PROMPT_KEY = "prompt"
 MESSAGES_KEY = "messages"
 
 # TODO: Eventually change to chutes
-BASE_URL = "http://llm_server:6919".rstrip("/")
+BASE_URL = settings.llm_server_url.rstrip("/")
+LLM_UPSTREAM = models.ServerType.LLM.value
+
+# Fine grained checks compare the miner's logprobs with the top k of the validator's, at up to this many tokens
+MAX_DISTANCE_CHECKS = 5
+DISTANCE_CHECK_TOP_K = 5
+SINGLE_PASS_SCORE_TOLERANCE = 0.01
+
+# A response fails with more than this many tokens ranked poorly in the prompt logprobs
+MAX_BAD_TOKENS = 3
+# or if the eos token was this many times likelier than a token it picked instead
+AVOIDED_STOP_RATIO = 100
 
 BOTTOM_TEXT_THRESHOLD = 0.125
 TOP_TEXT_THRESHOLD = 0.25
 
 
+def _upstream_call(endpoint: str, default_timeout: float = settings.http_default_timeout_seconds, size: int = 1) -> ContextManager[float]:
+    return timeouts.upstream_call(LLM_UPSTREAM, endpoint, default_timeout, size)
+
+
 def _score_average_distance(average_distance: float) -> float:
     if average_distance <= BOTTOM_TEXT_THRESHOLD:
         return 1.0
@@ -54,55 +81,122 @@ def _extract_chat_message(idx: int, response: dict) -> models.MessageResponse |
     return models.MessageResponse(content=content, logprob=logprob)
 
 
-async def _tokenize(prompt: str, model: str, add_special_tokens: bool) -> list[int]:
-    async with httpx.AsyncClient() as client:
-        r = await client.post(url=f"{BASE_URL}/tokenize", json={"model": model, "prompt": prompt, "add_special_tokens": add_special_tokens})
-        r.raise_for_status()  # raise an exception for 4xx or 5xx status codes
-        return r.json()["tokens"]
+async def _server_tokenize(prompt: str, model: str, add_special_tokens: bool) -> list[int]:
+    client = http_clients.client(LLM_UPSTREAM)
+    with _upstream_call("/tokenize") as timeout:
+        r = await client.post(url=f"{BASE_URL}/tokenize", json={"model": model, "prompt": prompt, "add_special_tokens": add_special_tokens}, timeout=timeout)
+    r.raise_for_status()  # raise an exception for 4xx or 5xx status codes
+    return r.json()["tokens"]
+
+
+async def _server_tokenize_chat(messages: list[dict], model: str) -> list[int]:
+    client = http_clients.client(LLM_UPSTREAM)
+    logger.info(f"Tokenizing at: {BASE_URL}/tokenize")
+    with _upstream_call("/tokenize") as timeout:
+        r = await client.post(url=f"{BASE_URL}/tokenize", json={"model": model, "messages": messages}, timeout=timeout)
+    r.raise_for_status()
+    return r.json()["tokens"]
+
+
+async def _server_detokenize(tokens: list[int], model: str) -> str:
+    client = http_clients.client(LLM_UPSTREAM)
+    with _upstream_call("/detokenize") as timeout:
+        r = await client.post(url=f"{BASE_URL}/detokenize", json={"tokens": tokens, "model": model}, timeout=timeout)
+    r.raise_for_status()  # raise an exception for 4xx or 5xx status codes
+    return r.json()["prompt"]
+
+
+async def _local_tokenizer(load_model_config: dict) -> LocalTokenizer | None:
+    if settings.tokenizer_mode == TokenizerMode.SERVER:
+        return None
+    return await tokenizer_cache.get(load_model_config)
+
+
+async def _check_parity(operation: str, local_result: Any, server_result: Awaitable[Any]) -> None:
+    server_result = await server_result
+    if server_result != local_result:
+        metrics.tokenizer_parity_mismatches_total.inc(operation=operation)
+        logger.error(f"In-process {operation} doesn't match the llm_server's. Local: {local_result!r}, server: {server_result!r}")
+
+
+async def _tokenize(prompt: str, load_model_config: dict, add_special_tokens: bool) -> list[int]:
+    model = load_model_config["model"]
+    local_tokenizer = await _local_tokenizer(load_model_config)
+    if local_tokenizer is None:
+        return await _server_tokenize(prompt, model, add_special_tokens)
+
+    tokens = local_tokenizer.tokenize(prompt, add_special_tokens)
+    if settings.tokenizer_mode == TokenizerMode.PARITY:
+        await _check_parity("tokenize", tokens, _server_tokenize(prompt, model, add_special_tokens))
+    return tokens
+
+
+async def _tokenize_chat(messages: list[dict], load_model_config: dict) -> list[int]:
+    model = load_model_config["model"]
+    local_tokenizer = await _local_tokenizer(load_model_config)
+    if local_tokenizer is None:
+        return await _server_tokenize_chat(messages, model)
+
+    tokens = prompt_cache_module.tokenize_chat(local_tokenizer, messages)
+    if settings.tokenizer_mode == TokenizerMode.PARITY:
+        await _check_parity("tokenize_chat", tokens, _server_tokenize_chat(messages, model))
+    return tokens
 
 
-async def _detokenize(tokens: list[int], model: str):
-    async with httpx.AsyncClient() as client:
-        r = await client.post(url=f"{BASE_URL}/detokenize", json={"tokens": tokens, "model": model})
-        r.raise_for_status()  # raise an exception for 4xx or 5xx status codes
-        return r.json()["prompt"]
+async def _detokenize(tokens: list[int], load_model_config: dict) -> str:
+    model = load_model_config["model"]
+    local_tokenizer = await _local_tokenizer(load_model_config)
+    if local_tokenizer is None:
+        return await _server_detokenize(tokens, model)
 
+    prompt = local_tokenizer.detokenize(tokens)
+    if settings.tokenizer_mode == TokenizerMode.PARITY:
+        await _check_parity("detokenize", prompt, _server_detokenize(tokens, model))
+    return prompt
 
-async def _tokenize_and_detokenize(input_payload: dict, model_name: str, eos_token_id: int = 128009, add_generation_prompt: bool = True) -> tuple[str, int]:
-    async with httpx.AsyncClient() as http_client:
-        logger.info(f"Tokenizing at: {BASE_URL}/tokenize")
-        tokenize_response = await http_client.post(url=f"{BASE_URL}/tokenize", json=input_payload)
-        tokenize_response.raise_for_status()
-        token_list: list[int] = tokenize_response.json()["tokens"]
 
-        if "llama-3" in model_name.lower() and not add_generation_prompt:
-            last_eot_index = max((index for index, value in enumerate(token_list) if value == eos_token_id), default=None)
-            if last_eot_index is not None:
-                token_list = token_list[:last_eot_index]
+async def _tokens_to_prompt(token_list: list[int], load_model_config: dict, add_generation_prompt: bool = True) -> tuple[str, list[int]]:
+    metadata = await model_metadata_cache.get(load_model_config)
+    if metadata.trim_to_last_eos and not add_generation_prompt:
+        last_eot_index = max((index for index, value in enumerate(token_list) if value == metadata.eos_token_id), default=None)
+        if last_eot_index is not None:
+            token_list = token_list[:last_eot_index]
 
-        detokenize_response = await http_client.post(url=f"{BASE_URL}/detokenize", json={"tokens": token_list, "model": model_name})
-        detokenize_response.raise_for_status()
-        prompt = detokenize_response.json()["prompt"]
-        return prompt, len(token_list)
+    prompt = await _detokenize(token_list, load_model_config)
+    return prompt, token_list
 
 
-async def _chat_to_prompt(messages: list[dict], model_name: str, eos_token_id: int = 128009, add_generation_prompt: bool = True) -> tuple[str, int]:
-    input_payload = {"model": model_name, "messages": messages}
-    return await _tokenize_and_detokenize(input_payload, model_name, eos_token_id, add_generation_prompt)
+async def _chat_to_prompt(messages: list[dict], load_model_config: dict, add_generation_prompt: bool = True) -> tuple[str, int]:
+    metadata = await model_metadata_cache.get(load_model_config)
+    key = ("prompt", load_model_config["model"], metadata.eos_token_id, add_generation_prompt, prompt_cache_module.messages_hash(messages))
+    cached = prompt_cache.get(key)
+    metrics.prompt_cache_lookups_total.inc(result="miss" if cached is None else "hit")
+    if cached is not None:
+        return cached.prompt, len(cached.token_ids)
 
+    token_list = await _tokenize_chat(messages, load_model_config)
+    prompt, token_list = await _tokens_to_prompt(token_list, load_model_config, add_generation_prompt)
+    prompt_cache.put(key, prompt, token_list)
+    return prompt, len(token_list)
 
-async def _completions_to_prompt(prompt: str, model_name: str, eos_token_id: int = 128009, add_generation_prompt: bool = True) -> tuple[str, int]:
-    input_payload = {"model": model_name, "prompt": prompt}
-    return await _tokenize_and_detokenize(input_payload, model_name, eos_token_id, add_generation_prompt)
+
+async def _completions_to_prompt(prompt: str, load_model_config: dict, add_generation_prompt: bool = True) -> tuple[str, int]:
+    token_list = await _tokenize(prompt, load_model_config, add_special_tokens=True)
+    prompt, token_list = await _tokens_to_prompt(token_list, load_model_config, add_generation_prompt)
+    return prompt, len(token_list)
 
 
 async def make_api_call(
     payload: dict,
     endpoint: str,
+    size: int = 1,
 ) -> dict:
-    async with httpx.AsyncClient(timeout=20) as client:
-        response = await client.post(endpoint, json=payload)
-        return response.json()
+    """`size` is the number of prompt tokens the call is timed by, for calls whose time depends on their prompts"""
+    client = http_clients.client(LLM_UPSTREAM)
+    with _upstream_call(endpoint.removeprefix(BASE_URL), default_timeout=20, size=size) as timeout:
+        response = await client.post(endpoint, json=payload, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
 
 
 async def calculate_distance_for_token(
@@ -116,8 +210,7 @@ async def calculate_distance_for_token(
         messages = [elm.model_dump() for elm in llm_request.messages]
         prompt, _ = await _chat_to_prompt(
             messages=messages,
-            model_name=task_config.load_model_config["model"],
-            eos_token_id=task_config.load_model_config.get("eos_token_id", 128009),
+            load_model_config=task_config.load_model_config,
             add_generation_prompt=starting_assistant_message,
         )
     elif isinstance(llm_request, models.CompletionRequestModel):
@@ -134,14 +227,9 @@ async def calculate_distance_for_token(
         "logprobs": llm_request.number_of_logprobs,
         "add_special_tokens": False
     }
-    try:
+    # If the llm_server fails us the check fails too, it says nothing about the miner's response
+    with tracing.span("distance_for_token", index=index):
         validator_checking_response = await make_api_call(completions_payload, endpoint=f"{BASE_URL}/v1/completions")
-    except json.JSONDecodeError as e:
-        logger.error(f"Error decoding JSON in calculate_distance_for_token: {e}. Response: {validator_checking_response}")
-        return 1
-    except httpx.RequestError as e:
-        logger.error(f"Request failed in calculate_distance_for_token: {e}")
-        return 1
 
     text = chat_responses[index].content
     validator_log_probs_for_token = validator_checking_response["choices"][0]["logprobs"]["top_logprobs"][0]
@@ -158,13 +246,103 @@ async def calculate_distance_for_token(
     return distance
 
 
-async def check_text_result(result: models.QueryResult, payload: dict, task_config: models.OrchestratorServerConfig) -> Union[float, None]:
+def _request_for_index(
+    llm_request: Union[models.ChatRequestModel, models.CompletionRequestModel],
+    messages: List[models.MessageResponse],
+    index: int,
+) -> tuple[Union[models.ChatRequestModel, models.CompletionRequestModel], bool]:
+    """
+    The request to check the token at `index` with: the original one, continued with the response up to that token.
+    Also returns whether it starts the assistant message.
+    """
+    response_so_far = "".join([message.content for message in messages[:index]])
+    if isinstance(llm_request, models.CompletionRequestModel):
+        return llm_request.model_copy(update={"prompt": llm_request.prompt + response_so_far}), False
+
+    if index == 0:
+        return llm_request, True
+    assistant_message = models.Message(role="assistant", content=response_so_far)
+    return llm_request.model_copy(update={"messages": [*llm_request.messages, assistant_message]}), False
+
+
+async def _multi_pass_distances(
+    task_config: models.OrchestratorServerConfig,
+    payload: dict,
+    messages: List[models.MessageResponse],
+    indices_to_check: List[int],
+    is_completions_payload: bool,
+    fan_out: asyncio.Semaphore,
+) -> List[float]:
+    """Distance of each checked token, asking the llm_server for the top logprobs at each index"""
+    request_overrides = {"starting_assistant_message": True, "number_of_logprobs": DISTANCE_CHECK_TOP_K, "top_k": DISTANCE_CHECK_TOP_K, "max_tokens": 1}
+    if is_completions_payload:
+        llm_request = models.CompletionRequestModel(**{**payload, **request_overrides})
+    else:
+        llm_request = models.ChatRequestModel(**{**payload, **request_overrides})
+
+    async def _distance_for_index(index: int) -> float:
+        index_request, starting_assistant_message = _request_for_index(llm_request, messages, index)
+        async with fan_out:
+            return await calculate_distance_for_token(task_config, index_request, messages, index, starting_assistant_message)
+
+    return list(await asyncio.gather(*[_distance_for_index(index) for index in indices_to_check]))
+
+
+def _single_pass_distance(logprobs: dict | None, message: models.MessageResponse) -> float:
+    """
+    The distance `calculate_distance_for_token` would find, from the prompt logprobs at the token's position.
+    Those are the full distribution, so keep the top k and renormalise, as the top_k sampling of the multi pass does.
+    """
+    top_logprobs = [logprob for logprob in (logprobs or {}).values() if logprob["rank"] <= DISTANCE_CHECK_TOP_K]
+    if not top_logprobs:
+        return 1
+    normaliser = _logsumexp([logprob["logprob"] for logprob in top_logprobs])
+    for logprob in top_logprobs:
+        if logprob.get("decoded_token") == message.content:
+            return abs(math.exp(logprob["logprob"] - normaliser) - math.exp(message.logprob))
+
+    logger.info(f"token: {message.content} - not found in the top {DISTANCE_CHECK_TOP_K} prompt logprobs")
+    return 1
+
+
+def _single_pass_distances(prompt_logprobs: List[dict | None], messages: List[models.MessageResponse], indices_to_check: List[int]) -> List[float]:
+    """
+    Distance of each checked token, from the prompt logprobs of the response we already have.
+    Assumes each streamed message is one token, as the prompt logprobs check above does.
+    """
+    return [_single_pass_distance(prompt_logprobs[index] if index < len(prompt_logprobs) else None, messages[index]) for index in indices_to_check]
+
+
+def _compare_single_pass(multi_pass_distances: List[float], single_pass_distances: List[float], indices_to_check: List[int]) -> None:
+    multi_pass_score = _score_average_distance(sum(multi_pass_distances) / len(multi_pass_distances))
+    single_pass_score = _score_average_distance(sum(single_pass_distances) / len(single_pass_distances))
+    metrics.text_verification_score_difference.observe(abs(multi_pass_score - single_pass_score))
+    if abs(multi_pass_score - single_pass_score) > SINGLE_PASS_SCORE_TOLERANCE:
+        logger.warning(
+            f"Single pass score {single_pass_score} differs from multi pass score {multi_pass_score}. "
+            f"Indexes: {indices_to_check}, multi pass distances: {multi_pass_distances}, single pass distances: {single_pass_distances}"
+        )
+
+
+def _logsumexp(values: List[float]) -> float:
+    largest = max(values)
+    if largest == float("-inf"):
+        return largest
+    return largest + math.log(sum(math.exp(value - largest) for value in values))
+
+
+def _extract_messages(result: models.QueryResult, is_completions_payload: bool) -> list[models.MessageResponse] | None:
+    """Messages & logprobs of a miner's response, or None if it's unusable"""
+    if isinstance(result.formatted_response, models.PackedTextResponse):
+        messages = result.formatted_response.messages()
+        if not messages:
+            logger.error("No valid messages in response.")
+            return None
+        return messages
+
     formatted_response = json.loads(result.formatted_response) if isinstance(result.formatted_response, str) else result.formatted_response
-    eos_token_id = task_config.load_model_config.get("eos_token_id", 128009)
 
-    # Extract messages & logprobs from the response
     messages: list[models.MessageResponse] = []
-    is_completions_payload = _payload_is_completions(payload)
     for idx, response in enumerate(formatted_response):
         try:
             # If `prompt` is in the payload, treat it as a /completions request
@@ -178,128 +356,209 @@ async def check_text_result(result: models.QueryResult, payload: dict, task_conf
         except Exception as e:
             logger.error(f"Error with logprob: {e}. Response: {response}")
             logger.exception(e)
-            return 0  # Important to return 0 as this is a critical error
+            return None  # Important to score 0 as this is a critical error
 
     if not messages:
         logger.error("No valid messages in response.")
         logger.exception(formatted_response)
-        return 0.0
+        return None
 
-    if len(messages) > payload["max_tokens"]:
-        logger.error("Number of messages is greater than max_tokens, skipping logprob check, returning 0")
-        return 0.0
+    return messages
 
-    full_response_content = "".join([message.content for message in messages])
-    number_of_output_tokens = len(messages)
 
-    # Now get the combined input + output in `prompt` format
+async def _input_prompt(payload: dict, load_model_config: dict, is_completions_payload: bool) -> tuple[str, int, str | None]:
+    """The input in `prompt` format, its number of tokens, and for completions the eos token"""
     if is_completions_payload:
         input_completions_content = payload[PROMPT_KEY]
+        input_tokens, metadata = await asyncio.gather(
+            _tokenize(input_completions_content, load_model_config, add_special_tokens=False),
+            model_metadata_cache.get(load_model_config),
+        )
+        return input_completions_content, len(input_tokens), metadata.eos_token
 
-        input_tokens = await _tokenize(input_completions_content, task_config.load_model_config["model"], add_special_tokens=False)
-        input_content, num_input_tokens = input_completions_content, len(input_tokens)
-        eos_token = await _detokenize([eos_token_id], task_config.load_model_config["model"])
+    input_content, num_input_tokens = await _chat_to_prompt(payload[MESSAGES_KEY], load_model_config, add_generation_prompt=True)
+    return input_content, num_input_tokens, None
 
-        if number_of_output_tokens != payload["max_tokens"] and messages[-1] != eos_token:
+
+async def _full_prompt(
+    messages: list[models.MessageResponse],
+    payload: dict,
+    load_model_config: dict,
+    input_content: str,
+    eos_token: str | None,
+    eos_token_id: int,
+    is_completions_payload: bool,
+    complete: bool = True,
+) -> tuple[str, list[int]]:
+    """
+    The combined input + output in `prompt` format, and its tokens.
+    The eos token is only added to `complete` responses, not to the start of one that's still streaming in.
+    """
+    full_response_content = "".join([message.content for message in messages])
+    number_of_output_tokens = len(messages)
+
+    if is_completions_payload:
+        if complete and number_of_output_tokens != payload["max_tokens"] and messages[-1] != eos_token:
             full_prompt = input_content + full_response_content + eos_token
-        else:    
+        else:
             full_prompt = input_content + full_response_content
 
-        all_tokens = await _tokenize(full_prompt, task_config.load_model_config["model"], add_special_tokens=False)
+        all_tokens = await _tokenize(full_prompt, load_model_config, add_special_tokens=False)
+        return full_prompt, all_tokens
 
-    else:
-        input_chat_content = payload[MESSAGES_KEY]
-        input_content, num_input_tokens = await _chat_to_prompt(input_chat_content, task_config.load_model_config["model"], eos_token_id, add_generation_prompt=True)
-        full_prompt_before_eos = input_content + full_response_content
-        all_tokens = await _tokenize(full_prompt_before_eos, task_config.load_model_config["model"], add_special_tokens=True)
+    full_prompt_before_eos = input_content + full_response_content
+    all_tokens = await _tokenize(full_prompt_before_eos, load_model_config, add_special_tokens=True)
+
+    # Make sure the last token is eos token where necessary, so we can check it with prompt logprobs
+    if complete and number_of_output_tokens != payload["max_tokens"] and all_tokens[-1] != eos_token_id:
+        all_tokens.append(eos_token_id)
 
-        # Make sure the last token is eos token where necessary, so we can check it with prompt logprobs
-        if number_of_output_tokens != payload["max_tokens"] and all_tokens[-1] != eos_token_id:
-            all_tokens.append(eos_token_id)
+    full_prompt = await _detokenize(all_tokens, load_model_config)
+    return full_prompt, all_tokens
 
-        full_prompt = await _detokenize(all_tokens, task_config.load_model_config["model"])
 
-    # Now get the prompt logprobs from completions and check they are all correct
+async def _fetch_prompt_logprobs(full_prompts: list[tuple[str, list[int]]], payload: dict, load_model_config: dict) -> list[list[dict | None] | None]:
+    """
+    Prompt logprobs of each (full prompt, its tokens), from one (batched if there are several) completions request.
+    The llm_server rejects a whole batch for one bad prompt, so a rejected batch is retried a prompt at a time.
+    Prompts it still rejects get None, to be left unscored like prompts that are too long.
+    """
     # TODO: in future if upgrading from vllm 0.6.3, remember to set `add_special_tokens = False` due to "second bos" issue
     completions_payload = {
-        "prompt": full_prompt,
-        "model": task_config.load_model_config["model"],
+        "prompt": full_prompts[0][0] if len(full_prompts) == 1 else [full_prompt for full_prompt, _ in full_prompts],
+        "model": load_model_config["model"],
         "temperature": payload["temperature"],
         "max_tokens": 1,
         "prompt_logprobs": 10,
         "add_special_tokens": False
     }
 
+    number_of_tokens = sum(len(all_tokens) for _, all_tokens in full_prompts)
     try:
-        result = await make_api_call(completions_payload, endpoint=f"{BASE_URL}/v1/completions")
-    except (httpx.RequestError, json.JSONDecodeError) as e:
-        logger.exception(e)
-        logger.error(f"API call failed: {e}")
-        return 0.0
-
-    prompt_logprobs = result["choices"][0]["prompt_logprobs"][num_input_tokens:]
-
-    bad_token_found = False
-
-    fail_reason = ""
-
-    failed_tokens_idx = []
-    failed_tokens_details = []
-
-    for idx, response_token, logprobs in zip(range(len(all_tokens[num_input_tokens:])), all_tokens[num_input_tokens:], prompt_logprobs):
-        # Just a helper for nicer printing
-        nice_logprobs = json.dumps(logprobs, indent=2, sort_keys=True, ensure_ascii=False)
-
-        # The edge case here is when the messages didn't include the end of token
-        # So sometimes we don't have a message for the last token
-        additional_log = f" (decoded: '{messages[idx].content}', logprob: {messages[idx].logprob})" if idx <= len(messages) - 1 else ""
-
-        if str(response_token) in logprobs:
-            logprob = logprobs[str(response_token)]["logprob"]
-            rank = logprobs[str(response_token)]["rank"]
-
-            if rank < 10 and logprob > float("-inf"):
-                logger.info(f"Token {response_token} {additional_log} in logprobs with good behaviour; rank: {rank}, logprob: {logprob} ✅")
-            else:
-                logger.error(f"Token {response_token} {additional_log} in logprobs with bad behaviour; rank: {rank}, logprob: {logprob} ❌")
-                failed_tokens_idx.append(idx)
-                failed_tokens_details.append((response_token, rank, logprob, additional_log))
-
-                if len(failed_tokens_idx) > 3:
-                    failed_tokens_details = json.dumps(failed_tokens_details, indent=2, sort_keys=True, ensure_ascii=False)
-                    fail_reason = f"Too many bad tokens found ('response_token', 'rank', 'logprob', 'additional_log'):\n{failed_tokens_details}"
-                    bad_token_found = True
-                    break
-        else:
-            logger.error(f"Token {response_token} {additional_log} not found in logprobs :(")
-            bad_token_found = True
-            break
-
+        with tracing.span("prompt_logprobs", number_of_tokens=number_of_tokens, number_of_prompts=len(full_prompts)):
+            # Timed by the prompts' size, so they don't share their timeouts with the 1 token distance checks
+            result = await make_api_call(completions_payload, endpoint=f"{BASE_URL}/v1/completions", size=number_of_tokens)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code != 400:
+            raise
+        if len(full_prompts) == 1:
+            logger.warning(f"The llm_server rejected a prompt, not scoring it: {e.response.text}")
+            return [None]
+        logger.warning(f"The llm_server rejected a batch of {len(full_prompts)} prompts, fetching them one at a time: {e.response.text}")
+        per_prompt = await asyncio.gather(*[_fetch_prompt_logprobs([full_prompt], payload, load_model_config) for full_prompt in full_prompts])
+        return [prompt_logprobs for [prompt_logprobs] in per_prompt]
+
+    choices = sorted(result["choices"], key=lambda choice: choice.get("index", 0))
+    return [choice["prompt_logprobs"] for choice in choices]
+
+
+def _token_columns(
+    response_tokens: list[int], prompt_logprobs: list[dict | None], eos_token_id: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The rank & logprob of each response token in the prompt logprobs at its position (rank -1 if it isn't there),
+    and the logprob of the eos token at each position (-inf if it isn't there)
+    """
+    ranks = np.full(len(response_tokens), -1, dtype=np.int64)
+    logprobs = np.full(len(response_tokens), -np.inf)
+    eos_logprobs = np.full(len(response_tokens), -np.inf)
+    eos_key = str(eos_token_id)
+    for idx, (response_token, position_logprobs) in enumerate(zip(response_tokens, prompt_logprobs)):
+        position_logprobs = position_logprobs or {}
+        entry = position_logprobs.get(str(response_token))
+        if entry is not None:
+            ranks[idx] = entry["rank"]
+            logprobs[idx] = entry["logprob"]
+        eos_entry = position_logprobs.get(eos_key)
+        if eos_entry is not None:
+            eos_logprobs[idx] = eos_entry["logprob"]
+    return ranks, logprobs, eos_logprobs
+
+
+def _describe_token(idx: int, response_token: int, messages: list[models.MessageResponse]) -> str:
+    # The edge case here is when the messages didn't include the end of token
+    # So sometimes we don't have a message for the last token
+    additional_log = f" (decoded: '{messages[idx].content}', logprob: {messages[idx].logprob})" if idx <= len(messages) - 1 else ""
+    return f"Token {response_token} {additional_log}"
+
+
+class _TokenVerifier:
+    """
+    Checks response tokens against the validator's prompt logprobs, a run of tokens at a time, so a response can be
+    checked in pieces as it arrives. Remembers the poorly ranked tokens so far: more than MAX_BAD_TOKENS fail it.
+    """
+
+    def __init__(self, eos_token_id: int):
+        self.eos_token_id = eos_token_id
+        self.failed_tokens_idx: list[int] = []
+        self.failed_tokens_details: list[tuple] = []
+
+    def verify(self, start: int, response_tokens: list[int], prompt_logprobs: list[dict | None], messages: list[models.MessageResponse]) -> bool:
+        """Check `response_tokens[start:]`, with the prompt logprobs at the same positions. False if the response fails"""
+        tokens = response_tokens[start : start + max(len(prompt_logprobs) - start, 0)]
+        if not tokens:
+            return True
+        ranks, logprobs, eos_logprobs = _token_columns(tokens, prompt_logprobs[start:], self.eos_token_id)
+
+        found = ranks >= 0
+        bad_rank = found & ~((ranks < 10) & (logprobs > -np.inf))
+        too_many_bad = np.cumsum(bad_rank) > MAX_BAD_TOKENS - len(self.failed_tokens_idx)
         # If you could've stopped, why didnt you?
-        if str(eos_token_id) in logprobs and str(response_token) != str(eos_token_id):
-            logprob = logprobs[str(eos_token_id)]["logprob"]
-            response_logprob = logprobs[str(response_token)]["logprob"]
-            if logprob > float("-inf") and math.exp(logprob) / math.exp(response_logprob) > 100:
-                fail_reason = "You really went out your way to avoid stopping!"
-                bad_token_found = True
-                break
-
-    if bad_token_found:
-        # TODO: Make a nice message
-        logger.error(f"Bad token (s) found at indexes {failed_tokens_idx}." f" Prompt logprobs: {nice_logprobs}" f" Reason: {fail_reason}")
-        return 0.0
+        with np.errstate(invalid="ignore"):
+            avoided_stop = (
+                found
+                & (np.asarray(tokens) != self.eos_token_id)
+                & (eos_logprobs > -np.inf)
+                & (eos_logprobs - logprobs > math.log(AVOIDED_STOP_RATIO))
+            )
+        failing = ~found | too_many_bad | avoided_stop
+
+        checked = len(tokens) if not failing.any() else int(np.argmax(failing)) + 1
+        for offset in np.flatnonzero(bad_rank[:checked]).tolist():
+            idx = start + offset
+            logger.error(f"{_describe_token(idx, tokens[offset], messages)} in logprobs with bad behaviour; rank: {ranks[offset]}, logprob: {logprobs[offset]} ❌")
+            self.failed_tokens_idx.append(idx)
+            self.failed_tokens_details.append((tokens[offset], int(ranks[offset]), float(logprobs[offset]), _describe_token(idx, tokens[offset], messages)))
+        if checked == len(tokens) and not failing[-1]:
+            return True
+
+        offset = checked - 1
+        if not found[offset]:
+            fail_reason = f"{_describe_token(start + offset, tokens[offset], messages)} not found in logprobs :("
+        elif too_many_bad[offset]:
+            failed_tokens_details = json.dumps(self.failed_tokens_details, indent=2, sort_keys=True, ensure_ascii=False)
+            fail_reason = f"Too many bad tokens found ('response_token', 'rank', 'logprob', 'additional_log'):\n{failed_tokens_details}"
+        else:
+            fail_reason = "You really went out your way to avoid stopping!"
+        # Just a helper for nicer printing
+        nice_logprobs = json.dumps(prompt_logprobs[start + offset], indent=2, sort_keys=True, ensure_ascii=False)
+        logger.error(f"Bad token (s) found at indexes {self.failed_tokens_idx}." f" Prompt logprobs: {nice_logprobs}" f" Reason: {fail_reason}")
+        return False
+
+
+def _verify_prompt_logprobs(
+    response_tokens: list[int],
+    prompt_logprobs: list[dict],
+    messages: list[models.MessageResponse],
+    eos_token_id: int,
+) -> list[int] | None:
+    """Check every response token against the validator's prompt logprobs. Returns the indexes of poorly ranked tokens, or None if the response fails"""
+    verifier = _TokenVerifier(eos_token_id)
+    if not verifier.verify(0, response_tokens, prompt_logprobs, messages):
+        return None
 
-    logger.info("All tokens found in prompt_logprobs! ✅")
+    logger.info(f"All {min(len(response_tokens), len(prompt_logprobs))} tokens found in prompt_logprobs! ✅")
+    return verifier.failed_tokens_idx
 
-    # Now lets do some fine grained checking
 
+def _indices_to_check(messages: list[models.MessageResponse], failed_tokens_idx: list[int]) -> list[int]:
     if len(messages) == 1:
         indices_to_check = [0]
     else:
         # Always check first & last
         indices_to_check = [0, len(messages) - 1] + failed_tokens_idx
 
-        number_of_additional_indices_to_check = min(5 - len(indices_to_check), len(messages) - 2) 
+        number_of_additional_indices_to_check = min(5 - len(indices_to_check), len(messages) - 2)
         additional_indices_to_check = random.sample(
             range(1, len(messages) - 1),
             number_of_additional_indices_to_check,
@@ -308,54 +567,300 @@ async def check_text_result(result: models.QueryResult, payload: dict, task_conf
 
     logger.info(f"failed token indexes : {failed_tokens_idx}")
     logger.info(f"logprobs indexes to check : {indices_to_check}")
+    return indices_to_check[:MAX_DISTANCE_CHECKS]
+
+
+async def _distances(
+    task_config: models.OrchestratorServerConfig,
+    payload: dict,
+    messages: list[models.MessageResponse],
+    prompt_logprobs: list[dict],
+    indices_to_check: list[int],
+    is_completions_payload: bool,
+    fan_out: asyncio.Semaphore,
+) -> list[float]:
+    if settings.text_verification_mode == TextVerificationMode.SINGLE_PASS:
+        return _single_pass_distances(prompt_logprobs, messages, indices_to_check)
 
-    total_distance = 0
-    checks = 0
+    distances = await _multi_pass_distances(task_config, payload, messages, indices_to_check, is_completions_payload, fan_out)
+    if settings.text_verification_mode == TextVerificationMode.COMPARE:
+        _compare_single_pass(distances, _single_pass_distances(prompt_logprobs, messages, indices_to_check), indices_to_check)
+    return distances
 
-    # Prepare request for token validation
-    payload["starting_assistant_message"] = True
-    payload["number_of_logprobs"] = 5
-    payload["top_k"] = 5
 
-    if is_completions_payload:
-        llm_request = models.CompletionRequestModel(**payload)
-        llm_request.max_tokens = 1
-    else:
-        llm_request = models.ChatRequestModel(**payload)
-        llm_request.max_tokens = 1
+def _sampling_order(messages: list[models.MessageResponse], failed_tokens_idx: list[int], max_checks: int) -> list[int]:
+    """Indexes to check, in order: the poorly ranked tokens, first & last, then random others"""
+    order = [index for index in dict.fromkeys([*failed_tokens_idx, 0, len(messages) - 1]) if index < len(messages)]
+    others = [index for index in range(1, len(messages) - 1) if index not in order]
+    order.extend(random.sample(others, min(len(others), max(max_checks - len(order), 0))))
+    return order[:max_checks]
 
-    for index in indices_to_check:
-        if checks >= 5:
-            break
 
-        if is_completions_payload:
-            text_to_inject_for_checking = "".join([i.content for i in messages[:index]])
-            llm_request.prompt += text_to_inject_for_checking
-            starting_assistant_message = False
-        else:
-            starting_assistant_message = index == 0
-            if index > 0:
-                text_to_inject_into_assistant_message = "".join([i.content for i in messages[:index]])
-                llm_request.messages.append(
-                    models.Message(
-                        **{
-                            "role": "assistant",
-                            "content": text_to_inject_into_assistant_message,
-                        }
-                    )
-                )
-        distance = await calculate_distance_for_token(task_config, llm_request, messages, index, starting_assistant_message)
-        checks += 1
-        total_distance += distance
-        if index != 0 and is_completions_payload:
-            llm_request.prompt = llm_request.prompt[: (len(llm_request.prompt) - len(text_to_inject_for_checking))]
-        elif index != 0 and not is_completions_payload:
-            llm_request.messages = llm_request.messages[:-1]
+def _confidence_radius(sampling: models.DistanceSamplingConfig, checks: int) -> float:
+    """Sub-Gaussian bound on how far the average of `checks` distances is from the mean, union bounded over the `max_checks` looks"""
+    return sampling.sub_gaussian_scale * math.sqrt(2 * math.log(2 * sampling.max_checks / sampling.error_rate) / checks)
+
+
+def _verdict_is_certain(distances: list[float], sampling: models.DistanceSamplingConfig) -> bool:
+    """
+    Whether the average distance is clearly under BOTTOM_TEXT_THRESHOLD or over TOP_TEXT_THRESHOLD, so more checks
+    can't change the score
+    """
+    average_distance = sum(distances) / len(distances)
+    radius = _confidence_radius(sampling, len(distances))
+    return average_distance + radius <= BOTTOM_TEXT_THRESHOLD or average_distance - radius >= TOP_TEXT_THRESHOLD
+
+
+async def _sequential_distances(
+    task_config: models.OrchestratorServerConfig,
+    payload: dict,
+    messages: list[models.MessageResponse],
+    prompt_logprobs: list[dict],
+    failed_tokens_idx: list[int],
+    is_completions_payload: bool,
+    fan_out: asyncio.Semaphore,
+) -> list[float]:
+    """Distances checked a token at a time (after the first `min_checks`), until the verdict is certain"""
+    sampling = task_config.distance_sampling
+    order = _sampling_order(messages, failed_tokens_idx, sampling.max_checks)
+    logger.info(f"failed token indexes : {failed_tokens_idx}")
+    logger.info(f"logprobs indexes to check, in order : {order}")
+
+    # Even distances of all 0s or all 1s can't be certain before the last check: check them all at once instead
+    if len(order) <= 1 or _confidence_radius(sampling, len(order) - 1) > 1 - TOP_TEXT_THRESHOLD:
+        return await _distances(task_config, payload, messages, prompt_logprobs, order, is_completions_payload, fan_out)
+
+    checked = min(sampling.min_checks, len(order))
+    distances = await _distances(task_config, payload, messages, prompt_logprobs, order[:checked], is_completions_payload, fan_out)
+    while checked < len(order) and not _verdict_is_certain(distances, sampling):
+        distances += await _distances(task_config, payload, messages, prompt_logprobs, order[checked : checked + 1], is_completions_payload, fan_out)
+        checked += 1
+    return distances
+
+
+async def _score_distances(
+    task_config: models.OrchestratorServerConfig,
+    payload: dict,
+    messages: list[models.MessageResponse],
+    prompt_logprobs: list[dict],
+    failed_tokens_idx: list[int],
+    is_completions_payload: bool,
+    fan_out: asyncio.Semaphore,
+) -> float:
+    """Fine grained checking: how close the miner's logprobs are to ours at a few tokens"""
+    if task_config.distance_sampling is not None:
+        distances = await _sequential_distances(task_config, payload, messages, prompt_logprobs, failed_tokens_idx, is_completions_payload, fan_out)
+    else:
+        indices_to_check = _indices_to_check(messages, failed_tokens_idx)
+        distances = await _distances(task_config, payload, messages, prompt_logprobs, indices_to_check, is_completions_payload, fan_out)
+    metrics.text_distance_checks.observe(len(distances))
+
+    total_distance = sum(distances)
+    checks = len(distances)
 
     try:
         average_distance = total_distance / checks
     except Exception as e:
         logger.error(f"Error with average distance: {e}. Total distance: {total_distance}. Checks: {checks}")
         return 0
-    score = _score_average_distance(average_distance)
-    return score
+    return _score_average_distance(average_distance)
+
+
+async def _check_text_responses(
+    results: list[models.QueryResult], payload: dict, task_config: models.OrchestratorServerConfig
+) -> list[float | None]:
+    """
+    Score each of several miner responses to the same payload. The input is templated & tokenised once,
+    and the prompt logprobs of all the responses come from a single completions request.
+    """
+    load_model_config = task_config.load_model_config
+    metadata = await model_metadata_cache.get(load_model_config)
+    eos_token_id = metadata.eos_token_id
+    is_completions_payload = _payload_is_completions(payload)
+
+    scores: list[float | None] = [None] * len(results)
+    messages_per_response: dict[int, list[models.MessageResponse]] = {}
+    for response_idx, result in enumerate(results):
+        messages = _extract_messages(result, is_completions_payload)
+        if messages is None:
+            scores[response_idx] = 0.0
+        elif len(messages) > payload["max_tokens"]:
+            logger.error("Number of messages is greater than max_tokens, skipping logprob check, returning 0")
+            scores[response_idx] = 0.0
+        else:
+            messages_per_response[response_idx] = messages
+    if not messages_per_response:
+        return scores
+
+    input_content, num_input_tokens, eos_token = await _input_prompt(payload, load_model_config, is_completions_payload)
+    full_prompts = await asyncio.gather(
+        *[
+            _full_prompt(messages, payload, load_model_config, input_content, eos_token, eos_token_id, is_completions_payload)
+            for messages in messages_per_response.values()
+        ]
+    )
+    # The llm_server would reject the whole request for a prompt with no room left for the 1 token it generates,
+    # so leave those unscored
+    too_long = {response_idx for response_idx, (_, all_tokens) in zip(messages_per_response, full_prompts) if len(all_tokens) >= metadata.max_model_len}
+    if too_long:
+        logger.warning(f"Responses {sorted(too_long)} need more than the {metadata.max_model_len} tokens the model takes, not scoring them")
+        full_prompts = [full_prompt for response_idx, full_prompt in zip(messages_per_response, full_prompts) if response_idx not in too_long]
+        messages_per_response = {response_idx: messages for response_idx, messages in messages_per_response.items() if response_idx not in too_long}
+        if not messages_per_response:
+            return scores
+
+    # Now get the prompt logprobs from completions and check they are all correct. If that fails, so does the check:
+    # scoring the responses 0 would blame the miners (and be memoised) for the llm_server's error
+    prompt_logprobs_per_response = await _fetch_prompt_logprobs(full_prompts, payload, load_model_config)
+
+    # The checks of all the responses are independent, so run them together; the llm_server batches them
+    fan_out = asyncio.Semaphore(settings.distance_check_fan_out)
+    distance_checks = {}
+    for (response_idx, messages), (_, all_tokens), prompt_logprobs in zip(messages_per_response.items(), full_prompts, prompt_logprobs_per_response):
+        if prompt_logprobs is None:
+            continue
+        prompt_logprobs = prompt_logprobs[num_input_tokens:]
+        failed_tokens_idx = _verify_prompt_logprobs(all_tokens[num_input_tokens:], prompt_logprobs, messages, eos_token_id)
+        if failed_tokens_idx is None:
+            scores[response_idx] = 0.0
+            continue
+        distance_checks[response_idx] = _score_distances(
+            task_config, payload, messages, prompt_logprobs, failed_tokens_idx, is_completions_payload, fan_out
+        )
+
+    for response_idx, score in zip(distance_checks, await asyncio.gather(*distance_checks.values())):
+        scores[response_idx] = score
+    return scores
+
+
+@checker(server_needed=models.ServerType.LLM)
+async def check_text_result(result: models.QueryResult, payload: dict, task_config: models.OrchestratorServerConfig) -> Union[float, None]:
+    scores = await _check_text_responses([result], payload, task_config)
+    return scores[0]
+
+
+@checker(server_needed=models.ServerType.LLM, batched=True)
+async def check_text_results(results: list[models.QueryResult], payload: dict, task_config: models.OrchestratorServerConfig) -> Dict[int, float]:
+    """Score many miners' responses to the same payload together, see `_check_text_responses`"""
+    scores = await _check_text_responses(results, payload, task_config)
+    return {result.node_id: score for result, score in zip(results, scores) if score is not None}
+
+
+class StreamingTextCheck:
+    """
+    A text check fed the miner's response chunk by chunk, as it's uploaded. New tokens are verified against the
+    prompt logprobs a window at a time (`verify_window` once `window_ready`), so a response that's already failed is rejected without waiting for (or
+    checking) the rest of it. Verification stops for good once the response fails.
+
+    Each window's prompt logprobs cover the whole response so far, so windows grow with it: a window is at least
+    `window_tokens` and at least as many tokens as were already verified. The llm_server then prefills about 2x
+    the response in total, rather than a quadratic amount in fixed size windows.
+    """
+
+    def __init__(self, payload: dict, task_config: models.OrchestratorServerConfig, window_tokens: int = settings.stream_check_window_tokens):
+        self.payload = payload
+        self.task_config = task_config
+        self.window_tokens = window_tokens
+        self.load_model_config = task_config.load_model_config
+        # From the model's metadata, looked up with the first window
+        self.eos_token_id: int | None = None
+        self.is_completions_payload = _payload_is_completions(payload)
+        self.messages: list[models.MessageResponse] = []
+        self.rejected = False
+
+        self._chunks_received = 0
+        self._verifier: _TokenVerifier | None = None
+        self._verified_tokens: list[int] = []
+        self._input: tuple[str, int, str | None] | None = None
+
+    @property
+    def tokens_verified(self) -> int:
+        return len(self._verified_tokens)
+
+    def _reject(self) -> bool:
+        self.rejected = True
+        return False
+
+    def add_chunk(self, chunk: dict) -> bool:
+        """Add the next chunk of the response. False once the response has failed"""
+        if self.rejected:
+            return False
+        try:
+            if self.is_completions_payload:
+                message = _extract_completions_message(self._chunks_received, chunk)
+            else:
+                message = _extract_chat_message(self._chunks_received, chunk)
+        except Exception as e:
+            logger.error(f"Error with logprob: {e}. Response: {chunk}")
+            return self._reject()  # Important to score 0 as this is a critical error
+        self._chunks_received += 1
+        if message is None:
+            return True
+
+        self.messages.append(message)
+        if len(self.messages) > self.payload["max_tokens"]:
+            logger.error("Number of messages is greater than max_tokens, stopping the logprob check, returning 0")
+            return self._reject()
+        return True
+
+    @property
+    def window_ready(self) -> bool:
+        """Whether enough new tokens are in to verify a window"""
+        # The last token can still change as more text arrives, so a window is verified once one more token is in
+        return not self.rejected and len(self.messages) - self.tokens_verified > max(self.window_tokens, self.tokens_verified)
+
+    async def verify_window(self) -> bool:
+        """Verify the tokens added since the last window. False if the response failed"""
+        await self._verify(complete=False)
+        return not self.rejected
+
+    async def _verify(self, complete: bool) -> list[dict | None] | None:
+        """Verify the tokens received since the last window. Returns the response's prompt logprobs, or None if it failed"""
+        if self._input is None:
+            metadata = await model_metadata_cache.get(self.load_model_config)
+            self.eos_token_id = metadata.eos_token_id
+            self._verifier = _TokenVerifier(self.eos_token_id)
+            self._input = await _input_prompt(self.payload, self.load_model_config, self.is_completions_payload)
+        input_content, num_input_tokens, eos_token = self._input
+        full_prompt, all_tokens = await _full_prompt(
+            self.messages, self.payload, self.load_model_config, input_content, eos_token, self.eos_token_id, self.is_completions_payload, complete
+        )
+        # Errors from the llm_server fail the check rather than rejecting the response
+        [prompt_logprobs] = await _fetch_prompt_logprobs([(full_prompt, all_tokens)], self.payload, self.load_model_config)
+        if prompt_logprobs is None:
+            raise ValueError("The llm_server rejected the response's prompt, it can't be checked")
+
+        response_tokens = all_tokens[num_input_tokens:]
+        if not complete:
+            response_tokens = response_tokens[:-1]
+        if response_tokens[: self.tokens_verified] != self._verified_tokens:
+            # The new text changed how the start of the response tokenises, so verify it all again
+            self._verifier = _TokenVerifier(self.eos_token_id)
+            self._verified_tokens = []
+
+        prompt_logprobs = prompt_logprobs[num_input_tokens:]
+        verified_up_to = min(len(response_tokens), len(prompt_logprobs))
+        if not self._verifier.verify(self.tokens_verified, response_tokens[:verified_up_to], prompt_logprobs, self.messages):
+            self._reject()
+            return None
+        self._verified_tokens = response_tokens[:verified_up_to]
+        return prompt_logprobs
+
+    async def finish(self) -> float:
+        """Verify the rest of the response once it's all in, then score it"""
+        if self.rejected:
+            return 0.0
+        if not self.messages:
+            logger.error("No valid messages in response.")
+            self._reject()
+            return 0.0
+
+        prompt_logprobs = await self._verify(complete=True)
+        if prompt_logprobs is None:
+            return 0.0
+        logger.info("All tokens found in prompt_logprobs! ✅")
+
+        fan_out = asyncio.Semaphore(settings.distance_check_fan_out)
+        return await _score_distances(
+            self.task_config, self.payload, self.messages, prompt_logprobs, self._verifier.failed_tokens_idx, self.is_completions_payload, fan_out
+        )
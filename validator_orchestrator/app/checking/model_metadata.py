@@ -0,0 +1,104 @@
+"""
+Facts about the loaded model that text checks need on every check: its eos token and its context length. They're looked up once per model, when the llm_server brings it up,
+instead of on every check, and forgotten when the container is swapped.
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, Hashable
+from loguru import logger
+from app.checking.tokenization import tokenizer_name
+from app.core.http_clients import http_clients
+from app.core import models
+from app.core import timeouts
+
+DEFAULT_EOS_TOKEN_ID = 128009
+DEFAULT_MAX_MODEL_LEN = 8000
+
+
+@dataclass(frozen=True)
+class ModelMetadata:
+    model: str
+    eos_token_id: int
+    eos_token: str
+    # Llama 3 templates end every message with the eos token, so prompts continuing a message are cut at the last one
+    trim_to_last_eos: bool
+    max_model_len: int
+
+
+def _eos_token_id(load_model_config: dict) -> int:
+    return load_model_config.get("eos_token_id", DEFAULT_EOS_TOKEN_ID)
+
+
+def _key(load_model_config: dict) -> Hashable:
+    return load_model_config["model"], tokenizer_name(load_model_config), _eos_token_id(load_model_config)
+
+
+async def _max_model_len(load_model_config: dict) -> int:
+    from app.checking.functions.text import BASE_URL
+
+    try:
+        with timeouts.upstream_call(models.ServerType.LLM.value, "/v1/models", default_timeout=5) as timeout:
+            response = await http_clients.client(models.ServerType.LLM.value).get(f"{BASE_URL}/v1/models", timeout=timeout)
+        response.raise_for_status()
+        for model in response.json()["data"]:
+            if model["id"] == load_model_config["model"] and model.get("max_model_len"):
+                return model["max_model_len"]
+    except Exception as e:
+        logger.warning(f"Couldn't get max_model_len from the llm_server, using the load config's: {e}")
+    return load_model_config.get("max_model_len") or DEFAULT_MAX_MODEL_LEN
+
+
+async def _build(load_model_config: dict) -> ModelMetadata:
+    from app.checking.functions import text
+
+    model = load_model_config["model"]
+    eos_id = _eos_token_id(load_model_config)
+    eos_token, max_model_len = await asyncio.gather(
+        text._detokenize([eos_id], load_model_config),
+        _max_model_len(load_model_config),
+    )
+
+    return ModelMetadata(
+        model=model,
+        eos_token_id=eos_id,
+        eos_token=eos_token,
+        trim_to_last_eos="llama-3" in model.lower(),
+        max_model_len=max_model_len,
+    )
+
+
+class ModelMetadataCache:
+    """Metadata of the models loaded since the last container swap"""
+
+    def __init__(self):
+        self._metadata: Dict[Hashable, ModelMetadata] = {}
+        self._lock = asyncio.Lock()
+
+    async def _refresh(self, load_model_config: dict) -> ModelMetadata:
+        metadata = await _build(load_model_config)
+        self._metadata[_key(load_model_config)] = metadata
+        logger.info(f"Model metadata: {metadata}")
+        return metadata
+
+    async def build(self, load_model_config: dict) -> ModelMetadata:
+        """Look the model's metadata up (again), the llm_server must be serving it"""
+        async with self._lock:
+            return await self._refresh(load_model_config)
+
+    async def get(self, load_model_config: dict) -> ModelMetadata:
+        metadata = self._metadata.get(_key(load_model_config))
+        if metadata is not None:
+            return metadata
+        # Normally built when the server started, but the server may have been up before we were
+        async with self._lock:
+            metadata = self._metadata.get(_key(load_model_config))
+            if metadata is None:
+                metadata = await self._refresh(load_model_config)
+        return metadata
+
+    def invalidate(self) -> None:
+        self._metadata.clear()
+
+
+model_metadata_cache = ModelMetadataCache()
@@ -0,0 +1,139 @@
+"""
+Cache of chat prompts built from chat templates, bounded by the memory its entries take.
+
+Two kinds of entries are kept:
+- the final prompt & token ids `_chat_to_prompt` builds, keyed by (model, eos id, add_generation_prompt, messages hash),
+  so the same conversation is only templated & tokenised once;
+- with in-process tokenizers, the rendered template & token ids of each conversation without a generation prompt,
+  keyed by (tokenizer, messages hash). A longer conversation starting with a cached one only tokenises what was added.
+"""
+
+import hashlib
+import json
+import sys
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable, List
+from app.checking.tokenization import LocalTokenizer
+from app.core import metrics
+from app.settings import settings
+
+# Rough bytes per entry on top of its prompt & token ids: the key, the entry & the LRU bookkeeping
+_ENTRY_OVERHEAD_BYTES = 400
+
+
+@dataclass(frozen=True)
+class CachedPrompt:
+    prompt: str
+    token_ids: array
+
+    @property
+    def size_bytes(self) -> int:
+        return sys.getsizeof(self.prompt) + sys.getsizeof(self.token_ids) + _ENTRY_OVERHEAD_BYTES
+
+
+def messages_prefix_hashes(messages: list[dict]) -> List[str]:
+    """Hash of every prefix of the conversation: the i-th hash covers messages[: i + 1]"""
+    hashes = []
+    digest = hashlib.sha256()
+    for message in messages:
+        digest.update(json.dumps(message, sort_keys=True, separators=(",", ":")).encode())
+        digest.update(b"\0")
+        hashes.append(digest.copy().hexdigest())
+    return hashes
+
+
+def messages_hash(messages: list[dict]) -> str:
+    hashes = messages_prefix_hashes(messages)
+    return hashes[-1] if hashes else hashlib.sha256().hexdigest()
+
+
+class PromptCache:
+    """LRU cache of `CachedPrompt`s, holding at most `max_bytes` of them"""
+
+    def __init__(self, max_bytes: int = settings.prompt_cache_max_bytes):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries: OrderedDict[Hashable, CachedPrompt] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> CachedPrompt | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: Hashable, prompt: str, token_ids: list[int]) -> None:
+        entry = CachedPrompt(prompt=prompt, token_ids=array("I", token_ids))
+        if entry.size_bytes > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size_bytes -= previous.size_bytes
+        self._entries[key] = entry
+        self.size_bytes += entry.size_bytes
+        while self.size_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size_bytes -= evicted.size_bytes
+
+
+def _tokenize_after(tokenizer: LocalTokenizer, boundary_id: int, text: str) -> tuple[list[int], list[tuple[int, int]]] | None:
+    """
+    Token ids & offsets of `text` as it tokenises after the special token `boundary_id`, or None if it doesn't
+    tokenise as that token followed by the rest.
+
+    Tokenising the text after the cached prefix on its own isn't always the same as in the full prompt: SentencePiece
+    style tokenizers add a leading space to the start of the input, but not after a special token. So the special
+    token is tokenised again, together with the text after it.
+    """
+    boundary = tokenizer.detokenize([boundary_id])
+    token_ids, offsets = tokenizer.tokenize_with_offsets(boundary + text)
+    if not token_ids or token_ids[0] != boundary_id or offsets[0][1] != len(boundary):
+        return None
+    return token_ids[1:], [(start - len(boundary), end - len(boundary)) for start, end in offsets[1:]]
+
+
+def tokenize_chat(tokenizer: LocalTokenizer, messages: list[dict]) -> list[int]:
+    """
+    `tokenizer.tokenize_chat(messages)`, reusing the tokens of the longest cached start of the conversation.
+
+    Reuse is only safe when the cached text ends in a special token (like llama 3's <|eot_id|>): tokenizers split
+    on those before anything else, so the text after it tokenises the same with that token in front of it as it
+    does in the full prompt.
+    """
+    full_prompt = tokenizer.render_chat(messages, add_generation_prompt=True)
+    prefix_hashes = messages_prefix_hashes(messages)
+
+    token_ids: list[int] = []
+    offset = 0
+    suffix = None
+    for prefix_hash in reversed(prefix_hashes):
+        cached = prompt_cache.get(("template", tokenizer.name, prefix_hash))
+        if cached is not None and full_prompt.startswith(cached.prompt):
+            suffix = _tokenize_after(tokenizer, cached.token_ids[-1], full_prompt[len(cached.prompt) :])
+            if suffix is not None:
+                token_ids = cached.token_ids.tolist()
+                offset = len(cached.prompt)
+                metrics.prompt_cache_lookups_total.inc(result="prefix")
+            break
+
+    suffix_ids, suffix_offsets = suffix if suffix is not None else tokenizer.tokenize_with_offsets(full_prompt)
+    token_ids.extend(suffix_ids)
+
+    # Remember the conversation so far (without the generation prompt) for the conversations that continue it
+    conversation = tokenizer.render_chat(messages, add_generation_prompt=False) if messages else ""
+    if len(conversation) > offset and full_prompt.startswith(conversation):
+        conversation_end = len(conversation) - offset
+        conversation_suffix_length = sum(1 for _, token_end in suffix_offsets if token_end <= conversation_end)
+        if conversation_suffix_length and suffix_offsets[conversation_suffix_length - 1][1] == conversation_end:
+            conversation_ids = token_ids[: len(token_ids) - len(suffix_ids) + conversation_suffix_length]
+            if tokenizer.is_special(conversation_ids[-1]):
+                prompt_cache.put(("template", tokenizer.name, prefix_hashes[-1]), conversation, conversation_ids)
+
+    return token_ids
+
+
+prompt_cache = PromptCache()
@@ -0,0 +1,115 @@
+import asyncio
+from dataclasses import dataclass
+from importlib import metadata
+from typing import Any, Awaitable, Callable, Dict, List
+from loguru import logger
+from app.core import models
+
+# Other packages can add checking functions by declaring an entry point in this group,
+# pointing at a function decorated with `checker(...)`
+CHECKER_ENTRY_POINT_GROUP = "validator_orchestrator.checkers"
+
+CheckingFunction = Callable[[models.QueryResult, dict, models.OrchestratorServerConfig], Awaitable[float | None]]
+BatchedCheckingFunction = Callable[[List[models.QueryResult], dict, models.OrchestratorServerConfig], Awaitable[Dict[int, float]]]
+
+
+@dataclass(frozen=True)
+class CheckerProfile:
+    # None for checkers that only need the CPU, they run without waiting for a server swap
+    server_needed: models.ServerType | None
+    # How many of these checks can run at once, None for no limit
+    max_concurrency: int | None = None
+    # Batched checkers take all the responses of a request at once & return a score per node,
+    # others are called once per response
+    batched: bool = False
+
+
+def checker(server_needed: models.ServerType | None, max_concurrency: int | None = None, batched: bool = False):
+    """Declare the resources a checking function needs, so it can be registered"""
+
+    def decorator(func: CheckingFunction | BatchedCheckingFunction) -> CheckingFunction | BatchedCheckingFunction:
+        func.checker_profile = CheckerProfile(server_needed=server_needed, max_concurrency=max_concurrency, batched=batched)
+        return func
+
+    return decorator
+
+
+@dataclass
+class Checker:
+    name: str
+    func: CheckingFunction | BatchedCheckingFunction
+    profile: CheckerProfile
+    semaphore: asyncio.Semaphore | None = None
+
+    @property
+    def needs_server(self) -> bool:
+        return self.profile.server_needed is not None
+
+
+class UnknownCheckerError(KeyError):
+    pass
+
+
+class CheckerRegistry:
+    """
+    The checking functions we know about, built once at startup from `app.checking.functions`
+    and any `validator_orchestrator.checkers` entry points.
+    """
+
+    def __init__(self):
+        self._checkers: Dict[str, Checker] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._checkers
+
+    def load(self) -> None:
+        from app.checking import functions
+
+        self._checkers = {}
+        for name in functions.__all__:
+            self.register(name, getattr(functions, name))
+
+        for entry_point in metadata.entry_points(group=CHECKER_ENTRY_POINT_GROUP):
+            try:
+                self.register(entry_point.name, entry_point.load())
+            except Exception:
+                logger.exception(f"Could not load checking function from entry point {entry_point.value}")
+
+        logger.info(f"Registered checking functions: {self.profiles()}")
+
+    def register(self, name: str, func: Any) -> None:
+        profile = getattr(func, "checker_profile", None)
+        if not callable(func) or not isinstance(profile, CheckerProfile):
+            raise ValueError(f"{name} is not a checking function, decorate it with `checker(...)` to declare its profile")
+        if name in self._checkers:
+            logger.warning(f"Checking function {name} is registered twice, keeping the latest one")
+        semaphore = asyncio.Semaphore(profile.max_concurrency) if profile.max_concurrency is not None else None
+        self._checkers[name] = Checker(name=name, func=func, profile=profile, semaphore=semaphore)
+
+    def get(self, name: str) -> Checker:
+        try:
+            return self._checkers[name]
+        except KeyError:
+            raise UnknownCheckerError(f"Unknown checking function {name}") from None
+
+    def validate(self, task_config: models.OrchestratorServerConfig) -> None:
+        """Raise ValueError if the config asks for a checking function we can't run"""
+        if task_config.checking_function not in self._checkers:
+            raise ValueError(f"Unknown checking function {task_config.checking_function}. Known ones: {sorted(self._checkers)}")
+        profile = self._checkers[task_config.checking_function].profile
+        if profile.server_needed is not None and profile.server_needed != task_config.server_needed:
+            raise ValueError(
+                f"Checking function {task_config.checking_function} needs server {profile.server_needed.value}, "
+                f"not {task_config.server_needed.value}"
+            )
+
+    def needs_server(self, name: str) -> bool:
+        # Unknown functions are treated as needing a server, they fail once they're picked up
+        checker = self._checkers.get(name)
+        return checker is None or checker.needs_server
+
+    def profiles(self) -> Dict[str, CheckerProfile]:
+        return {name: checker.profile for name, checker in self._checkers.items()}
+
+
+checker_registry = CheckerRegistry()
@@ -0,0 +1,135 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict
+from loguru import logger
+from app.core import models
+from app.checking.registry import checker_registry
+from app.server_management import ServerKey, server_key
+
+# Checks whose checker only needs the CPU. They don't compete for the server, so they skip the queue
+CPU_ONLY_GROUP: ServerKey = ("cpu", None)
+
+
+@dataclass
+class _QueuedCheck:
+    task_id: str
+    request: models.CheckResultsRequest
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class AffinityScheduler:
+    """
+    Queue of pending checks, grouped by the server & model they need.
+
+    Checks for the group that is currently being served are handed out first, so a group is drained
+    before we pay for a container swap. To stop a busy group starving the others, once the oldest check
+    of another group has waited longer than `max_group_wait_seconds`, that group goes next.
+    Otherwise the next group is the one with the oldest waiting check.
+
+    Checks that need no server at all are cheap to run alongside the others, so they are handed out
+    straight away, without changing the group being served. So are checks whose server is already up
+    (`is_warm`) next to the one being served: groups that need no swap go oldest first.
+
+    Checks that run outside the queue (streamed ones) `reserve` a place in it while they run, so they count
+    against `max_size` like queued checks do.
+    """
+
+    def __init__(self, max_size: int, max_group_wait_seconds: float, is_warm: Callable[[ServerKey], bool] | None = None):
+        self._max_size = max_size
+        self._max_group_wait_seconds = max_group_wait_seconds
+        self._is_warm = is_warm or (lambda key: False)
+        self._groups: Dict[ServerKey, Deque[_QueuedCheck]] = {}
+        self._size = 0
+        self.reserved = 0
+        self._has_checks = asyncio.Event()
+        self.active_group: ServerKey | None = None
+
+    def qsize(self) -> int:
+        return self._size
+
+    def reserve(self) -> None:
+        """Take a place in the queue for a check that runs outside it, until `release`"""
+        if self._size + self.reserved >= self._max_size:
+            raise asyncio.QueueFull
+        self.reserved += 1
+
+    def release(self) -> None:
+        self.reserved -= 1
+
+    def put_nowait(self, task_id: str, request: models.CheckResultsRequest) -> None:
+        if self._size + self.reserved >= self._max_size:
+            raise asyncio.QueueFull
+        key = self._group_key(request)
+        self._groups.setdefault(key, deque()).append(_QueuedCheck(task_id=task_id, request=request))
+        self._size += 1
+        self._has_checks.set()
+
+    def put_many_nowait(self, checks: list[tuple[str, models.CheckResultsRequest]]) -> None:
+        """
+        Queue a batch of checks all-or-nothing. The batch is planned as a whole: its checks are
+        added group by group, so each group of the batch shares one container swap.
+        """
+        if self._size + self.reserved + len(checks) > self._max_size:
+            raise asyncio.QueueFull
+        planned: Dict[ServerKey, list[tuple[str, models.CheckResultsRequest]]] = {}
+        for task_id, request in checks:
+            planned.setdefault(self._group_key(request), []).append((task_id, request))
+        logger.info(f"Queueing batch of {len(checks)} checks in {len(planned)} groups: {[(key, len(group)) for key, group in planned.items()]}")
+        for group_checks in planned.values():
+            for task_id, request in group_checks:
+                self.put_nowait(task_id, request)
+
+    async def get(self) -> tuple[str, models.CheckResultsRequest]:
+        while self._size == 0:
+            self._has_checks.clear()
+            await self._has_checks.wait()
+
+        key = CPU_ONLY_GROUP if CPU_ONLY_GROUP in self._groups else self._next_group()
+        if key != self.active_group and key != CPU_ONLY_GROUP:
+            logger.info(f"Switching scheduled group from {self.active_group} to {key}. Queue depths: {self.group_depths()}")
+            self.active_group = key
+
+        group = self._groups[key]
+        queued_check = group.popleft()
+        if not group:
+            del self._groups[key]
+        self._size -= 1
+        return queued_check.task_id, queued_check.request
+
+    @staticmethod
+    def _group_key(request: models.CheckResultsRequest) -> ServerKey:
+        if not checker_registry.needs_server(request.server_config.checking_function):
+            return CPU_ONLY_GROUP
+        return server_key(request.server_config)
+
+    def _next_group(self) -> ServerKey:
+        now = time.monotonic()
+        oldest_key = min(self._groups, key=lambda key: self._groups[key][0].queued_at)
+        warm_keys = [key for key in self._groups if key == self.active_group or self._is_warm(key)]
+
+        if not warm_keys:
+            return oldest_key
+
+        oldest_wait = now - self._groups[oldest_key][0].queued_at
+        if oldest_key not in warm_keys and oldest_wait > self._max_group_wait_seconds:
+            logger.info(f"Group {oldest_key} has waited {oldest_wait:.0f}s, switching to it to avoid starving it")
+            return oldest_key
+
+        return min(warm_keys, key=lambda key: self._groups[key][0].queued_at)
+
+    def group_depths(self) -> Dict[ServerKey, int]:
+        return {key: len(group) for key, group in self._groups.items()}
+
+    def group_statuses(self) -> list[models.QueueGroupStatus]:
+        now = time.monotonic()
+        return [
+            models.QueueGroupStatus(
+                server_needed=server_needed,
+                model=model,
+                depth=len(group),
+                oldest_wait_seconds=now - group[0].queued_at,
+            )
+            for (server_needed, model), group in self._groups.items()
+        ]
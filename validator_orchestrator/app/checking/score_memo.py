@@ -0,0 +1,94 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Tuple
+from app.core import metrics
+from app.core import models
+from app.settings import settings
+
+
+def request_key(request: models.CheckResultsRequest) -> str:
+    """
+    Hash of everything that decides a check's score: the server config, the payload & the miner's response.
+    Which node answered and how quickly, and how long the check may take, don't change the score, so they're
+    left out (unless the request has several responses: their scores are keyed by node).
+    """
+    canonical = request.model_dump(mode="json", exclude={"result": {"node_id", "response_time"}, "timeout_seconds": True, "deadline": True})
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def result_for_request(result: models.TaskResult, request: models.CheckResultsRequest) -> models.TaskResult:
+    """A fresh copy of a memoised result, with its score given to the node of `request`"""
+    node_scores = result.node_scores
+    if node_scores is not None and len(node_scores) == 1 and request.result is not None:
+        node_scores = {request.result.node_id: next(iter(node_scores.values()))}
+    return result.model_copy(update={"node_scores": node_scores, "timestamp": datetime.now()})
+
+
+class ScoreMemo:
+    """
+    Results of recent successful checks, keyed by `request_key`, so exact repeats aren't checked again.
+
+    Bounded LRU: entries expire `ttl_seconds` after they were stored, and once there are more than
+    `max_entries` the least recently used go first. While a check is running, identical checks join
+    it as followers and get its result when it finishes, instead of running themselves.
+
+    Only successful checks are kept. Checkers raise when the servers they check against fail, rather than
+    scoring the response, so a score here never stands in for an upstream error.
+    """
+
+    def __init__(self, max_entries: int = settings.score_memo_max_entries, ttl_seconds: float = settings.score_memo_ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._results: OrderedDict[str, Tuple[float, models.TaskResult]] = OrderedDict()
+        self._in_flight: Dict[str, List[Tuple[str, models.CheckResultsRequest]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def get(self, key: str) -> models.TaskResult | None:
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return entry[1]
+
+    def lookup(self, key: str) -> models.TaskResult | None:
+        """`get`, counted in the hit / miss metrics"""
+        result = self.get(key)
+        metrics.score_memo_lookups_total.inc(result="miss" if result is None else "hit")
+        return result
+
+    def join(self, key: str, task_id: str, request: models.CheckResultsRequest) -> bool:
+        """
+        If an identical check is running, follow it & return True. Otherwise the caller becomes the
+        check that others follow, until it calls `finish`
+        """
+        followers = self._in_flight.get(key)
+        if followers is None:
+            self._in_flight[key] = []
+            return False
+        followers.append((task_id, request))
+        metrics.score_memo_lookups_total.inc(result="joined")
+        return True
+
+    def finish(self, key: str, status: models.TaskStatus, result: models.TaskResult) -> List[Tuple[str, models.CheckResultsRequest]]:
+        """Memoise a finished check (unless it failed) and return the checks that were following it"""
+        if self.max_entries > 0 and status == models.TaskStatus.Success and result.error_message is None:
+            self._results[key] = (time.monotonic() + self.ttl_seconds, result.model_copy(update={"trace": None}))
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        return self._in_flight.pop(key, [])
+
+    def clear(self) -> None:
+        """Forget the memoised results, checks in flight keep their followers"""
+        self._results.clear()
+
+
+score_memo = ScoreMemo()
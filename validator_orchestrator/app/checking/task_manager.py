@@ -1,31 +1,177 @@
 import asyncio
-from datetime import datetime, timedelta
-from typing import Dict, Optional, Tuple
+import heapq
+import itertools
+import time
+from typing import Dict, List, Optional, Tuple
 from loguru import logger
 from app.core import models
+from app.settings import settings
+from app.checking.task_persistence import SQLiteTaskStore
 
-RESULT_EXPIRY_TIME = timedelta(hours=1)
+CLEANUP_INTERVAL_SECONDS = 60
 
 
 class TaskManager:
-    def __init__(self):
+    """
+    Holds the status & result of every task, bounded in size.
+
+    Each task (status and result together) expires `task_expiry_seconds` after it was last updated.
+    Expiry times are kept in a heap so expiring tasks is O(log n) per task instead of a scan over everything,
+    and if we hold more than `max_stored_tasks` tasks, the ones closest to expiring are evicted early.
+    """
+
+    def __init__(self, max_tasks: int = settings.max_stored_tasks, expiry_seconds: float = settings.task_expiry_seconds):
         self.task_status: Dict[str, models.TaskStatus] = {}
         self.task_results: Dict[str, models.TaskResult] = {}
-        self.current_task_id = None
+        self.batches: Dict[str, List[str]] = {}
+        self._task_done_events: Dict[str, asyncio.Event] = {}
         self.last_task_type: Optional[models.Task] = None
 
+        self.max_tasks = max_tasks
+        self.expiry_seconds = expiry_seconds
+        self._expiry_heap: List[Tuple[float, int, str]] = []
+        self._task_expiry: Dict[str, float] = {}
+        self._heap_tiebreak = itertools.count()
+        self.evicted_expired = 0
+        self.evicted_capacity = 0
+        self.store: SQLiteTaskStore | None = None
+
         asyncio.create_task(self._cleanup_expired_tasks())
 
     async def _cleanup_expired_tasks(self):
         while True:
-            await asyncio.sleep(RESULT_EXPIRY_TIME.seconds / 4)
-            now = datetime.now()
-            expired_tasks = [
-                task_id for task_id, result in self.task_results.items() if now - result.timestamp > RESULT_EXPIRY_TIME
+            await asyncio.sleep(CLEANUP_INTERVAL_SECONDS)
+            expired = self.expire_tasks()
+            expired_batches = [
+                batch_id
+                for batch_id, task_ids in self.batches.items()
+                if not any(task_id in self.task_status for task_id in task_ids)
             ]
-            for task_id in expired_tasks:
-                self.task_results.pop(task_id, None)
-            logger.info(f"Cleaned up expired tasks; Removed {len(expired_tasks)} expired tasks")
+            for batch_id in expired_batches:
+                self._remove_batch(batch_id)
+            if expired:
+                logger.info(f"Cleaned up expired tasks; Removed {expired} expired tasks")
+
+    def attach_store(self, store: SQLiteTaskStore) -> List[Tuple[str, models.CheckResultsRequest]]:
+        """
+        Persist tasks to `store` from now on, restoring the tasks & batches it holds.
+        Returns the checks that were still queued or processing when we last stopped, which need queueing again.
+        """
+        self.store = store
+        now = time.time()
+        checks_to_requeue = []
+        for task in store.load_tasks():
+            remaining_seconds = self.expiry_seconds - (now - task.updated_at)
+            if remaining_seconds <= 0:
+                store.delete_task(task.task_id)
+                continue
+
+            if task.status == models.TaskStatus.Processing:
+                if task.request is None:
+                    store.delete_task(task.task_id)
+                    continue
+                checks_to_requeue.append((task.task_id, task.request))
+                self._task_done_events[task.task_id] = asyncio.Event()
+                remaining_seconds = self.expiry_seconds
+
+            self.task_status[task.task_id] = task.status
+            if task.result is not None:
+                self.task_results[task.task_id] = task.result
+            self._touch(task.task_id, remaining_seconds)
+
+        for batch_id, task_ids in store.load_batches().items():
+            if any(task_id in self.task_status for task_id in task_ids):
+                self.batches[batch_id] = task_ids
+            else:
+                store.delete_batch(batch_id)
+
+        self._evict_over_capacity()
+        logger.info(f"Restored {len(self.task_status)} tasks & {len(self.batches)} batches from {store.path}, {len(checks_to_requeue)} to requeue")
+        return checks_to_requeue
+
+    def _touch(self, task_id: str, expiry_seconds: float | None = None) -> None:
+        expires_at = time.monotonic() + (expiry_seconds if expiry_seconds is not None else self.expiry_seconds)
+        self._task_expiry[task_id] = expires_at
+        heapq.heappush(self._expiry_heap, (expires_at, next(self._heap_tiebreak), task_id))
+
+    def _pop_next_to_expire(self) -> Tuple[float, str] | None:
+        """Pop the task closest to expiring, skipping heap entries made stale by a later update"""
+        while self._expiry_heap:
+            expires_at, _, task_id = heapq.heappop(self._expiry_heap)
+            if self._task_expiry.get(task_id) == expires_at:
+                return expires_at, task_id
+        return None
+
+    def _peek_next_expiry(self) -> float | None:
+        while self._expiry_heap:
+            expires_at, _, task_id = self._expiry_heap[0]
+            if self._task_expiry.get(task_id) == expires_at:
+                return expires_at
+            heapq.heappop(self._expiry_heap)
+        return None
+
+    def _remove(self, task_id: str) -> Tuple[Optional[models.TaskStatus], Optional[models.TaskResult]]:
+        status = self.task_status.pop(task_id, None)
+        result = self.task_results.pop(task_id, None)
+        self._task_expiry.pop(task_id, None)
+        if self.store is not None and status is not None:
+            self.store.delete_task(task_id)
+        done_event = self._task_done_events.pop(task_id, None)
+        if done_event is not None:
+            # Wake anyone waiting on it, they'll find it gone
+            done_event.set()
+        return status, result
+
+    def expire_tasks(self) -> int:
+        now = time.monotonic()
+        expired = 0
+        while (next_expiry := self._peek_next_expiry()) is not None and next_expiry <= now:
+            _, task_id = self._pop_next_to_expire()
+            self._remove(task_id)
+            expired += 1
+        self.evicted_expired += expired
+        return expired
+
+    def _evict_over_capacity(self) -> None:
+        while len(self._task_expiry) > self.max_tasks:
+            _, task_id = self._pop_next_to_expire()
+            logger.warning(f"Task store is full ({self.max_tasks} tasks), evicting task {task_id}")
+            self._remove(task_id)
+            self.evicted_capacity += 1
+
+    def add_task(self, task_id: str, request: models.CheckResultsRequest | None = None) -> None:
+        self.task_status[task_id] = models.TaskStatus.Processing
+        self._task_done_events[task_id] = asyncio.Event()
+        self._touch(task_id)
+        if self.store is not None:
+            self.store.record_task(task_id, models.TaskStatus.Processing, request=request)
+        self.expire_tasks()
+        self._evict_over_capacity()
+
+    def complete_task(self, task_id: str, status: models.TaskStatus, result: models.TaskResult) -> None:
+        if task_id not in self.task_status:
+            logger.warning(f"Task {task_id} finished after it was evicted from the task store, dropping its result")
+            return
+        self.task_status[task_id] = status
+        self.task_results[task_id] = result
+        self._touch(task_id)
+        if self.store is not None:
+            self.store.record_task(task_id, status, result=result)
+        done_event = self._task_done_events.pop(task_id, None)
+        if done_event is not None:
+            done_event.set()
+
+    async def wait_for_any_task(self, task_ids: List[str], timeout: float) -> None:
+        """Wait until any of the given tasks finishes processing, or the timeout passes"""
+        done_events = [self._task_done_events[task_id] for task_id in task_ids if task_id in self._task_done_events]
+        if not done_events:
+            return
+        waiters = [asyncio.create_task(done_event.wait()) for done_event in done_events]
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
 
     def task_is_processing(self, task_id: str) -> bool:
         status = self.task_status.get(task_id, None)
@@ -34,9 +180,51 @@ class TaskManager:
     def clear_and_return_task_status_and_result(
         self, task_id: str
     ) -> Tuple[Optional[models.TaskStatus], Optional[models.TaskResult]]:
-        status = self.task_status.pop(task_id, None)
-        result = self.task_results.pop(task_id, None)
-        return status, result
+        return self._remove(task_id)
+
+    def add_batch(self, batch_id: str, task_ids: List[str]) -> None:
+        self.batches[batch_id] = task_ids
+        if self.store is not None:
+            self.store.record_batch(batch_id, task_ids)
+
+    def _remove_batch(self, batch_id: str) -> List[str]:
+        task_ids = self.batches.pop(batch_id, [])
+        if self.store is not None:
+            self.store.delete_batch(batch_id)
+        return task_ids
+
+    def batch_is_processing(self, batch_id: str) -> bool:
+        return any(self.task_is_processing(task_id) for task_id in self.batches[batch_id])
+
+    def clear_and_return_batch(self, batch_id: str) -> Tuple[Dict[str, models.TaskStatus], Dict[str, models.TaskResult]]:
+        statuses, results = {}, {}
+        for task_id in self._remove_batch(batch_id):
+            status, result = self.clear_and_return_task_status_and_result(task_id)
+            if status is not None:
+                statuses[task_id] = status
+            if result is not None:
+                results[task_id] = result
+        return statuses, results
+
+    def list_task_statuses(
+        self, offset: int, limit: int, status: Optional[models.TaskStatus] = None
+    ) -> Tuple[Dict[str, models.TaskStatus], int]:
+        """A page of task statuses (oldest first), optionally only those with the given status, and the total matching"""
+        if status is None:
+            matching = self.task_status.items()
+            total = len(self.task_status)
+        else:
+            matching = [(task_id, task_status) for task_id, task_status in self.task_status.items() if task_status == status]
+            total = len(matching)
+        return dict(itertools.islice(matching, offset, offset + limit)), total
+
+    def stats(self) -> models.TaskStoreStats:
+        return models.TaskStoreStats(
+            size=len(self.task_status),
+            capacity=self.max_tasks,
+            evicted_expired=self.evicted_expired,
+            evicted_capacity=self.evicted_capacity,
+        )
 
 
 task_manager = TaskManager()
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from loguru import logger
+from app.core import models
+
+_DELETED = object()
+
+
+@dataclass
+class PersistedTask:
+    task_id: str
+    status: models.TaskStatus
+    result: Optional[models.TaskResult]
+    request: Optional[models.CheckResultsRequest]
+    updated_at: float
+
+
+class SQLiteTaskStore:
+    """
+    Persists task statuses, results & the requests of unfinished tasks to SQLite, so they survive restarts.
+
+    Writes are buffered in memory and flushed in the background every `flush_interval_seconds` on a
+    worker thread, so recording a task never blocks the event loop on disk IO. Only the latest write
+    for each task in a flush window is written.
+    """
+
+    def __init__(self, path: str, flush_interval_seconds: float):
+        self.path = path
+        self.flush_interval_seconds = flush_interval_seconds
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "task_id TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT, request TEXT, updated_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE TABLE IF NOT EXISTS batches (batch_id TEXT PRIMARY KEY, task_ids TEXT NOT NULL)")
+        self._connection.commit()
+        self._pending_tasks: Dict[str, tuple | object] = {}
+        self._pending_batches: Dict[str, List[str] | object] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flusher: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.flush()
+        self._connection.close()
+
+    def record_task(
+        self,
+        task_id: str,
+        status: models.TaskStatus,
+        result: Optional[models.TaskResult] = None,
+        request: Optional[models.CheckResultsRequest] = None,
+    ) -> None:
+        self._pending_tasks[task_id] = (
+            status.value,
+            result.model_dump_json() if result is not None else None,
+            request.model_dump_json() if request is not None else None,
+            time.time(),
+        )
+
+    def delete_task(self, task_id: str) -> None:
+        self._pending_tasks[task_id] = _DELETED
+
+    def record_batch(self, batch_id: str, task_ids: List[str]) -> None:
+        self._pending_batches[batch_id] = list(task_ids)
+
+    def delete_batch(self, batch_id: str) -> None:
+        self._pending_batches[batch_id] = _DELETED
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush tasks to the task store")
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._pending_tasks and not self._pending_batches:
+                return
+            pending_tasks, self._pending_tasks = self._pending_tasks, {}
+            pending_batches, self._pending_batches = self._pending_batches, {}
+            await asyncio.to_thread(self._write, pending_tasks, pending_batches)
+
+    def _write(self, pending_tasks: Dict[str, tuple | object], pending_batches: Dict[str, List[str] | object]) -> None:
+        with self._connection:
+            self._connection.executemany(
+                "DELETE FROM tasks WHERE task_id = ?",
+                [(task_id,) for task_id, row in pending_tasks.items() if row is _DELETED],
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO tasks (task_id, status, result, request, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(task_id, *row) for task_id, row in pending_tasks.items() if row is not _DELETED],
+            )
+            self._connection.executemany(
+                "DELETE FROM batches WHERE batch_id = ?",
+                [(batch_id,) for batch_id, task_ids in pending_batches.items() if task_ids is _DELETED],
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO batches (batch_id, task_ids) VALUES (?, ?)",
+                [(batch_id, json.dumps(task_ids)) for batch_id, task_ids in pending_batches.items() if task_ids is not _DELETED],
+            )
+
+    def load_tasks(self) -> List[PersistedTask]:
+        rows = self._connection.execute("SELECT task_id, status, result, request, updated_at FROM tasks ORDER BY updated_at").fetchall()
+        tasks = []
+        for task_id, status, result, request, updated_at in rows:
+            try:
+                tasks.append(
+                    PersistedTask(
+                        task_id=task_id,
+                        status=models.TaskStatus(status),
+                        result=models.TaskResult.model_validate_json(result) if result is not None else None,
+                        request=models.CheckResultsRequest.model_validate_json(request) if request is not None else None,
+                        updated_at=updated_at,
+                    )
+                )
+            except ValueError as e:
+                logger.error(f"Skipping task {task_id} from the task store, it couldn't be loaded: {e}")
+        return tasks
+
+    def load_batches(self) -> Dict[str, List[str]]:
+        return {batch_id: json.loads(task_ids) for batch_id, task_ids in self._connection.execute("SELECT batch_id, task_ids FROM batches")}
@@ -0,0 +1,103 @@
+"""
+Tokenizers for text checks, loaded in-process so templating & tokenising don't need a round trip to the llm_server.
+
+They're the same HF fast tokenizers (and chat templates) vLLM loads for `load_model_config["tokenizer"]`, and
+mirror what its /tokenize & /detokenize endpoints do. With `local_tokenizers_dir` set, tokenizers are loaded
+from `<local_tokenizers_dir>/<tokenizer name>` without touching the network.
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Dict, Tuple
+from loguru import logger
+from app.settings import settings
+
+
+class LocalTokenizer:
+    def __init__(self, name: str, tokenizer: Any):
+        self.name = name
+        self._tokenizer = tokenizer
+        self._special_ids = set(tokenizer.all_special_ids) | {
+            token_id for token_id, token in tokenizer.added_tokens_decoder.items() if token.special
+        }
+
+    def tokenize(self, prompt: str, add_special_tokens: bool) -> list[int]:
+        return self._tokenizer(prompt, add_special_tokens=add_special_tokens)["input_ids"]
+
+    def tokenize_with_offsets(self, prompt: str) -> tuple[list[int], list[tuple[int, int]]]:
+        """Token ids (without added special tokens) & the (start, end) character offsets of each one in `prompt`"""
+        encoding = self._tokenizer(prompt, add_special_tokens=False, return_offsets_mapping=True)
+        return encoding["input_ids"], encoding["offset_mapping"]
+
+    def render_chat(self, messages: list[dict], add_generation_prompt: bool = True) -> str:
+        return self._tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=add_generation_prompt)
+
+    def tokenize_chat(self, messages: list[dict], add_generation_prompt: bool = True) -> list[int]:
+        # Like vLLM: render the chat template, then tokenise without adding special tokens (the template has them)
+        return self.tokenize(self.render_chat(messages, add_generation_prompt), add_special_tokens=False)
+
+    def is_special(self, token_id: int) -> bool:
+        return token_id in self._special_ids
+
+    def detokenize(self, tokens: list[int]) -> str:
+        return self._tokenizer.decode(tokens)
+
+
+def tokenizer_name(load_model_config: dict) -> str:
+    return load_model_config.get("tokenizer") or load_model_config["model"]
+
+
+def _load(name: str) -> LocalTokenizer:
+    from transformers import AutoTokenizer
+
+    local_path = os.path.join(settings.local_tokenizers_dir, name) if settings.local_tokenizers_dir else None
+    if local_path is not None and os.path.isdir(local_path):
+        tokenizer = AutoTokenizer.from_pretrained(local_path, use_fast=True, local_files_only=True)
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(name, use_fast=True)
+    if not tokenizer.is_fast:
+        raise ValueError(f"Tokenizer {name} has no fast implementation")
+    return LocalTokenizer(name, tokenizer)
+
+
+class TokenizerCache:
+    """
+    Tokenizers loaded so far, one per tokenizer name. Names that failed to load (e.g. the hub was unreachable)
+    are tried again after a backoff, using the llm_server's tokenizer until then
+    """
+
+    def __init__(self):
+        self._tokenizers: Dict[str, LocalTokenizer] = {}
+        # Name -> (when to try loading it again, failures in a row)
+        self._failures: Dict[str, Tuple[float, int]] = {}
+        self._lock = asyncio.Lock()
+
+    def _backing_off(self, name: str) -> bool:
+        failure = self._failures.get(name)
+        return failure is not None and time.monotonic() < failure[0]
+
+    async def get(self, load_model_config: dict) -> LocalTokenizer | None:
+        name = tokenizer_name(load_model_config)
+        if name in self._tokenizers:
+            return self._tokenizers[name]
+        if self._backing_off(name):
+            return None
+
+        async with self._lock:
+            if name not in self._tokenizers and not self._backing_off(name):
+                try:
+                    self._tokenizers[name] = await asyncio.to_thread(_load, name)
+                    self._failures.pop(name, None)
+                    logger.info(f"Loaded tokenizer {name} in-process")
+                except Exception as e:
+                    failures = self._failures.get(name, (0.0, 0))[1] + 1
+                    retry_seconds = min(settings.tokenizer_load_retry_seconds * 2 ** (failures - 1), settings.tokenizer_load_max_retry_seconds)
+                    self._failures[name] = (time.monotonic() + retry_seconds, failures)
+                    logger.warning(
+                        f"Couldn't load tokenizer {name} in-process, the llm_server will tokenise for it for the next {retry_seconds:.0f}s: {e}"
+                    )
+        return self._tokenizers.get(name)
+
+
+tokenizer_cache = TokenizerCache()
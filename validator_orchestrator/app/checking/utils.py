@@ -2,7 +2,8 @@ import numpy as np
 from typing import List
 import imagehash
 from PIL import Image
-import httpx
+from app.core import timeouts
+from app.core.http_clients import EXTERNAL_UPSTREAM, http_clients
 import re
 from loguru import logger
 from app.core import utility_models
@@ -78,9 +79,10 @@ def validate_gojourney_url(url: str) -> bool:
 
 async def fetch_image_as_bytes(url):
     try:
-        async with httpx.AsyncClient(timeout=45) as client:
-            response = await client.get(url)
-            return response.content
+        # Keyed by what's fetched, not the url: miners' image hosts are too many to keep a model of each
+        with timeouts.upstream_call(EXTERNAL_UPSTREAM, "image", default_timeout=45) as timeout:
+            response = await http_clients.client(EXTERNAL_UPSTREAM).get(url, timeout=timeout)
+        return response.content
     except Exception as e:
         logger.debug(f"Error when fetching image {url}: {e}")
         return False
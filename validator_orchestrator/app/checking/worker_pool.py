@@ -0,0 +1,107 @@
+import asyncio
+from typing import Awaitable, Callable, Dict
+from loguru import logger
+from app.core import models
+from app.checking.scheduler import AffinityScheduler
+from app.server_management import ServerKey
+
+CheckHandler = Callable[[str, models.CheckResultsRequest], Awaitable[None]]
+
+
+class CheckWorkerPool:
+    """
+    Queue of checks waiting to be processed, drained by a fixed number of workers.
+    Checks are handed out by the AffinityScheduler so we swap containers as little as possible.
+    """
+
+    def __init__(
+        self,
+        handler: CheckHandler,
+        num_workers: int,
+        max_queue_size: int,
+        max_group_wait_seconds: float,
+        is_warm: Callable[[ServerKey], bool] | None = None,
+    ):
+        self._handler = handler
+        self._num_workers = num_workers
+        self._queue = AffinityScheduler(max_size=max_queue_size, max_group_wait_seconds=max_group_wait_seconds, is_warm=is_warm)
+        self._workers: list[asyncio.Task] = []
+        self.busy_workers = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def num_workers(self) -> int:
+        return self._num_workers
+
+    def group_depths(self) -> Dict[ServerKey, int]:
+        return self._queue.group_depths()
+
+    def status(self) -> models.QueueStatusResponse:
+        active_group = self._queue.active_group
+        return models.QueueStatusResponse(
+            queue_depth=self._queue.qsize(),
+            busy_workers=self.busy_workers,
+            num_workers=self._num_workers,
+            active_server=active_group[0] if active_group else None,
+            active_model=active_group[1] if active_group else None,
+            groups=self._queue.group_statuses(),
+            streaming_checks=self._queue.reserved,
+        )
+
+    def start(self) -> None:
+        logger.info(f"Starting {self._num_workers} check workers")
+        self._workers = [asyncio.create_task(self._worker(worker_id)) for worker_id in range(self._num_workers)]
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, task_id: str, request: models.CheckResultsRequest) -> bool:
+        """Queue a check. Returns False if the queue is full"""
+        try:
+            self._queue.put_nowait(task_id, request)
+        except asyncio.QueueFull:
+            logger.warning(f"Check queue is full ({self._queue.qsize()} checks), rejecting task {task_id}")
+            return False
+        return True
+
+    def submit_batch(self, checks: list[tuple[str, models.CheckResultsRequest]]) -> bool:
+        """Queue a batch of checks, all or nothing. Returns False if the queue can't fit them all"""
+        try:
+            self._queue.put_many_nowait(checks)
+        except asyncio.QueueFull:
+            logger.warning(f"Check queue can't fit a batch of {len(checks)} checks ({self._queue.qsize()} queued), rejecting it")
+            return False
+        return True
+
+    def reserve_stream(self) -> bool:
+        """
+        Count a streamed check, which its endpoint runs rather than the workers, against the queue's size until
+        `release_stream`. Returns False if the queue is full
+        """
+        try:
+            self._queue.reserve()
+        except asyncio.QueueFull:
+            logger.warning(f"Check queue is full ({self._queue.qsize()} checks, {self._queue.reserved} streamed), rejecting a streamed check")
+            return False
+        return True
+
+    def release_stream(self) -> None:
+        self._queue.release()
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            task_id, request = await self._queue.get()
+            self.busy_workers += 1
+            try:
+                await self._handler(task_id, request)
+            except Exception:
+                # The handler records its own failures, this is just so a bug can't kill the worker
+                logger.exception(f"Worker {worker_id} failed to process task {task_id}")
+            finally:
+                self.busy_workers -= 1
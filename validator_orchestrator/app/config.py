@@ -4,6 +4,8 @@ import os
 from app.core.models import ServerType, ProdDockerImages
 
 DEFAULT_NETWORK_NAME = "comm"
+# The orchestrator's own port on the host, as launch_orchestrator.sh publishes it
+ORCHESTRATOR_PORT = int(os.getenv("PORT", 6920))
 
 
 class CheckingServerConfig(BaseModel):
@@ -40,10 +42,16 @@ checking_server_configs: list[CheckingServerConfig] = [
         volumes={"COMFY": "/app/image_server/ComfyUI"},
         env_vars={},
         network=shared_network,
-        external_port=6919,
+        # Its own port on the host, so it can be up at the same time as the LLM server
+        external_port=int(os.getenv("IMAGE_SERVER_EXTERNAL_PORT", 6921)),
     ),
 ]
 
+if len({config.external_port for config in checking_server_configs}) != len(checking_server_configs):
+    raise ValueError(f"Checking servers need different external ports: {[(config.name, config.external_port) for config in checking_server_configs]}")
+if any(config.external_port == ORCHESTRATOR_PORT for config in checking_server_configs):
+    raise ValueError(f"Checking servers can't use the orchestrator's port {ORCHESTRATOR_PORT}: {[(config.name, config.external_port) for config in checking_server_configs]}")
+
 
 def get_checking_server_config(server_type: ServerType) -> CheckingServerConfig | None:
     for worker_config in checking_server_configs:
@@ -9,3 +9,12 @@ SYNTHETIC_ENDPOINT_PREFIX = "synthetic"
 CHECKING_ENDPOINT_PREFIX = "checking"
 
 AI_SERVER_PORT = 6919
+
+# Longest a client can long-poll /check-task for
+MAX_TASK_WAIT_SECONDS = 60
+TASK_EVENTS_KEEPALIVE_SECONDS = 15
+
+MAX_TASK_STATUS_PAGE_SIZE = 1000
+
+# Checking functions whose responses can also be checked as they're uploaded, at /check-result-stream
+STREAMABLE_CHECKING_FUNCTIONS = ("check_text_result", "check_text_results")
@@ -1,4 +1,5 @@
 from app import server_management
+from app.checking import worker_pool
 from fastapi import Request
 
 
@@ -6,3 +7,9 @@ async def get_server_manager(
     request: Request,
 ) -> server_management.ServerManager:
     return request.app.state.server_manager
+
+
+async def get_check_worker_pool(
+    request: Request,
+) -> worker_pool.CheckWorkerPool:
+    return request.app.state.check_worker_pool
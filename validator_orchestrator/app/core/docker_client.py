@@ -0,0 +1,193 @@
+"""
+A small async client for the Docker Engine API, over the daemon's unix socket (mounted into the orchestrator's
+container), so starting & stopping checking servers doesn't block the event loop like the docker CLI did.
+"""
+
+import json
+from typing import Any, AsyncIterator, Dict, List
+import httpx
+from loguru import logger
+from app.settings import settings
+
+
+class DockerError(Exception):
+    """A Docker Engine API call that failed: what we tried, the HTTP status (None if the daemon couldn't be reached) & why"""
+
+    def __init__(self, operation: str, status_code: int | None, message: str):
+        super().__init__(f"Docker {operation} failed ({status_code or 'no response'}): {message}")
+        self.operation = operation
+        self.status_code = status_code
+        self.message = message
+
+
+class DockerNotFound(DockerError):
+    pass
+
+
+class DockerConflict(DockerError):
+    pass
+
+
+def _error(operation: str, response: httpx.Response) -> DockerError:
+    try:
+        message = response.json().get("message", response.text)
+    except ValueError:
+        message = response.text
+    error_class = {404: DockerNotFound, 409: DockerConflict}.get(response.status_code, DockerError)
+    return error_class(operation, response.status_code, message)
+
+
+def _filters(filters: Dict[str, List[str]] | None) -> Dict[str, str]:
+    return {"filters": json.dumps(filters)} if filters else {}
+
+
+def split_image(image: str) -> tuple[str, str]:
+    """`repository[:tag]` to (repository, tag), the tag being `latest` if there isn't one"""
+    repository, _, tag = image.rpartition(":")
+    if not repository or "/" in tag:
+        return image, "latest"
+    return repository, tag
+
+
+class DockerClient:
+    """
+    The Engine API calls the server manager needs. The connection is made on first use, like the
+    pooled HTTP clients. Calls raise DockerError (DockerNotFound & DockerConflict for 404s & 409s).
+    """
+
+    def __init__(self, socket_path: str = settings.docker_socket_path, api_version: str | None = settings.docker_api_version):
+        self.socket_path = socket_path
+        # Unversioned paths get the daemon's own API version
+        self.base_url = f"http://docker/v{api_version}" if api_version else "http://docker"
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(uds=self.socket_path),
+                base_url=self.base_url,
+                timeout=settings.http_default_timeout_seconds,
+            )
+        return self._client
+
+    async def _request(self, operation: str, method: str, path: str, ok_statuses: tuple[int, ...] = (200, 201, 204), **kwargs) -> httpx.Response:
+        try:
+            response = await self.client.request(method, path, **kwargs)
+        except httpx.TransportError as e:
+            raise DockerError(operation, None, f"Couldn't reach the daemon at {self.socket_path}: {e!r}") from e
+        if response.status_code not in ok_statuses:
+            raise _error(operation, response)
+        return response
+
+    async def ping(self) -> bool:
+        try:
+            await self._request("ping", "GET", "/_ping")
+            return True
+        except DockerError:
+            return False
+
+    async def list_containers(self, filters: Dict[str, List[str]] | None = None, all: bool = False) -> List[Dict[str, Any]]:
+        response = await self._request("list containers", "GET", "/containers/json", params={"all": str(all).lower(), **_filters(filters)})
+        return response.json()
+
+    async def inspect_container(self, container: str) -> Dict[str, Any]:
+        response = await self._request(f"inspect {container}", "GET", f"/containers/{container}/json")
+        return response.json()
+
+    async def pull_image(self, image: str) -> None:
+        repository, tag = split_image(image)
+        logger.info(f"Pulling {repository}:{tag}...")
+        operation = f"pull {image}"
+        try:
+            # Progress is streamed as JSON lines until the pull is done, failures show up in them too
+            async with self.client.stream(
+                "POST", "/images/create", params={"fromImage": repository, "tag": tag}, timeout=httpx.Timeout(settings.http_default_timeout_seconds, read=None)
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise _error(operation, response)
+                async for line in response.aiter_lines():
+                    if line.strip() and "error" in (progress := json.loads(line)):
+                        raise DockerError(operation, response.status_code, progress["error"])
+        except httpx.TransportError as e:
+            raise DockerError(operation, None, f"Couldn't reach the daemon at {self.socket_path}: {e!r}") from e
+
+    async def create_container(self, name: str, config: Dict[str, Any]) -> str:
+        """Create a container from an Engine API container config, pulling its image if needed. Returns its id"""
+        try:
+            response = await self._request(f"create {name}", "POST", "/containers/create", params={"name": name}, json=config)
+        except DockerNotFound:
+            await self.pull_image(config["Image"])
+            response = await self._request(f"create {name}", "POST", "/containers/create", params={"name": name}, json=config)
+        for warning in response.json().get("Warnings") or []:
+            logger.warning(f"Docker, creating {name}: {warning}")
+        return response.json()["Id"]
+
+    async def start_container(self, container: str) -> None:
+        # 304: it's already running
+        await self._request(f"start {container}", "POST", f"/containers/{container}/start", ok_statuses=(204, 304))
+
+    async def stop_container(self, container: str, timeout_seconds: int = settings.docker_stop_timeout_seconds) -> None:
+        """Stop a container, killing it if it hasn't exited after `timeout_seconds`"""
+        await self._request(
+            f"stop {container}",
+            "POST",
+            f"/containers/{container}/stop",
+            ok_statuses=(204, 304),
+            params={"t": timeout_seconds},
+            timeout=timeout_seconds + settings.http_default_timeout_seconds,
+        )
+
+    async def remove_container(self, container: str, force: bool = False) -> None:
+        await self._request(f"remove {container}", "DELETE", f"/containers/{container}", params={"force": str(force).lower()})
+
+    async def wait_container(self, container: str, condition: str = "not-running", timeout_seconds: float | None = None) -> Dict[str, Any]:
+        """Wait for a container to exit (`not-running`, `next-exit`) or be removed (`removed`)"""
+        response = await self._request(
+            f"wait for {container}",
+            "POST",
+            f"/containers/{container}/wait",
+            params={"condition": condition},
+            timeout=httpx.Timeout(settings.http_default_timeout_seconds, read=timeout_seconds),
+        )
+        return response.json()
+
+    async def stop_and_remove_container(self, container: str) -> None:
+        """Stop & remove a container if it's there, returning once it's gone (so its name & ports are free)"""
+        try:
+            await self.stop_container(container)
+        except DockerNotFound:
+            return
+        try:
+            await self.remove_container(container, force=True)
+        except DockerNotFound:
+            return
+        except DockerConflict as e:
+            # Auto-removed containers are already being removed once stopped
+            logger.debug(f"{container} is already being removed: {e.message}")
+        try:
+            await self.wait_container(container, condition="removed", timeout_seconds=settings.docker_stop_timeout_seconds + settings.http_default_timeout_seconds)
+        except DockerNotFound:
+            pass
+
+    async def events(self, filters: Dict[str, List[str]] | None = None) -> AsyncIterator[Dict[str, Any]]:
+        """Events from the daemon (container starts, deaths, ...) as they happen, until the connection drops"""
+        try:
+            async with self.client.stream("GET", "/events", params=_filters(filters), timeout=httpx.Timeout(settings.http_default_timeout_seconds, read=None)) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise _error("events", response)
+                async for line in response.aiter_lines():
+                    if line.strip():
+                        yield json.loads(line)
+        except httpx.TransportError as e:
+            raise DockerError("events", None, f"Lost the event stream from {self.socket_path}: {e!r}") from e
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+docker_client = DockerClient()
@@ -0,0 +1,71 @@
+import importlib.util
+from typing import Dict, Tuple
+import httpx
+from loguru import logger
+from app.core import models
+from app.settings import settings
+
+# Anything that isn't one of our checking servers (trace collectors, image urls, ...)
+EXTERNAL_UPSTREAM = "external"
+
+
+def _limits(upstream: str) -> httpx.Limits:
+    max_connections = {
+        models.ServerType.LLM.value: settings.llm_server_max_connections,
+        models.ServerType.IMAGE.value: settings.image_server_max_connections,
+    }.get(upstream, settings.external_max_connections)
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=settings.http_keepalive_expiry_seconds,
+    )
+
+
+class HttpClients:
+    """
+    One keep-alive connection pool per upstream, shared by everything in the process that talks to it.
+    Clients are made on first use, so callers outside the app's lifespan (scripts, benchmarks) work too.
+    """
+
+    def __init__(self, http2: bool = settings.http2):
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 was asked for but the `h2` package isn't installed (pip install httpx[http2]), using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def client(self, upstream: str) -> httpx.AsyncClient:
+        client = self._clients.get(upstream)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(limits=_limits(upstream), http2=self.http2, timeout=settings.http_default_timeout_seconds)
+            self._clients[upstream] = client
+        return client
+
+    def start(self) -> None:
+        for server_type in models.ServerType:
+            self.client(server_type.value)
+
+    async def reset(self, upstream: str) -> None:
+        """Drop the pooled connections to an upstream, e.g. after its container was replaced"""
+        client = self._clients.pop(upstream, None)
+        if client is not None:
+            await client.aclose()
+
+    async def close(self) -> None:
+        for upstream in list(self._clients):
+            await self.reset(upstream)
+
+    def pool_stats(self) -> Dict[Tuple[str, str], int]:
+        """Number of pooled connections per (upstream, state), state being `active` or `idle`"""
+        stats: Dict[Tuple[str, str], int] = {}
+        for upstream, client in self._clients.items():
+            # httpx doesn't expose its pool, so this digs into httpcore & gives up quietly if that changes
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            connections = getattr(pool, "connections", [])
+            idle = sum(1 for connection in connections if connection.is_idle())
+            stats[(upstream, "active")] = len(connections) - idle
+            stats[(upstream, "idle")] = idle
+        return stats
+
+
+http_clients = HttpClients()
@@ -0,0 +1,232 @@
+"""
+In-process counters exported in the Prometheus text format on /metrics.
+
+Everything here runs on the event loop thread, so updating a metric is just a dict update - no locks.
+"""
+
+import bisect
+import contextlib
+import math
+import time
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+SCORE_BUCKETS = (0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape(label_value: str) -> str:
+    return label_value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names: Sequence[str], label_values: Sequence[str]) -> str:
+    if not label_names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)) + "}"
+
+
+class _Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+    def _label_values(self, labels: Dict[str, object]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}", *self._samples()]
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _ValueMetric(_Metric):
+    """
+    A metric holding one value per label set. Values can also be read from a collector function when
+    scraped, for things that are already counted elsewhere (queue depth, task store evictions, ...)
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = {}
+        self._collector: Callable[[], Dict[LabelValues, float]] | None = None
+
+    def set_collector(self, collector: Callable[[], Dict[LabelValues, float]]) -> None:
+        self._collector = collector
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Shortcut for a metric without labels that is read from `function`"""
+        self.set_collector(lambda: {(): function()})
+
+    def _samples(self) -> List[str]:
+        values = dict(self._values)
+        if self._collector is not None:
+            values.update({tuple(str(value) for value in key): value for key, value in self._collector().items()})
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in values.items()]
+
+
+class Counter(_ValueMetric):
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        key = self._label_values(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_ValueMetric):
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels: object) -> None:
+        self._values[self._label_values(labels)] = value
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (non-cumulative, last one is +Inf), sum]
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._label_values(labels)
+        if key not in self._values:
+            self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        bucket_counts, total = self._values[key]
+        bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        samples = []
+        for key, (bucket_counts, total) in self._values.items():
+            cumulative = 0
+            for upper_bound, count in zip((*self.buckets, math.inf), bucket_counts):
+                cumulative += count
+                labels = _format_labels((*self.label_names, "le"), (*key, _format_value(upper_bound)))
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            samples.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+            samples.append(f"{self.name}_count{labels} {cumulative}")
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, label_names))
+
+    def histogram(
+        self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+checks_total = registry.counter(
+    "orchestrator_checks_total", "Checks processed, by task, checking function & final status", ["task", "checking_function", "status"]
+)
+check_duration_seconds = registry.histogram(
+    "orchestrator_check_duration_seconds", "Time to process a check, from leaving the queue to finishing", ["task", "checking_function"]
+)
+check_scores = registry.histogram("orchestrator_check_score", "Scores given by checks", ["task", "checking_function"], buckets=SCORE_BUCKETS)
+
+queue_depth = registry.gauge("orchestrator_queue_depth", "Checks waiting in the queue")
+queue_group_depth = registry.gauge("orchestrator_queue_group_depth", "Checks waiting in the queue, per server & model", ["server", "model"])
+busy_workers = registry.gauge("orchestrator_busy_workers", "Workers currently processing a check")
+workers = registry.gauge("orchestrator_workers", "Workers in the check pool")
+
+container_starts_total = registry.counter("orchestrator_container_starts_total", "Checking server containers (re)started", ["server", "model"])
+container_start_duration_seconds = registry.histogram(
+    "orchestrator_container_start_duration_seconds", "Time to (re)start a checking server container until it's healthy", ["server"]
+)
+
+gpu_memory_reserved_mib = registry.gauge("orchestrator_gpu_memory_reserved_mib", "VRAM held by the checking servers that are up, per GPU", ["gpu"])
+container_exits_total = registry.counter("orchestrator_container_exits_total", "Checking server containers that died without us stopping them", ["server"])
+
+upstream_request_duration_seconds = registry.histogram(
+    "orchestrator_upstream_request_duration_seconds", "Latency of requests to the checking servers", ["upstream", "endpoint"]
+)
+upstream_timeout_seconds = registry.gauge(
+    "orchestrator_upstream_timeout_seconds",
+    "Current timeout of requests to each upstream endpoint, by size class, from their recent latencies",
+    ["upstream", "endpoint", "size_class"],
+)
+http_pool_connections = registry.gauge(
+    "orchestrator_http_pool_connections", "Pooled HTTP connections per upstream, by state: active or idle", ["upstream", "state"]
+)
+
+task_store_size = registry.gauge("orchestrator_task_store_size", "Tasks held in the task store")
+task_store_evictions_total = registry.counter("orchestrator_task_store_evictions_total", "Tasks evicted from the task store, by reason", ["reason"])
+
+score_memo_lookups_total = registry.counter(
+    "orchestrator_score_memo_lookups_total", "Score memo lookups, by result: hit, miss, or joined a running identical check", ["result"]
+)
+score_memo_entries = registry.gauge("orchestrator_score_memo_entries", "Check results held in the score memo")
+
+tokenizer_parity_mismatches_total = registry.counter(
+    "orchestrator_tokenizer_parity_mismatches_total", "In-process tokenizer results that differ from the llm_server's, in parity mode", ["operation"]
+)
+
+prompt_cache_lookups_total = registry.counter(
+    "orchestrator_prompt_cache_lookups_total",
+    "Chat prompt cache lookups, by result: hit, miss, or prefix (tokenised only what followed a cached conversation)",
+    ["result"],
+)
+prompt_cache_bytes = registry.gauge("orchestrator_prompt_cache_bytes", "Memory used by the chat prompt cache")
+
+text_verification_score_difference = registry.histogram(
+    "orchestrator_text_verification_score_difference",
+    "Difference between the multi pass & single pass scores of text checks, in compare mode",
+    buckets=(0, 0.01, 0.05, 0.1, 0.2, 0.5, 1),
+)
+text_distance_checks = registry.histogram(
+    "orchestrator_text_distance_checks", "Tokens whose distance was checked per text check", buckets=(1, 2, 3, 4, 5, 10, 20)
+)
+
+stream_checks_total = registry.counter(
+    "orchestrator_stream_checks_total",
+    "Streamed text checks, by verdict: accepted, rejected, or rejected_early (before the whole response was uploaded)",
+    ["verdict"],
+)
+stream_check_tokens_verified = registry.histogram(
+    "orchestrator_stream_check_tokens_verified",
+    "Response tokens verified per streamed text check",
+    buckets=(1, 4, 16, 64, 256, 1024, 4096),
+)
@@ -1,14 +1,58 @@
 from __future__ import annotations
+from array import array
 from typing import Dict, List, Optional, Any, Union
 from enum import Enum
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr, model_validator
 from datetime import datetime
+import base64
+import binascii
+import sys
 
 AxonScores = Dict[int, float]
 
 
+class PackedTextResponse(BaseModel):
+    """
+    A text response as parallel columns, instead of a list of OpenAI style chunks with one token each.
+    `logprobs` is base64 of the little endian float32 logprob of each token.
+    """
+
+    tokens: List[str]
+    logprobs: str
+
+    _logprob_values: array = PrivateAttr()
+
+    @model_validator(mode="after")
+    def _unpack_logprobs(self) -> PackedTextResponse:
+        try:
+            packed = base64.b64decode(self.logprobs, validate=True)
+        except binascii.Error as e:
+            raise ValueError(f"logprobs must be base64: {e}")
+        if len(packed) != 4 * len(self.tokens):
+            raise ValueError(f"Got {len(packed) // 4} logprobs for {len(self.tokens)} tokens")
+
+        values = array("f")
+        values.frombytes(packed)
+        if sys.byteorder == "big":
+            values.byteswap()
+        self._logprob_values = values
+        return self
+
+    @classmethod
+    def pack(cls, tokens: List[str], logprobs: List[float]) -> PackedTextResponse:
+        values = array("f", logprobs)
+        if sys.byteorder == "big":
+            values.byteswap()
+        return cls(tokens=tokens, logprobs=base64.b64encode(values.tobytes()).decode())
+
+    def messages(self) -> List[MessageResponse]:
+        # The columns were validated when unpacked, so skip validating each message again
+        return [MessageResponse.model_construct(content=token, logprob=logprob) for token, logprob in zip(self.tokens, self._logprob_values.tolist())]
+
+
 class QueryResult(BaseModel):
-    formatted_response: dict[str, Any] | list[dict[str, Any]] | None
+    # Text responses can come packed; packed is tried first so a dict with its fields isn't taken as a plain dict
+    formatted_response: PackedTextResponse | dict[str, Any] | list[dict[str, Any]] | None = Field(union_mode="left_to_right")
     node_id: Optional[int]
     response_time: Optional[float]
 
@@ -36,6 +80,28 @@ class ModelConfigDetails(BaseModel):
     max_model_len: Optional[int] = None
 
 
+class DistanceSamplingConfig(BaseModel):
+    """
+    Check the distances of a text response a token at a time, stopping once its score is clearly 1 or 0.
+    The stopping rule treats distances as sub-Gaussian with scale `sub_gaussian_scale`. The default of 0.035 assumes
+    an honest response's distances stay within a few hundredths of each other (they're the difference between two
+    runs of the same model), so a clean response stops after 1 or 2 checks and garbage after 1. 0.5 is valid for any
+    distances in [0, 1], but then no verdict is certain before `max_checks`, and all the checks run at once.
+    """
+
+    min_checks: int = Field(default=1, ge=1)
+    max_checks: int = Field(default=5, ge=1)
+    # Chance of stopping with the wrong verdict
+    error_rate: float = Field(default=0.05, gt=0, lt=1)
+    sub_gaussian_scale: float = Field(default=0.035, gt=0, le=0.5)
+
+    @model_validator(mode="after")
+    def _checks_in_order(self) -> DistanceSamplingConfig:
+        if self.min_checks > self.max_checks:
+            raise ValueError(f"min_checks ({self.min_checks}) can't be more than max_checks ({self.max_checks})")
+        return self
+
+
 class OrchestratorServerConfig(BaseModel):
     server_needed: ServerType = Field(examples=[ServerType.LLM, ServerType.IMAGE])
     load_model_config: dict | None = Field(
@@ -54,12 +120,30 @@ class OrchestratorServerConfig(BaseModel):
     checking_function: str = Field(examples=["check_text_result", "check_image_result"])
     task: str = Field(examples=["chat-llama-3-1-8b"])
     endpoint: str = Field(examples=["/generate_text"])
+    # Sample the distances of text checks adaptively, instead of always checking up to 5 tokens
+    distance_sampling: Optional[DistanceSamplingConfig] = None
 
 
 class CheckResultsRequest(BaseModel):
     server_config: OrchestratorServerConfig
-    result: QueryResult
+    result: Optional[QueryResult] = None
+    # Several miners' responses to the same payload, checked together. Give either this or `result`
+    results: Optional[List[QueryResult]] = Field(default=None, min_length=1)
     payload: dict
+    # Seconds the check can take from being submitted, `settings.check_timeout_seconds` if not given
+    timeout_seconds: Optional[float] = Field(default=None, gt=0)
+    # When the check expires, as a unix timestamp. Set from `timeout_seconds` when the check is submitted
+    deadline: Optional[float] = None
+
+    @model_validator(mode="after")
+    def _has_results(self) -> CheckResultsRequest:
+        if (self.result is None) == (self.results is None):
+            raise ValueError("Give exactly one of `result` and `results`")
+        return self
+
+    @property
+    def query_results(self) -> List[QueryResult]:
+        return self.results if self.results is not None else [self.result]
 
 
 class Message(BaseModel):
@@ -159,6 +243,37 @@ class CheckResultResponse(BaseModel):
     status: TaskStatus
 
 
+class CheckResultsBatchResponse(BaseModel):
+    batch_id: Union[str, None]
+    task_ids: List[str]
+    status: TaskStatus
+
+
+class CheckBatchResponse(BaseModel):
+    batch_id: str
+    status: TaskStatus
+    statuses: Dict[str, TaskStatus]
+    results: Dict[str, TaskResult]
+
+
+class StreamCheckHeader(BaseModel):
+    """First line of a streamed check, the chunks of the miner's response follow it"""
+
+    server_config: OrchestratorServerConfig
+    payload: dict
+    node_id: Optional[int] = None
+    # Seconds the check can take from the header arriving, `settings.check_timeout_seconds` if not given
+    timeout_seconds: Optional[float] = Field(default=None, gt=0)
+
+
+class StreamCheckResponse(BaseModel):
+    status: TaskStatus
+    result: TaskResult
+    tokens_verified: int
+    # Whether the response failed before all of it was uploaded
+    rejected_early: bool
+
+
 class TaskResultResponse(BaseModel):
     task_id: str
     result: Union[Dict, str]
@@ -170,11 +285,33 @@ class CheckTaskResponse(BaseModel):
     status: TaskStatus
 
 
+class TraceSpan(BaseModel):
+    name: str
+    span_id: str
+    parent_span_id: Optional[str] = None
+    start_time_ns: int
+    duration_ms: float
+    attributes: Dict[str, Any] = {}
+    error: Optional[str] = None
+
+
+class CheckTrace(BaseModel):
+    trace_id: str
+    root_span_id: str
+    name: str
+    start_time_ns: int
+    duration_ms: float
+    attributes: Dict[str, Any] = {}
+    error: Optional[str] = None
+    spans: List[TraceSpan] = []
+
+
 class TaskResult(BaseModel):
     node_scores: Optional[AxonScores] = None
     timestamp: datetime
     error_message: Optional[str] = None
     traceback: Optional[str] = None
+    trace: Optional[CheckTrace] = None
 
 
 class TaskStatus(Enum):
@@ -183,7 +320,44 @@ class TaskStatus(Enum):
     Failed = "Failed"
     Busy = "Busy"
     Missing = "Missing"
+    # Ran out of time before it finished
+    Expired = "Expired"
+
+
+class TaskStoreStats(BaseModel):
+    size: int
+    capacity: int
+    evicted_expired: int
+    evicted_capacity: int
 
 
 class AllTaskStatusResponse(BaseModel):
     tasks: Dict[str, TaskStatus]
+    total: int
+    offset: int
+    limit: int
+    stats: TaskStoreStats
+
+
+class CheckerProfileResponse(BaseModel):
+    server_needed: Optional[ServerType]
+    max_concurrency: Optional[int]
+    batched: bool
+
+
+class QueueGroupStatus(BaseModel):
+    server_needed: str
+    model: Optional[str]
+    depth: int
+    oldest_wait_seconds: float
+
+
+class QueueStatusResponse(BaseModel):
+    queue_depth: int
+    busy_workers: int
+    num_workers: int
+    active_server: Optional[str] = None
+    active_model: Optional[str] = None
+    groups: List[QueueGroupStatus]
+    # Streamed checks running now, which take places in the queue without being in it
+    streaming_checks: int = 0
@@ -0,0 +1,129 @@
+"""
+Deadlines for checks, and upstream timeouts that follow how long each upstream endpoint usually takes.
+
+A check's deadline is held in a context variable while it runs, so every stage & upstream call under it sees it
+without it being passed around. Upstream calls time out after a few times the endpoint's recent p99 latency
+(never more than their usual fixed timeout), and never later than the deadline of the check they're for. A call
+that times out raises DeadlineExceeded: the upstream is slow, not down, so the check expires rather than fails.
+Calls to one endpoint can differ a lot in size (a 1 token completion vs the prompt logprobs of a long response),
+so their latencies are kept per size class: the power of 2 at or above the call's size.
+"""
+
+import contextlib
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterator, Tuple
+import httpx
+from app.core import metrics
+from app.core import tracing
+from app.settings import settings
+
+_deadline: ContextVar[float | None] = ContextVar("check_deadline", default=None)
+
+# (upstream, endpoint, size class)
+LatencyKey = Tuple[str, str, int]
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def deadline(at: float | None) -> Iterator[None]:
+    """Run the block with a deadline (a `time.time()` timestamp), or keep the current one if it's sooner"""
+    current = _deadline.get()
+    if at is None or (current is not None and current < at):
+        at = current
+    token = _deadline.set(at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> float | None:
+    """Seconds left before the current deadline, None if there isn't one"""
+    at = _deadline.get()
+    return None if at is None else at - time.time()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def size_class(size: int) -> int:
+    """The power of 2 at or above `size`, calls in the same class share their latencies"""
+    return 1 << max(size - 1, 0).bit_length()
+
+
+class LatencyModel:
+    """Recent latencies of each (upstream, endpoint, size class), and the timeouts they suggest"""
+
+    def __init__(
+        self,
+        window: int = settings.upstream_latency_window,
+        min_samples: int = settings.upstream_latency_min_samples,
+        multiplier: float = settings.upstream_timeout_multiplier,
+        min_timeout_seconds: float = settings.upstream_min_timeout_seconds,
+    ):
+        self.window = window
+        self.min_samples = min_samples
+        self.multiplier = multiplier
+        self.min_timeout_seconds = min_timeout_seconds
+        self._latencies: Dict[LatencyKey, Deque[float]] = {}
+        self._timeouts: Dict[LatencyKey, float] = {}
+
+    def observe(self, upstream: str, endpoint: str, seconds: float, size: int = 1) -> None:
+        self._latencies.setdefault((upstream, endpoint, size_class(size)), deque(maxlen=self.window)).append(seconds)
+
+    def p99(self, upstream: str, endpoint: str, size: int = 1) -> float | None:
+        latencies = self._latencies.get((upstream, endpoint, size_class(size)))
+        if latencies is None or len(latencies) < self.min_samples:
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+
+    def timeout(self, upstream: str, endpoint: str, default: float, size: int = 1) -> float:
+        """
+        Timeout for a call: `multiplier` times the p99 of the endpoint's calls of its size class (between
+        `min_timeout_seconds` & `default`), or `default` until there are enough samples. Raises DeadlineExceeded
+        if the current deadline has passed
+        """
+        timeout = default
+        p99 = self.p99(upstream, endpoint, size)
+        if p99 is not None:
+            timeout = min(default, max(self.min_timeout_seconds, self.multiplier * p99))
+        self._timeouts[(upstream, endpoint, size_class(size))] = timeout
+
+        left = remaining()
+        if left is not None:
+            if left <= 0:
+                raise DeadlineExceeded(f"No time left for {upstream} {endpoint}")
+            timeout = min(timeout, left)
+        return timeout
+
+    def timeouts(self) -> Dict[LatencyKey, float]:
+        """The latest timeout (before deadlines) of each (upstream, endpoint, size class)"""
+        return dict(self._timeouts)
+
+
+upstream_latency = LatencyModel()
+
+
+@contextlib.contextmanager
+def upstream_call(upstream: str, endpoint: str, default_timeout: float, size: int = 1) -> Iterator[float]:
+    """
+    Trace & time a call to an upstream, giving the timeout to make it with. Timed out calls count at their timeout.
+    `size` is how much work the call asks for, e.g. the number of prompt tokens
+    """
+    timeout = upstream_latency.timeout(upstream, endpoint, default_timeout, size)
+    started_at = time.perf_counter()
+    try:
+        with tracing.span(f"{upstream} {endpoint}"), metrics.upstream_request_duration_seconds.time(upstream=upstream, endpoint=endpoint):
+            yield timeout
+    except httpx.TimeoutException as e:
+        raise DeadlineExceeded(f"{upstream} {endpoint} took more than {timeout:.1f}s") from e
+    finally:
+        upstream_latency.observe(upstream, endpoint, time.perf_counter() - started_at, size)
@@ -0,0 +1,217 @@
+"""
+Lightweight per-check tracing.
+
+A trace is started for each check, and `span(...)` records how long each stage inside it takes.
+The current trace & span are tracked with contextvars, so spans opened in concurrent tasks spawned
+from a check still end up in that check's trace with the right parent.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import time
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional
+import httpx
+from loguru import logger
+from app.core import models
+from app.core.http_clients import EXTERNAL_UPSTREAM, http_clients
+
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("current_trace", default=None)
+_current_span_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_span_id", default=None)
+
+
+def _new_span_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class Trace:
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex
+        self.root_span_id = _new_span_id()
+        self.name = name
+        self.attributes = attributes
+        self.start_time_ns = time.time_ns()
+        self.duration_ms = 0.0
+        self.error: Optional[str] = None
+        self.spans: List[models.TraceSpan] = []
+
+    def to_model(self) -> models.CheckTrace:
+        return models.CheckTrace(
+            trace_id=self.trace_id,
+            root_span_id=self.root_span_id,
+            name=self.name,
+            start_time_ns=self.start_time_ns,
+            duration_ms=self.duration_ms,
+            attributes=self.attributes,
+            error=self.error,
+            spans=self.spans,
+        )
+
+
+class _TraceBuffer:
+    """The most recent finished traces, to find the slowest recent checks on /debug/traces"""
+
+    def __init__(self, max_traces: int):
+        self._traces: Deque[models.CheckTrace] = deque(maxlen=max_traces)
+
+    def add(self, trace: models.CheckTrace) -> None:
+        self._traces.append(trace)
+
+    def slowest(self, limit: int) -> List[models.CheckTrace]:
+        return sorted(self._traces, key=lambda trace: trace.duration_ms, reverse=True)[:limit]
+
+
+class OTLPExporter:
+    """Ships finished traces to an OTLP/HTTP collector (JSON encoding) in batches, in the background"""
+
+    def __init__(self, endpoint: str, service_name: str, flush_interval_seconds: float = 5, max_queued_traces: int = 1000):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self.flush_interval_seconds = flush_interval_seconds
+        self._queue: Deque[models.CheckTrace] = deque(maxlen=max_queued_traces)
+        self._flusher: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.flush()
+
+    def export(self, trace: models.CheckTrace) -> None:
+        self._queue.append(trace)
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._queue:
+            return
+        traces = list(self._queue)
+        self._queue.clear()
+        try:
+            response = await http_clients.client(EXTERNAL_UPSTREAM).post(self.url, json=self._to_otlp(traces), timeout=10)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to export {len(traces)} traces to {self.url}: {e}")
+
+    def _to_otlp(self, traces: List[models.CheckTrace]) -> dict:
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": _otlp_attributes({"service.name": self.service_name})},
+                    "scopeSpans": [{"scope": {"name": __name__}, "spans": [span for trace in traces for span in _otlp_spans(trace)]}],
+                }
+            ]
+        }
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[dict]:
+    otlp_attributes = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            otlp_value = {"boolValue": value}
+        elif isinstance(value, int):
+            otlp_value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            otlp_value = {"doubleValue": value}
+        else:
+            otlp_value = {"stringValue": str(value)}
+        otlp_attributes.append({"key": key, "value": otlp_value})
+    return otlp_attributes
+
+
+def _otlp_span(
+    trace_id: str, span_id: str, parent_span_id: Optional[str], name: str, start_time_ns: int, duration_ms: float, attributes: dict, error: Optional[str]
+) -> dict:
+    return {
+        "traceId": trace_id,
+        "spanId": span_id,
+        "parentSpanId": parent_span_id or "",
+        "name": name,
+        "kind": 1,
+        "startTimeUnixNano": str(start_time_ns),
+        "endTimeUnixNano": str(start_time_ns + int(duration_ms * 1e6)),
+        "attributes": _otlp_attributes(attributes),
+        "status": {"code": 2, "message": error} if error else {"code": 1},
+    }
+
+
+def _otlp_spans(trace: models.CheckTrace) -> List[dict]:
+    spans = [_otlp_span(trace.trace_id, trace.root_span_id, None, trace.name, trace.start_time_ns, trace.duration_ms, trace.attributes, trace.error)]
+    spans.extend(
+        _otlp_span(trace.trace_id, span.span_id, span.parent_span_id, span.name, span.start_time_ns, span.duration_ms, span.attributes, span.error)
+        for span in trace.spans
+    )
+    return spans
+
+
+trace_buffer = _TraceBuffer(max_traces=1000)
+exporter: OTLPExporter | None = None
+
+
+def configure(buffer_size: int, otlp_endpoint: str | None, service_name: str) -> None:
+    global trace_buffer, exporter
+    trace_buffer = _TraceBuffer(max_traces=buffer_size)
+    exporter = OTLPExporter(otlp_endpoint, service_name) if otlp_endpoint else None
+
+
+@contextlib.contextmanager
+def start_trace(name: str, **attributes: Any) -> Iterator[Trace]:
+    trace = Trace(name, attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span_id.set(trace.root_span_id)
+    started_at = time.perf_counter()
+    try:
+        yield trace
+    except BaseException as e:
+        trace.error = repr(e)
+        raise
+    finally:
+        trace.duration_ms = (time.perf_counter() - started_at) * 1000
+        _current_span_id.reset(span_token)
+        _current_trace.reset(trace_token)
+        finished_trace = trace.to_model()
+        trace_buffer.add(finished_trace)
+        if exporter is not None:
+            exporter.export(finished_trace)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: Any) -> Iterator[None]:
+    """Time a stage of the current check. Does nothing outside of a trace"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    span_id = _new_span_id()
+    parent_span_id = _current_span_id.get()
+    span_token = _current_span_id.set(span_id)
+    start_time_ns = time.time_ns()
+    started_at = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        _current_span_id.reset(span_token)
+        trace.spans.append(
+            models.TraceSpan(
+                name=name,
+                span_id=span_id,
+                parent_span_id=parent_span_id,
+                start_time_ns=start_time_ns,
+                duration_ms=(time.perf_counter() - started_at) * 1000,
+                attributes=attributes,
+                error=error,
+            )
+        )
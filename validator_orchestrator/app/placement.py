@@ -0,0 +1,218 @@
+"""
+Deciding which checking servers can stay up together, and on which GPUs.
+
+Each server needs some VRAM on each of its GPUs: vLLM takes `gpu_memory_utilization` of every GPU it's given,
+the image server about `settings.image_server_vram_mib`, and once a server has run we go by what it was seen to
+use (with headroom) when that's more. Whatever else is using the GPUs, e.g. processes that aren't ours, takes
+VRAM too. A server that's starting gets the GPUs it fits on best next to the servers already up; if it
+doesn't fit, the least recently used servers are evicted until it does.
+
+The GPUs come from an inventory: `NvidiaSmiInventory` normally, or a `StaticGpuInventory` (from
+`settings.gpu_memory_mib`, or a test's). With no GPUs known, every server evicts all of the others, like when
+only one checking server could run at a time.
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+from loguru import logger
+from app.core.models import ServerType
+from app.settings import settings
+
+ServerKey = tuple[str, str | None]
+
+
+class PlacementError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Gpu:
+    index: int
+    total_mib: int
+    # By anything, ours or not
+    used_mib: int = 0
+
+
+@dataclass
+class Resident:
+    """A server that's up, and what it holds"""
+
+    server: str
+    key: ServerKey
+    gpu_ids: Tuple[int, ...]
+    vram_mib: int
+    last_used: float = field(default_factory=time.monotonic)
+
+
+@dataclass(frozen=True)
+class Plan:
+    # None: the GPUs aren't known, use the default ones
+    gpu_ids: Tuple[int, ...] | None
+    vram_mib: int
+    # Servers to stop first, least recently used first
+    evict: List[str]
+
+
+class StaticGpuInventory:
+    """A fixed list of GPUs, e.g. from settings, or a test's"""
+
+    def __init__(self, gpus: List[Gpu]):
+        self._gpus = list(gpus)
+
+    async def gpus(self) -> List[Gpu]:
+        return list(self._gpus)
+
+
+class NvidiaSmiInventory:
+    """The GPUs `nvidia-smi` sees, limited to CUDA_VISIBLE_DEVICES. None if there's no nvidia-smi"""
+
+    def __init__(self, visible_devices: str | None = os.environ.get("CUDA_VISIBLE_DEVICES")):
+        self.visible_devices = visible_devices
+
+    async def gpus(self) -> List[Gpu]:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                "nvidia-smi",
+                "--query-gpu=index,memory.total,memory.used",
+                "--format=csv,noheader,nounits",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            stdout, stderr = await process.communicate()
+        except OSError as e:
+            logger.warning(f"Couldn't run nvidia-smi, GPUs are unknown: {e}")
+            return []
+        if process.returncode != 0:
+            logger.warning(f"nvidia-smi failed, GPUs are unknown: {stderr.decode().strip()}")
+            return []
+
+        gpus = []
+        for line in stdout.decode().splitlines():
+            if line.strip():
+                index, total_mib, used_mib = (int(value.strip()) for value in line.split(","))
+                gpus.append(Gpu(index=index, total_mib=total_mib, used_mib=used_mib))
+        if self.visible_devices and self.visible_devices != "all":
+            visible = {int(device) for device in self.visible_devices.split(",") if device.strip().isdigit()}
+            gpus = [gpu for gpu in gpus if gpu.index in visible]
+        return gpus
+
+
+def default_inventory() -> StaticGpuInventory | NvidiaSmiInventory:
+    if settings.gpu_memory_mib:
+        return StaticGpuInventory([Gpu(index=index, total_mib=total_mib) for index, total_mib in enumerate(settings.gpu_memory_mib)])
+    return NvidiaSmiInventory()
+
+
+def gpus_needed(server_type: ServerType, load_model_config: dict | None) -> int:
+    load_model_config = load_model_config or {}
+    if "num_gpus" in load_model_config:
+        return load_model_config["num_gpus"]
+    if server_type == ServerType.LLM:
+        return load_model_config.get("tensor_parallel_size", 1)
+    return 1
+
+
+def estimate_vram_mib(server_type: ServerType, load_model_config: dict | None, gpu_total_mib: int) -> int:
+    """VRAM a server needs on each of its GPUs, before we've seen it run"""
+    load_model_config = load_model_config or {}
+    if load_model_config.get("vram_mib"):
+        return load_model_config["vram_mib"]
+    if server_type == ServerType.LLM:
+        # vLLM pre-allocates this much of each GPU, whatever the model's size
+        return int(load_model_config.get("gpu_memory_utilization", 0.7) * gpu_total_mib)
+    return settings.image_server_vram_mib
+
+
+class PlacementPlanner:
+    """Where each checking server is, and where the next one should go"""
+
+    def __init__(self, inventory: StaticGpuInventory | NvidiaSmiInventory | None = None, co_resident: bool = settings.co_resident_servers):
+        self.inventory = inventory or default_inventory()
+        self.co_resident = co_resident
+        self.residents: Dict[str, Resident] = {}
+        # Most VRAM per GPU each (server, model) was seen to use
+        self._measured_mib: Dict[ServerKey, int] = {}
+
+    def vram_mib(self, key: ServerKey, server_type: ServerType, load_model_config: dict | None, gpu_total_mib: int) -> int:
+        estimate = estimate_vram_mib(server_type, load_model_config, gpu_total_mib)
+        measured = self._measured_mib.get(key)
+        if measured is not None:
+            # A server that was measured while it was still loading mustn't be squeezed below the estimate
+            return max(estimate, int(measured * settings.measured_vram_headroom))
+        return estimate
+
+    def _foreign_mib(self, gpus: List[Gpu]) -> Dict[int, int]:
+        """VRAM used on each GPU beyond what the servers that are up hold, by processes that aren't ours"""
+        foreign_mib = {gpu.index: gpu.used_mib for gpu in gpus}
+        for resident in self.residents.values():
+            for gpu_id in resident.gpu_ids:
+                if gpu_id in foreign_mib:
+                    foreign_mib[gpu_id] -= resident.vram_mib
+        return {gpu_id: max(used_mib, 0) for gpu_id, used_mib in foreign_mib.items()}
+
+    def _fit(
+        self, gpus: List[Gpu], foreign_mib: Dict[int, int], residents: List[Resident], number_of_gpus: int, vram_mib: Dict[int, int]
+    ) -> Tuple[int, ...] | None:
+        free_mib = {gpu.index: gpu.total_mib - foreign_mib[gpu.index] for gpu in gpus}
+        for resident in residents:
+            for gpu_id in resident.gpu_ids:
+                if gpu_id in free_mib:
+                    free_mib[gpu_id] -= resident.vram_mib
+        fitting = [gpu.index for gpu in gpus if free_mib[gpu.index] >= vram_mib[gpu.index]]
+        if len(fitting) < number_of_gpus:
+            return None
+        # Tightest fit first, so the emptiest GPUs are kept for bigger servers
+        return tuple(sorted(sorted(fitting, key=lambda gpu_id: free_mib[gpu_id] - vram_mib[gpu_id])[:number_of_gpus]))
+
+    async def plan(self, server: str, key: ServerKey, server_type: ServerType, load_model_config: dict | None) -> Plan:
+        """Where to start `server` for `key`, and which other servers have to go first. Its own old container always goes"""
+        others = sorted((resident for resident in self.residents.values() if resident.server != server), key=lambda resident: resident.last_used)
+        gpus = await self.inventory.gpus()
+        if not gpus or not self.co_resident:
+            return Plan(gpu_ids=None, vram_mib=0, evict=[resident.server for resident in others])
+
+        number_of_gpus = gpus_needed(server_type, load_model_config)
+        if number_of_gpus > len(gpus):
+            raise PlacementError(f"{key} needs {number_of_gpus} GPUs, there are {len(gpus)}")
+        vram_mib = {gpu.index: self.vram_mib(key, server_type, load_model_config, gpu.total_mib) for gpu in gpus}
+        foreign_mib = self._foreign_mib(gpus)
+
+        evict: List[str] = []
+        while (gpu_ids := self._fit(gpus, foreign_mib, others, number_of_gpus, vram_mib)) is None:
+            if not others:
+                raise PlacementError(f"{key} needs {max(vram_mib.values())} MiB on each of {number_of_gpus} GPUs, more than they have")
+            evict.append(others.pop(0).server)
+        return Plan(gpu_ids=gpu_ids, vram_mib=max(vram_mib[gpu_id] for gpu_id in gpu_ids), evict=evict)
+
+    async def used_mib(self) -> Dict[int, int]:
+        return {gpu.index: gpu.used_mib for gpu in await self.inventory.gpus()}
+
+    def placed(self, server: str, key: ServerKey, plan: Plan, used_before_mib: Dict[int, int], used_after_mib: Dict[int, int]) -> None:
+        """Record a server that's up, and the VRAM it took (by how much its GPUs' usage went up while it started)"""
+        vram_mib = plan.vram_mib
+        if plan.gpu_ids:
+            increases = [used_after_mib[gpu_id] - used_before_mib[gpu_id] for gpu_id in plan.gpu_ids if gpu_id in used_before_mib and gpu_id in used_after_mib]
+            if increases and max(increases) > 0:
+                self._measured_mib[key] = max(self._measured_mib.get(key, 0), max(increases))
+                logger.info(f"{key} took {max(increases)} MiB per GPU, planned {plan.vram_mib} MiB")
+                vram_mib = max(vram_mib, max(increases))
+        self.residents[server] = Resident(server=server, key=key, gpu_ids=plan.gpu_ids or (), vram_mib=vram_mib)
+
+    def removed(self, server: str) -> None:
+        self.residents.pop(server, None)
+
+    def touch(self, server: str) -> None:
+        resident = self.residents.get(server)
+        if resident is not None:
+            resident.last_used = time.monotonic()
+
+    def reserved_mib(self) -> Dict[Tuple[str], int]:
+        """VRAM held by the servers that are up, per GPU"""
+        reserved: Dict[Tuple[str], int] = {}
+        for resident in self.residents.values():
+            for gpu_id in resident.gpu_ids:
+                reserved[(str(gpu_id),)] = reserved.get((str(gpu_id),), 0) + resident.vram_mib
+        return reserved
@@ -1,18 +1,179 @@
 import os
-import subprocess
-from time import sleep
+import shlex
 import httpx
-from typing import Dict, Any
+from typing import Dict, Any, Awaitable, Callable
 import asyncio
+import contextlib
+import functools
+import itertools
+import time
 from loguru import logger
 from app.config import checking_server_configs, get_checking_server_config
-from app.core.models import ServerType
+from app.core.models import ServerType, OrchestratorServerConfig
 from app.core.constants import AI_SERVER_PORT
+from app.core import metrics
+from app.core import timeouts
+from app.core import tracing
+from app.core.docker_client import DockerError, DockerNotFound, docker_client
+from app.core.http_clients import http_clients
+from app.checking.model_metadata import model_metadata_cache
+from app.placement import Plan, PlacementPlanner, ServerKey
+
+# Wait before reconnecting to the docker event stream, doubling while the daemon can't be reached
+EVENTS_RETRY_SECONDS = 5
+EVENTS_MAX_RETRY_SECONDS = 5 * 60
+_SIZE_UNITS = {"b": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+# On the containers we start, set to the server's name
+CHECKING_SERVER_LABEL = "vision.checking_server"
+
+
+def _size_in_bytes(size: str) -> int:
+    """Docker style sizes, e.g. `10g`"""
+    size = size.strip().lower()
+    if size[-1:] in _SIZE_UNITS:
+        return int(float(size[:-1]) * _SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+def _is_checking_server_container(container: dict) -> bool:
+    """Whether a container (as listed) is one of our checking servers: labelled as one, or named like one from before the labels"""
+    if CHECKING_SERVER_LABEL in (container.get("Labels") or {}):
+        return True
+    server_names = {config.name for config in checking_server_configs}
+    return any(name.lstrip("/") in server_names for name in container.get("Names") or [])
+
+
+def server_key(task_config: OrchestratorServerConfig) -> ServerKey:
+    """
+    The (server, model) a check needs to be running. Checks with the same key can share a server.
+    """
+    load_model_config = task_config.load_model_config or {}
+    return task_config.server_needed.value, load_model_config.get("model")
+
+
+class ServerGate:
+    """
+    Lets any number of checks use the server that is currently loaded at the same time,
+    while swapping to a different server / model is exclusive: the swap waits for in-flight
+    checks to drain, and nothing uses the server until the swap is done.
+
+    Waiters are served in arrival order, so a check that needs a swap can't be starved by
+    a stream of checks for the server that is already loaded.
+    """
+
+    def __init__(self):
+        self.current_key: ServerKey | None = None
+        self.active_checks = 0
+        self.swap_count = 0
+        self._swapping = False
+        self._evicting = False
+        self._condition = asyncio.Condition()
+        self._tickets = itertools.count()
+        self._waiting: Dict[int, ServerKey] = {}
+
+    def _waiting_behind_other_key(self, ticket: int, key: ServerKey) -> bool:
+        return any(other_ticket < ticket and other_key != key for other_ticket, other_key in self._waiting.items())
+
+    async def _acquire(self, key: ServerKey) -> bool:
+        """Returns True if the caller now holds the server exclusively and must swap it to `key`"""
+        ticket = next(self._tickets)
+        async with self._condition:
+            self._waiting[ticket] = key
+            try:
+                while True:
+                    if not self._swapping and not self._evicting and not self._waiting_behind_other_key(ticket, key):
+                        if self.current_key == key:
+                            self.active_checks += 1
+                            return False
+                        if self.active_checks == 0:
+                            self._swapping = True
+                            return True
+                    await self._condition.wait()
+            finally:
+                del self._waiting[ticket]
+                self._condition.notify_all()
+
+    async def _finish_swap(self, key: ServerKey | None) -> None:
+        async with self._condition:
+            self._swapping = False
+            self.current_key = key
+            if key is not None:
+                self.swap_count += 1
+                self.active_checks += 1
+            self._condition.notify_all()
+
+    async def _release(self) -> None:
+        async with self._condition:
+            self.active_checks -= 1
+            self._condition.notify_all()
+
+    def invalidate(self) -> None:
+        """
+        Forget which server is loaded (e.g. it stopped responding), so the next check re-runs the swap
+        once the in-flight checks have drained.
+        """
+        self.current_key = None
+
+    def is_warm(self, key: ServerKey) -> bool:
+        """
+        Whether checks for `key` can start without a swap. Not while a check for another key is waiting, as
+        sending more work here would only delay its swap and then need the server swapped back.
+        """
+        return (
+            self.current_key == key
+            and not self._swapping
+            and not self._evicting
+            and all(waiting_key == key for waiting_key in self._waiting.values())
+        )
+
+    async def evict(self, stop: Callable[[], Awaitable[None]]) -> None:
+        """
+        Take the server down to make room for another one: new checks wait, in-flight ones drain, then `stop`
+        runs and the next check that needs the server swaps it back in. Unlike a swap this doesn't queue
+        behind waiting checks, as their swap may be waiting for the one that's evicting.
+        """
+        async with self._condition:
+            self._evicting = True
+            try:
+                while self.active_checks > 0:
+                    await self._condition.wait()
+            except BaseException:
+                self._evicting = False
+                self._condition.notify_all()
+                raise
+        try:
+            await stop()
+        finally:
+            async with self._condition:
+                self._evicting = False
+                self.current_key = None
+                self._condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def use(self, key: ServerKey, swap: Callable[[], Awaitable[None]]):
+        with tracing.span("server_gate_wait", server=key[0], model=key[1] or ""):
+            must_swap = await self._acquire(key)
+        if must_swap:
+            try:
+                with tracing.span("server_swap", server=key[0], model=key[1] or ""):
+                    await swap()
+            except BaseException:
+                await self._finish_swap(None)
+                raise
+            await self._finish_swap(key)
+        try:
+            yield
+        finally:
+            await self._release()
 
 
 class ServerManager:
     """
     This class manages starting, stopping, and handling of language and image servers.
+
+    Each server has its own gate, so checks for the LLM and the image server run side by side when both are up.
+    Swaps are one at a time (`swap_lock`), each planned by the placement planner: a server that doesn't fit
+    next to the others evicts the least recently used ones.
     """
 
     cuda_visible_devices = os.environ.get("CUDA_VISIBLE_DEVICES", None)
@@ -21,37 +182,68 @@ class ServerManager:
     else:
         gpus = "all"
 
-    docker_run_flags = f"--gpus {gpus} --runtime=nvidia"
-
-    def __init__(self):
-        self.server_process = None
+    def __init__(self, planner: PlacementPlanner | None = None):
         self.running_servers = {checking_server_config.name: False for checking_server_config in checking_server_configs}
-
-    def generate_gpu_string(self, num_gpus: int) -> str:
-        gpu_devices = ",".join(str(i) for i in range(num_gpus))
-        return f'--gpus "device={gpu_devices}" --runtime=nvidia'
-
-    def _kill_process_on_port(self, port):
+        # Ids of the containers we started, so events about containers that were replaced since can be ignored
+        self.container_ids: Dict[str, str] = {}
+        self.server_gates = {checking_server_config.name: ServerGate() for checking_server_config in checking_server_configs}
+        self.swap_lock = asyncio.Lock()
+        self.planner = planner or PlacementPlanner()
+
+    @contextlib.asynccontextmanager
+    async def use_server(self, task_config: OrchestratorServerConfig, swap: Callable[[], Awaitable[None]]):
+        """Hold the server a check needs, running `swap` first (one swap at a time) if it isn't up"""
+        key = server_key(task_config)
+
+        async def swap_alone() -> None:
+            async with self.swap_lock:
+                await swap()
+
+        async with self.server_gates[key[0]].use(key, swap=swap_alone):
+            self.planner.touch(key[0])
+            yield
+
+    def is_warm(self, key: ServerKey) -> bool:
+        gate = self.server_gates.get(key[0])
+        return gate is not None and gate.is_warm(key)
+
+    def invalidate(self, server_name: str) -> None:
+        """The server may have died, make the next check that needs it bring it back up"""
+        self.server_gates[server_name].invalidate()
+
+    def gpu_device_requests(self, num_gpus: int | None = None, gpu_ids: tuple[int, ...] | None = None) -> list[dict]:
+        """
+        The Engine API's equivalent of `--gpus`: the given GPUs, else the first `num_gpus`, else CUDA_VISIBLE_DEVICES
+        or all of them
         """
-        Stop and remove Docker container running on the given port.
+        device_request: Dict[str, Any] = {"Driver": "nvidia", "Capabilities": [["gpu"]]}
+        if gpu_ids:
+            device_request["DeviceIDs"] = [str(gpu_id) for gpu_id in gpu_ids]
+        elif num_gpus is not None:
+            device_request["DeviceIDs"] = [str(i) for i in range(num_gpus)]
+        elif self.gpus == "all":
+            device_request["Count"] = -1
+        else:
+            device_request["DeviceIDs"] = self.gpus.split(",")
+        return [device_request]
+
+    async def _kill_process_on_port(self, port):
+        """
+        Stop and remove our checking server containers running on the given port. Anything else on it (like the
+        orchestrator itself) is left alone.
         """
         try:
-            result = subprocess.run(
-                ["docker", "ps", "--filter", f"publish={port}", "--format", "{{.ID}}"],
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-            container_id = result.stdout.strip()
-
-            if container_id:
-                subprocess.run(["docker", "stop", container_id], check=True)
-                subprocess.run(["docker", "rm", container_id], check=True)
-                logger.info(f"Successfully stopped and removed the container running on port {port}.")
-            else:
+            containers = await docker_client.list_containers(filters={"publish": [str(port)]})
+            if not containers:
                 logger.info(f"No container is running on port {port}.")
-
-        except subprocess.CalledProcessError as e:
+            for container in containers:
+                if not _is_checking_server_container(container):
+                    logger.warning(f"{container['Names']} is running on port {port}, but isn't a checking server, leaving it")
+                    continue
+                await docker_client.stop_and_remove_container(container["Id"])
+                logger.info(f"Successfully stopped and removed the container running on port {port}: {container['Names']}.")
+
+        except DockerError as e:
             logger.error(f"Failed to stop the container running on port {port}: {e}")
 
     async def is_server_healthy(
@@ -67,29 +259,29 @@ class ServerManager:
         server_is_healthy = False
         i = 0
         await asyncio.sleep(sleep_time)
-        async with httpx.AsyncClient(timeout=5) as client:
-            while not server_is_healthy:
-                try:
-                    logger.info("Pinging " + f"http://{server_name}:{port}")
-                    response = await client.get(f"http://{server_name}:{port}")
+        client = http_clients.client(server_name)
+        while not server_is_healthy:
+            try:
+                logger.info("Pinging " + f"http://{server_name}:{port}")
+                response = await client.get(f"http://{server_name}:{port}", timeout=5)
+                server_is_healthy = response.status_code == 200
+                if not server_is_healthy:
+                    # Some servers don't have a health endpoint, so we try to ping the root first
+                    # then fall back to this (llm has health, image does not)
+                    response = await client.get(f"http://{server_name}:{port}/health", timeout=5)
                     server_is_healthy = response.status_code == 200
-                    if not server_is_healthy:
-                        # Some servers don't have a health endpoint, so we try to ping the root first
-                        # then fall back to this (llm has health, image does not)
-                        response = await client.get(f"http://{server_name}:{port}/health")
-                        server_is_healthy = response.status_code == 200
-
-                        await asyncio.sleep(sleep_time)
-                    else:
-                        logger.info(f"Server {port} is healthy!")
-                        return server_is_healthy, response.content.decode()
-                except httpx.RequestError:
+
                     await asyncio.sleep(sleep_time)
-                except KeyboardInterrupt:
-                    break
-                i += 1
-                if i > total_attempts:
-                    break
+                else:
+                    logger.info(f"Server {port} is healthy!")
+                    return server_is_healthy, response.content.decode()
+            except httpx.RequestError:
+                await asyncio.sleep(sleep_time)
+            except KeyboardInterrupt:
+                break
+            i += 1
+            if i > total_attempts or timeouts.expired():
+                break
         return server_is_healthy, None
 
     async def load_model(self, load_model_config: Dict[str, Any], server_name) -> None:
@@ -98,10 +290,11 @@ class ServerManager:
         """
         try:
             logger.debug(f"Loading model with config: {load_model_config}")
-            async with httpx.AsyncClient(timeout=1200) as client:
-                response = await client.post(
+            with timeouts.upstream_call(server_name, "/load_model", default_timeout=1200) as timeout:
+                response = await http_clients.client(server_name).post(
                     url=f"http://{server_name}:{AI_SERVER_PORT}/load_model",
                     json=load_model_config,
+                    timeout=timeout,
                 )
             return response
         except httpx.HTTPError:
@@ -118,12 +311,13 @@ class ServerManager:
             return
 
         logger.info(f"Starting server: {server_config.name}. First checking if anything is running on {server_config.port}...")
-        desired_server_is_online, response_content = await self.is_server_healthy(
-            port=server_config.port,
-            sleep_time=1,
-            total_attempts=3,
-            server_name=server_config.name,
-        )
+        with tracing.span("server_health_probe", server=server_config.name):
+            desired_server_is_online, response_content = await self.is_server_healthy(
+                port=server_config.port,
+                sleep_time=1,
+                total_attempts=3,
+                server_name=server_config.name,
+            )
         # is_server_healthy uses the server name. So if we get a 200, it was from the server we want to start, else the server
         # we want is not running
         self.running_servers[server_config.name] = desired_server_is_online
@@ -138,105 +332,195 @@ class ServerManager:
                     model_name=load_model_config["model"],
                 )
                 if correct_model_is_running:
+                    await self._adopt_running_server(server_config.name, server_type, load_model_config)
+                    await self._load_model_metadata(server_type, load_model_config)
                     return
             # no need for image tasks
             else:
+                await self._adopt_running_server(server_config.name, server_type, load_model_config)
                 return
 
-        # Check no other server is running on the same port
-        logger.info(f"Running servers: {self.running_servers}. Killing anything on port {server_config.port}...")
-        self._kill_process_on_port(server_config.port)
-        subprocess.Popen(f"docker rm -f {server_config.name}", shell=True).wait()
-        for server in self.running_servers:
-            self.running_servers[server] = False
-
-        docker_run_flags = self.docker_run_flags
+        swap_started_at = time.perf_counter()
+        key = (server_type.value, (load_model_config or {}).get("model"))
+        plan = await self.planner.plan(server_config.name, key, server_type, load_model_config)
+        logger.info(f"Running servers: {self.running_servers}. Placing {key} on GPUs {plan.gpu_ids}, evicting {plan.evict or 'nothing'}")
+        for server in plan.evict:
+            await self.server_gates[server].evict(functools.partial(self._stop_server_container, server))
+        await self._stop_server_container(server_config.name)
+        # Anything else on our port, e.g. left over from before servers had a port each
+        logger.info(f"Killing anything on port {server_config.external_port}...")
+        await self._kill_process_on_port(server_config.external_port)
+
+        num_gpus = None
         if load_model_config is not None and "num_gpus" in load_model_config.keys():
             num_gpus = load_model_config["num_gpus"]
-            docker_run_flags = self.generate_gpu_string(num_gpus)
 
+        # Arguments to the server in the container, despite the name
         extra_docker_flags = ""
         if "extra-docker-flags" in load_model_config.keys():
             extra_docker_flags = load_model_config["extra-docker-flags"]
 
-        sleep(2)
-
         shared_vol_size = os.getenv("SHARED_VOLUME_SIZE", "10g")
 
-        command = (
-            f"docker run -d --rm --shm-size={shared_vol_size} --name {server_config.name} "
-            + " ".join([f"-v {volume}:{mount_path}" for volume, mount_path in server_config.volumes.items()])
-            + " "
-            + " ".join([f"-e {key}={val}" for key, val in server_config.env_vars.items()])
-            + f" {docker_run_flags} "
-            + f"-p {server_config.external_port}:{server_config.port} "
-            + f"--network {server_config.network} "
-            + f"{server_config.docker_image} "
-        )
-        if extra_docker_flags:
-            command += f" {extra_docker_flags}"
+        # Same as `docker run -d --rm --shm-size ... --name ... -v ... -e ... --gpus ... -p ... --network ... image args`
+        container_port = f"{server_config.port}/tcp"
+        container_config = {
+            "Image": server_config.docker_image,
+            "Labels": {CHECKING_SERVER_LABEL: server_config.name},
+            "Cmd": shlex.split(extra_docker_flags) or None,
+            "Env": [f"{key}={val}" for key, val in server_config.env_vars.items()],
+            "ExposedPorts": {container_port: {}},
+            "HostConfig": {
+                "AutoRemove": True,
+                "ShmSize": _size_in_bytes(shared_vol_size),
+                "Binds": [f"{volume}:{mount_path}" for volume, mount_path in server_config.volumes.items()],
+                "Runtime": "nvidia",
+                "DeviceRequests": self.gpu_device_requests(num_gpus, plan.gpu_ids),
+                "PortBindings": {container_port: [{"HostPort": str(server_config.external_port)}]},
+                "NetworkMode": server_config.network,
+            },
+        }
 
         logger.info(f"Starting server: {server_config.name} 🦄")
-        logger.debug(f"docker run cmd : {command}")
+        logger.debug(f"Container config: {container_config}")
 
-        self.server_process = subprocess.Popen(command, shell=True)
+        used_before_mib = await self.planner.used_mib()
+        with tracing.span("container_start", server=server_config.name):
+            container_id = await docker_client.create_container(server_config.name, container_config)
+            self.container_ids[server_config.name] = container_id
+            await docker_client.start_container(container_id)
 
-        server_is_up = await self.is_server_healthy(
-            server_config.port,
-            server_name=server_config.name,
-        )
+            server_is_up = await self._wait_until_healthy(server_config.name, server_config.port, container_id)
         if not server_is_up:
-            raise Exception(f"Timeout when starting server {server_config.name}")
+            raise Exception(f"Server {server_config.name} didn't become healthy")
 
         self.running_servers[server_config.name] = True
+        self.planner.placed(server_config.name, key, plan, used_before_mib, await self.planner.used_mib())
+        metrics.container_starts_total.inc(server=server_config.name, model=(load_model_config or {}).get("model", ""))
+        metrics.container_start_duration_seconds.observe(time.perf_counter() - swap_started_at, server=server_config.name)
+        await self._load_model_metadata(server_type, load_model_config)
+
+    async def _stop_server_container(self, server_name: str) -> None:
+        # Before stopping it, so the watcher knows it was stopped on purpose
+        self.running_servers[server_name] = False
+        self.container_ids.pop(server_name, None)
+        self.planner.removed(server_name)
+        await docker_client.stop_and_remove_container(server_name)
+        # Pooled connections to the old container are dead now
+        await http_clients.reset(server_name)
+        if server_name == ServerType.LLM.value:
+            model_metadata_cache.invalidate()
+
+    async def _adopt_running_server(self, server_name: str, server_type: ServerType, load_model_config: dict | None) -> None:
+        """Account for a server that was already up (e.g. from before a restart), on the GPUs its container has"""
+        if server_name in self.planner.residents:
+            return
+        key = (server_type.value, (load_model_config or {}).get("model"))
+        gpus = await self.planner.inventory.gpus()
+        gpu_ids: tuple[int, ...] = tuple(gpu.index for gpu in gpus)
+        try:
+            container = await docker_client.inspect_container(server_name)
+            for device_request in container.get("HostConfig", {}).get("DeviceRequests") or []:
+                if device_request.get("DeviceIDs"):
+                    gpu_ids = tuple(int(device) for device in device_request["DeviceIDs"] if device.isdigit())
+        except DockerError as e:
+            logger.warning(f"Couldn't find which GPUs {server_name} is on, assuming all of them: {e}")
+        gpu_total_mib = min((gpu.total_mib for gpu in gpus if gpu.index in gpu_ids), default=0)
+        vram_mib = self.planner.vram_mib(key, server_type, load_model_config, gpu_total_mib)
+        self.planner.placed(server_name, key, Plan(gpu_ids=gpu_ids, vram_mib=vram_mib, evict=[]), {}, {})
+
+    async def _wait_until_healthy(self, server_name: str, port: int, container_id: str) -> bool:
+        """Poll a new container until it's healthy, giving up as soon as it exits (e.g. the model doesn't fit)"""
+        healthy = asyncio.create_task(self.is_server_healthy(port, server_name=server_name))
+        exited = asyncio.create_task(docker_client.wait_container(container_id, condition="not-running"))
+        try:
+            done, _ = await asyncio.wait({healthy, exited}, return_when=asyncio.FIRST_COMPLETED)
+            if healthy not in done:
+                error = exited.exception()
+                if error is None or isinstance(error, DockerNotFound):
+                    # Not found: it exited & was auto-removed already
+                    exit_code = "unknown" if error is not None else exited.result().get("StatusCode")
+                    logger.error(f"Container {server_name} exited with code {exit_code} before it was healthy")
+                    return False
+                logger.warning(f"Couldn't watch container {server_name} for exits while it starts: {error}")
+            server_is_up, _ = await healthy
+            return server_is_up
+        finally:
+            healthy.cancel()
+            exited.cancel()
+
+    async def _load_model_metadata(self, server_type: ServerType, load_model_config: dict | None) -> None:
+        if server_type != ServerType.LLM or load_model_config is None:
+            return
+        try:
+            await model_metadata_cache.build(load_model_config)
+        except Exception as e:
+            logger.warning(f"Couldn't look up the metadata of {load_model_config.get('model')}, checks will try again: {e}")
 
     async def stop_server(self):
         """
-        Stop the currently running server.
+        Stop the running servers.
         """
         for server_name, is_running in self.running_servers.items():
             if is_running:
                 logger.info(f"Stopping the running server container {server_name} 😈")
 
                 try:
-                    subprocess.run(["docker", "stop", server_name], check=True)
-                    subprocess.run(["docker", "rm", server_name], check=True)
+                    await self._stop_server_container(server_name)
                     logger.info(f"Successfully stopped and removed the container: {server_name}")
-                except subprocess.CalledProcessError as e:
+                except DockerError as e:
                     logger.error(f"Failed to stop the container {server_name}: {e}")
 
-                self.running_servers[server_name] = False
-
-        self.server_process = None
-
-    def _is_container_running(self, container_name: str) -> bool:
+    async def _is_container_running(self, container_name: str) -> bool:
         try:
-            result = subprocess.run(
-                [
-                    "docker",
-                    "ps",
-                    "--filter",
-                    f"name={container_name}",
-                    "--format",
-                    "{{.Names}}",
-                ],
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-            return container_name in result.stdout.split()
-        except subprocess.CalledProcessError:
+            containers = await docker_client.list_containers(filters={"name": [container_name]})
+        except DockerError:
             return False
+        # The name filter matches substrings, names come back with a leading slash
+        return any(f"/{container_name}" in container["Names"] for container in containers)
+
+    def _container_died(self, event: dict) -> None:
+        attributes = event.get("Actor", {}).get("Attributes", {})
+        server_name = attributes.get("name")
+        container_id = event.get("id") or event.get("Actor", {}).get("ID")
+        known_id = self.container_ids.get(server_name)
+        if known_id != container_id and (known_id is not None or not self.running_servers.get(server_name)):
+            # We stopped it, or it's an old container that was replaced. Ids are only unknown for containers
+            # that were already up when we started
+            return
+        logger.error(f"Container {server_name} died (exit code {attributes.get('exitCode')}), it will be restarted by the next check that needs it")
+        self.running_servers[server_name] = False
+        self.container_ids.pop(server_name, None)
+        self.planner.removed(server_name)
+        if server_name in self.server_gates:
+            self.invalidate(server_name)
+        metrics.container_exits_total.inc(server=server_name)
+
+    async def watch_containers(self) -> None:
+        """
+        Follow the checking servers' containers through the docker event stream, so one that dies is noticed
+        straight away (instead of by the checks that fail against it) and started again by the next check
+        """
+        server_names = [checking_server_config.name for checking_server_config in checking_server_configs]
+        retry_seconds = EVENTS_RETRY_SECONDS
+        while True:
+            try:
+                async for event in docker_client.events(filters={"type": ["container"], "event": ["die"], "container": server_names}):
+                    retry_seconds = EVENTS_RETRY_SECONDS
+                    self._container_died(event)
+            except DockerError as e:
+                logger.warning(f"Lost the docker event stream, retrying in {retry_seconds}s: {e}")
+            await asyncio.sleep(retry_seconds)
+            retry_seconds = min(2 * retry_seconds, EVENTS_MAX_RETRY_SECONDS)
 
     @staticmethod
     async def _check_correct_model_is_running(server_name: str, port: int, model_name: str):
-        async with httpx.AsyncClient(timeout=5) as client:
-            response = await client.get(f"http://{server_name}:{port}/v1/models")
-            if response.status_code != 200:
-                logger.error(f"Server {server_name} is running, but /v1/models returned {response.status_code}???")
-                logger.exception(response.text)
-                return False
-            model_loaded = response.json()["data"][0]["id"]
-            correct_model_is_running = model_loaded == model_name
-            logger.info(f"Server {server_name} is running. Model is correct: {correct_model_is_running}")
-            return correct_model_is_running
+        response = await http_clients.client(server_name).get(f"http://{server_name}:{port}/v1/models", timeout=5)
+        if response.status_code != 200:
+            logger.error(f"Server {server_name} is running, but /v1/models returned {response.status_code}???")
+            logger.exception(response.text)
+            return False
+        model_loaded = response.json()["data"][0]["id"]
+        correct_model_is_running = model_loaded == model_name
+        logger.info(f"Server {server_name} is running. Model is correct: {correct_model_is_running}")
+        return correct_model_is_running
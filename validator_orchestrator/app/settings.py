@@ -2,10 +2,102 @@ from pydantic_settings import BaseSettings
 from enum import Enum
 
 
+class TokenizerMode(str, Enum):
+    # Tokenise with the llm_server's /tokenize & /detokenize
+    SERVER = "server"
+    # Tokenise in-process, falling back to the server for tokenizers that can't be loaded
+    LOCAL = "local"
+    # Tokenise in-process, but also ask the server & log any difference
+    PARITY = "parity"
+
+
+class TextVerificationMode(str, Enum):
+    # Ask the llm_server for the top logprobs at each checked token
+    MULTI_PASS = "multi_pass"
+    # Work them out from the prompt logprobs of the whole response, fetched once
+    SINGLE_PASS = "single_pass"
+    # Score with the multi pass, but also work out the single pass score & log any difference
+    COMPARE = "compare"
+
+
 class Settings(BaseSettings):
     version: str = "1.1.0"
     environment: str = "prod"
     debug: bool = False
     cors_origins: list[str] = ["*"]
 
+    # Checking worker pool
+    check_workers: int = 4
+    max_queued_checks: int = 1000
+    # Longest a group of checks for one server / model can wait while another group is being drained
+    max_group_wait_seconds: float = 300
+    image_server_concurrency: int = 1
+    # Longest a check can take from being submitted, unless its request says otherwise. Past it, it's Expired.
+    # Longer than the 20 minutes a server swap can take
+    check_timeout_seconds: float = 30 * 60
+
+    # Upstream timeouts: a multiple of the endpoint's p99 latency over its recent calls, once there are enough
+    upstream_latency_window: int = 200
+    upstream_latency_min_samples: int = 20
+    upstream_timeout_multiplier: float = 3
+    upstream_min_timeout_seconds: float = 1
+
+    # Task store
+    max_stored_tasks: int = 100_000
+    task_expiry_seconds: float = 60 * 60
+    # Set to persist tasks to a SQLite file, so they survive restarts
+    task_store_path: str | None = None
+    task_store_flush_interval_seconds: float = 0.5
+
+    # Results of recent checks, returned for exact repeats. 0 entries turns it off
+    score_memo_max_entries: int = 10_000
+    score_memo_ttl_seconds: float = 10 * 60
+
+    # Outbound HTTP, pooled per upstream. HTTP/2 needs the `h2` package
+    http2: bool = False
+    http_default_timeout_seconds: float = 5
+    http_keepalive_expiry_seconds: float = 30
+    llm_server_max_connections: int = 100
+    image_server_max_connections: int = 10
+    external_max_connections: int = 20
+
+    # Docker Engine API, for starting & stopping the checking servers
+    docker_socket_path: str = "/var/run/docker.sock"
+    # e.g. "1.41", unset to use the daemon's
+    docker_api_version: str | None = None
+    # How long a stopping container gets to exit before it's killed
+    docker_stop_timeout_seconds: int = 10
+
+    # Checking servers' GPUs
+    # Keep several checking servers up at once when they fit in VRAM, instead of one at a time
+    co_resident_servers: bool = True
+    # Memory of each GPU, e.g. [81920, 81920], instead of asking nvidia-smi
+    gpu_memory_mib: list[int] | None = None
+    # VRAM the image server needs until it's been seen running. Load configs can set `vram_mib` instead
+    image_server_vram_mib: int = 20 * 1024
+    # Servers get this much more than they were seen to use, for peaks
+    measured_vram_headroom: float = 1.1
+
+    # Text checks
+    # Where the llm_server's vLLM API is, e.g. a stub one for benchmarks
+    llm_server_url: str = "http://llm_server:6919"
+    tokenizer_mode: TokenizerMode = TokenizerMode.LOCAL
+    # Directory with a tokenizer per subdirectory, named like `load_model_config["tokenizer"]`, for running offline
+    local_tokenizers_dir: str | None = None
+    # A tokenizer that failed to load is tried again after this long, doubling after each failure up to the max
+    tokenizer_load_retry_seconds: float = 60
+    tokenizer_load_max_retry_seconds: float = 3600
+    text_verification_mode: TextVerificationMode = TextVerificationMode.MULTI_PASS
+    # Memory the cache of templated chat prompts can use
+    prompt_cache_max_bytes: int = 64 * 1024 * 1024
+    # Most fine grained distance checks a single text check runs at once
+    distance_check_fan_out: int = 5
+    # Streamed text checks verify the response against the prompt logprobs once this many new tokens are in (or as
+    # many as were already verified, if that's more)
+    stream_check_window_tokens: int = 16
+
+    # Tracing
+    trace_buffer_size: int = 1000
+    otlp_traces_endpoint: str | None = None
+
 settings = Settings()
@@ -0,0 +1,330 @@
+"""
+Throughput of text checks against the stub vLLM server, no GPU needed.
+
+Replays chat & completions checks (mostly honest responses, some garbage) through `check_text_result` directly
+and through `process_check_result` (the whole path a queued check takes), and reports checks/s, p50/p99 latency,
+upstream calls per check & peak traced memory. Run from `validator_orchestrator/`:
+
+    python -m benchmarks.bench_text_checks --checks 200 --concurrency 8 --json results.json
+
+In CI, pass `--baseline` a previous results file to fail when throughput or p99 latency regress.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+import httpx
+from loguru import logger
+from benchmarks import stub_vllm
+
+MODEL = "stub/llama-3-8b-instruct"
+CHECKING_FUNCTION = "check_text_result"
+TARGETS = ("check_text_result", "process_check_result")
+PAYLOADS_PATH = Path(__file__).resolve().parent.parent / "tests" / "test_payloads.json"
+# Checks run with tracemalloc on, which is too slow for the timed runs
+ALLOCATION_CHECKS = 20
+
+
+@dataclass
+class BenchResult:
+    target: str
+    checks: int
+    concurrency: int
+    checks_per_second: float
+    p50_ms: float
+    p99_ms: float
+    mean_score: float
+    upstream_calls_per_check: Dict[str, float]
+    peak_traced_memory_kib: float
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_stub(args: argparse.Namespace) -> tuple[subprocess.Popen, str]:
+    port = _free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "benchmarks.stub_vllm", "--port", str(port), "--model", MODEL,
+            "--latency-ms", str(args.latency_ms), "--latency-per-token-us", str(args.latency_per_token_us),
+        ],
+        cwd=Path(__file__).resolve().parent.parent,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            if httpx.get(f"{url}/health").status_code == 200:
+                return process, url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("The stub vLLM server didn't start")
+
+
+def _chat_prompts() -> List[List[dict]]:
+    prompts = [[{"role": "user", "content": "Write a short story about a river."}], [{"role": "user", "content": "What is a large city known for?"}]]
+    try:
+        for entry in json.loads(PAYLOADS_PATH.read_text()):
+            if "synapse" in entry and "messages" in entry["synapse"]:
+                prompts.append(entry["synapse"]["messages"])
+    except (OSError, ValueError):
+        pass
+    prompts.append([*prompts[0], {"role": "assistant", "content": "The river was small."}, {"role": "user", "content": "Make it longer."}])
+    return prompts
+
+
+def _honest_response(context: List[int], number_of_tokens: int, rng: random.Random) -> List[tuple[str, float]]:
+    """Tokens the stub model would sample, with top k = 5, and their logprobs"""
+    response = []
+    for _ in range(number_of_tokens):
+        candidates = [(token_id, logprob) for token_id, logprob in stub_vllm.distribution(context)[:5] if token_id != stub_vllm.EOS_TOKEN_ID]
+        normaliser = math.log(sum(math.exp(logprob) for _, logprob in stub_vllm.distribution(context)[:5]))
+        token_id, logprob = rng.choices(candidates, weights=[math.exp(logprob) for _, logprob in candidates])[0]
+        response.append((stub_vllm.detokenize([token_id]), logprob - normaliser))
+        context = [*context, token_id]
+    return response
+
+
+def _garbage_response(number_of_tokens: int, rng: random.Random) -> List[tuple[str, float]]:
+    return [(rng.choice(stub_vllm.VOCABULARY), -0.1) for _ in range(number_of_tokens)]
+
+
+def _chat_chunks(response: List[tuple[str, float]]) -> List[dict]:
+    chunks = [{"choices": [{"delta": {"role": "assistant", "content": ""}, "logprobs": None}]}]
+    for token, logprob in response:
+        chunks.append({"choices": [{"delta": {"content": token}, "logprobs": {"content": [{"token": token, "logprob": logprob}]}}]})
+    return chunks
+
+
+def _completions_chunks(response: List[tuple[str, float]]) -> List[dict]:
+    return [{"choices": [{"text": token, "logprobs": {"tokens": [token], "token_logprobs": [logprob]}}]} for token, logprob in response]
+
+
+def build_workload(args: argparse.Namespace) -> List[Any]:
+    """The checks to replay, as `CheckResultsRequest`s"""
+    from app.core import models
+
+    rng = random.Random(args.seed)
+    chat_prompts = _chat_prompts()
+    server_config = models.OrchestratorServerConfig(
+        server_needed=models.ServerType.LLM,
+        load_model_config={"model": MODEL, "tokenizer": MODEL, "eos_token_id": stub_vllm.EOS_TOKEN_ID},
+        checking_function=CHECKING_FUNCTION,
+        task="chat-bench",
+        endpoint="/generate_text",
+        distance_sampling=models.DistanceSamplingConfig() if args.adaptive_sampling else None,
+    )
+
+    requests = []
+    for node_id in range(args.checks):
+        payload = {"temperature": 0.5, "seed": rng.randrange(2**31), "max_tokens": args.response_tokens + 16, "top_p": 1.0, "model": MODEL}
+        if rng.random() < args.completions_fraction:
+            payload["prompt"] = " ".join(rng.choices(stub_vllm.WORDS, k=rng.randint(8, 64)))
+            context = stub_vllm.tokenize(payload["prompt"], add_special_tokens=False)
+            to_chunks = _completions_chunks
+        else:
+            payload["messages"] = rng.choice(chat_prompts)
+            context = stub_vllm.tokenize(stub_vllm.render_chat(payload["messages"]), add_special_tokens=False)
+            to_chunks = _chat_chunks
+
+        if rng.random() < args.bad_fraction:
+            response = _garbage_response(args.response_tokens, rng)
+        else:
+            response = _honest_response(context, args.response_tokens, rng)
+        result = models.QueryResult(formatted_response=to_chunks(response), node_id=node_id, response_time=1.0)
+        requests.append(models.CheckResultsRequest(server_config=server_config, result=result, payload=payload))
+    return requests
+
+
+async def _run_checks(run_check: Callable[[Any], Awaitable[float | None]], requests: List[Any], concurrency: int) -> tuple[float, List[float], List[float]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    scores: List[float] = []
+
+    async def _timed(request: Any) -> None:
+        async with semaphore:
+            started_at = time.perf_counter()
+            score = await run_check(request)
+            latencies.append(time.perf_counter() - started_at)
+            if score is not None:
+                scores.append(score)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*[_timed(request) for request in requests])
+    return time.perf_counter() - started_at, latencies, scores
+
+
+def _check_runner(target: str) -> Callable[[Any], Awaitable[float | None]]:
+    from uuid import uuid4
+    from app import server_management
+    from app.checking.endpoints import process_check_result
+    from app.checking.registry import checker_registry
+    from app.checking.task_manager import task_manager
+
+    if target == "check_text_result":
+        check = checker_registry.get(CHECKING_FUNCTION).func
+
+        async def run_check(request: Any) -> float | None:
+            return await check(request.result, request.payload, request.server_config)
+
+        return run_check
+
+    # The stub is already serving the model, so the gate never swaps
+    server_manager = server_management.ServerManager()
+
+    async def run_check(request: Any) -> float | None:
+        key = server_management.server_key(request.server_config)
+        server_manager.server_gates[key[0]].current_key = key
+        task_id = str(uuid4())
+        task_manager.add_task(task_id, request)
+        await process_check_result(task_id, request, server_manager)
+        _, result = task_manager.clear_and_return_task_status_and_result(task_id)
+        return (result.node_scores or {}).get(request.result.node_id) if result is not None else None
+
+    return run_check
+
+
+async def _upstream_calls(stub_url: str) -> Dict[str, int]:
+    async with httpx.AsyncClient() as client:
+        return (await client.get(f"{stub_url}/stats")).json()
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))]
+
+
+async def bench(args: argparse.Namespace, stub_url: str) -> List[BenchResult]:
+    from app.checking.registry import checker_registry
+    from app.checking.score_memo import score_memo
+    from app.core.http_clients import http_clients
+
+    checker_registry.load()
+    requests = build_workload(args)
+    results = []
+    try:
+        for target in args.targets:
+            run_check = _check_runner(target)
+            # Warm up connections & caches, and don't let the score memo answer repeats of the warm up
+            await _run_checks(run_check, requests[: args.concurrency], args.concurrency)
+            score_memo.clear()
+
+            calls_before = await _upstream_calls(stub_url)
+            elapsed, latencies, scores = await _run_checks(run_check, requests, args.concurrency)
+            calls_after = await _upstream_calls(stub_url)
+            score_memo.clear()
+
+            tracemalloc.start()
+            await _run_checks(run_check, requests[:ALLOCATION_CHECKS], args.concurrency)
+            _, peak_traced_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            score_memo.clear()
+
+            results.append(
+                BenchResult(
+                    target=target,
+                    checks=len(requests),
+                    concurrency=args.concurrency,
+                    checks_per_second=len(requests) / elapsed,
+                    p50_ms=_percentile(latencies, 50) * 1000,
+                    p99_ms=_percentile(latencies, 99) * 1000,
+                    mean_score=statistics.fmean(scores) if scores else 0.0,
+                    upstream_calls_per_check={
+                        endpoint: (calls_after.get(endpoint, 0) - calls_before.get(endpoint, 0)) / len(requests) for endpoint in sorted(calls_after)
+                    },
+                    peak_traced_memory_kib=peak_traced_memory / 1024,
+                )
+            )
+    finally:
+        await http_clients.close()
+    return results
+
+
+def _print_results(results: List[BenchResult]) -> None:
+    print(f"{'target':<24}{'checks/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'score':>8}{'peak KiB':>11}  upstream calls per check")
+    for result in results:
+        calls = ", ".join(f"{endpoint} {calls:.2f}" for endpoint, calls in result.upstream_calls_per_check.items())
+        print(
+            f"{result.target:<24}{result.checks_per_second:>10.1f}{result.p50_ms:>10.1f}{result.p99_ms:>10.1f}"
+            f"{result.mean_score:>8.3f}{result.peak_traced_memory_kib:>11.0f}  {calls}"
+        )
+
+
+def _regressions(results: List[BenchResult], baseline_path: str, max_regression: float) -> List[str]:
+    baseline = {result["target"]: result for result in json.loads(Path(baseline_path).read_text())["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result.target)
+        if previous is None:
+            continue
+        if result.checks_per_second < previous["checks_per_second"] * (1 - max_regression):
+            regressions.append(f"{result.target}: {result.checks_per_second:.1f} checks/s, was {previous['checks_per_second']:.1f}")
+        if result.p99_ms > previous["p99_ms"] * (1 + max_regression):
+            regressions.append(f"{result.target}: p99 {result.p99_ms:.1f} ms, was {previous['p99_ms']:.1f}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checks", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--response-tokens", type=int, default=256)
+    parser.add_argument("--completions-fraction", type=float, default=0.25, help="Share of checks for /completions payloads, the rest are chat")
+    parser.add_argument("--bad-fraction", type=float, default=0.1, help="Share of responses that are garbage & should fail")
+    parser.add_argument("--latency-ms", type=float, default=2, help="Latency the stub adds to every request")
+    parser.add_argument("--latency-per-token-us", type=float, default=5, help="Latency the stub adds per prompt token of a completion")
+    parser.add_argument("--adaptive-sampling", action="store_true", help="Check distances with the default adaptive sampling policy")
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=list(TARGETS))
+    parser.add_argument("--stub-url", help="Use an already running stub (or vLLM) server instead of starting one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING", help="Orchestrator log level; INFO logs every token checked")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Results file of a previous run, exit 1 if this one regressed against it")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative drop in checks/s (or rise in p99) from the baseline")
+    args = parser.parse_args()
+
+    stub_process = None
+    stub_url = args.stub_url
+    if stub_url is None:
+        stub_process, stub_url = _start_stub(args)
+    # The app reads its settings on import, so point it at the stub first. The stub does the tokenising
+    os.environ["LLM_SERVER_URL"] = stub_url
+    os.environ.setdefault("TOKENIZER_MODE", "server")
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    try:
+        results = asyncio.run(bench(args, stub_url))
+    finally:
+        if stub_process is not None:
+            stub_process.terminate()
+            stub_process.wait()
+
+    _print_results(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps({"args": vars(args), "results": [asdict(result) for result in results]}, indent=2))
+    if args.baseline:
+        regressions = _regressions(results, args.baseline, args.max_regression)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+A stand-in for the vLLM OpenAI server the text checks talk to, so checking can be benchmarked without a GPU.
+
+It serves /tokenize, /detokenize and /v1/completions (with `logprobs` & `prompt_logprobs`) for any model name.
+Tokens are words & punctuation with stable ids, the chat template is a cut down llama 3 one, and the "model" is
+deterministic: the top tokens after a context & their logprobs only depend on its last few tokens, so miner
+responses made with `distribution` check out exactly like honest ones would.
+
+Run it with `python -m benchmarks.stub_vllm --port 6919 --latency-ms 5`.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import uvicorn
+from fastapi import FastAPI, Response
+from pydantic import BaseModel
+
+BOS_TOKEN = "<|begin_of_text|>"
+EOS_TOKEN = "<|eot_id|>"
+SPECIAL_TOKEN_IDS = {BOS_TOKEN: 128000, "<|start_header_id|>": 128006, "<|end_header_id|>": 128007, EOS_TOKEN: 128009}
+EOS_TOKEN_ID = SPECIAL_TOKEN_IDS[EOS_TOKEN]
+
+WORDS = (
+    "the of and to in is was for on that with as by it at from his an were are which this be or has had not but "
+    "first one their its new after who they have her she two been other when there all during into school time may "
+    "years more most only over city some world would where later up such used many can state about national out "
+    "known university united then made also what small large window light river house music group game team film"
+).split()
+# Tokens the model picks from: words, each with a leading space like BPE vocabularies have
+VOCABULARY = [f" {word}" for word in WORDS] + [".", ",", "!", "?"]
+
+# How many of the last tokens of the context the distribution depends on
+CONTEXT_TOKENS = 3
+# Size of the distribution after any context. The eos token is always in it, at EOS_RANK
+DISTRIBUTION_SIZE = 20
+EOS_RANK = 8
+MAX_MODEL_LEN = 8192
+# Logprob of a token the model would never pick
+UNLIKELY_LOGPROB = -20.0
+
+_TOKEN_PATTERN = re.compile("|".join(re.escape(token) for token in SPECIAL_TOKEN_IDS) + r"|\s?\w+|\s?[^\w\s]|\s+")
+
+
+def _token_id(token: str) -> int:
+    if token in SPECIAL_TOKEN_IDS:
+        return SPECIAL_TOKEN_IDS[token]
+    # Below the special token ids; collisions between the tokens we see are negligible
+    return 1000 + int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little") % 100_000
+
+
+_id_to_token: Dict[int, str] = {token_id: token for token, token_id in SPECIAL_TOKEN_IDS.items()}
+for _token in VOCABULARY:
+    _id_to_token[_token_id(_token)] = _token
+VOCABULARY_IDS = [_token_id(token) for token in VOCABULARY]
+
+
+def tokenize(text: str, add_special_tokens: bool = True) -> List[int]:
+    token_ids = []
+    for token in _TOKEN_PATTERN.findall(text):
+        token_id = _token_id(token)
+        _id_to_token.setdefault(token_id, token)
+        token_ids.append(token_id)
+    if add_special_tokens and (not token_ids or token_ids[0] != SPECIAL_TOKEN_IDS[BOS_TOKEN]):
+        token_ids.insert(0, SPECIAL_TOKEN_IDS[BOS_TOKEN])
+    return token_ids
+
+
+def detokenize(token_ids: Sequence[int]) -> str:
+    return "".join(_id_to_token.get(token_id, "") for token_id in token_ids)
+
+
+def render_chat(messages: List[dict], add_generation_prompt: bool = True) -> str:
+    prompt = BOS_TOKEN
+    for message in messages:
+        prompt += f"<|start_header_id|>{message['role']}<|end_header_id|>{message['content']}{EOS_TOKEN}"
+    if add_generation_prompt:
+        prompt += "<|start_header_id|>assistant<|end_header_id|>"
+    return prompt
+
+
+@lru_cache(maxsize=100_000)
+def _distribution(context: Tuple[int, ...]) -> Tuple[Tuple[int, float], ...]:
+    rng = random.Random(hash(context))
+    token_ids = rng.sample(VOCABULARY_IDS, DISTRIBUTION_SIZE - 1)
+    token_ids.insert(EOS_RANK - 1, EOS_TOKEN_ID)
+    logits = [-0.6 * rank + 0.2 * rng.random() for rank in range(DISTRIBUTION_SIZE)]
+    normaliser = math.log(sum(math.exp(logit) for logit in logits))
+    return tuple(zip(token_ids, [logit - normaliser for logit in logits]))
+
+
+def distribution(context: Sequence[int]) -> Tuple[Tuple[int, float], ...]:
+    """The tokens the model might pick after `context` & their logprobs, likeliest first"""
+    return _distribution(tuple(context[-CONTEXT_TOKENS:]))
+
+
+def _top_logprobs(context: Sequence[int], top_k: int | None, number: int) -> Dict[str, float]:
+    candidates = distribution(context)
+    if top_k:
+        # Like sampling with top_k: the logprobs are renormalised over the top k
+        candidates = candidates[:top_k]
+        normaliser = math.log(sum(math.exp(logprob) for _, logprob in candidates))
+        candidates = tuple((token_id, logprob - normaliser) for token_id, logprob in candidates)
+    return {detokenize([token_id]): logprob for token_id, logprob in candidates[:number]}
+
+
+def _prompt_logprobs(token_ids: List[int], number: int) -> List[Optional[dict]]:
+    prompt_logprobs: List[Optional[dict]] = [None]
+    for position in range(1, len(token_ids)):
+        candidates = distribution(token_ids[:position])
+        logprobs = {
+            str(token_id): {"logprob": logprob, "rank": rank, "decoded_token": detokenize([token_id])}
+            for rank, (token_id, logprob) in enumerate(candidates[:number], start=1)
+        }
+        # Like vLLM, the prompt's own token is always there, whatever its rank
+        actual = token_ids[position]
+        if str(actual) not in logprobs:
+            rank, logprob = next(
+                ((rank, logprob) for rank, (token_id, logprob) in enumerate(candidates, start=1) if token_id == actual),
+                (len(VOCABULARY), UNLIKELY_LOGPROB),
+            )
+            logprobs[str(actual)] = {"logprob": logprob, "rank": rank, "decoded_token": detokenize([actual])}
+        prompt_logprobs.append(logprobs)
+    return prompt_logprobs
+
+
+class TokenizeRequest(BaseModel):
+    model: str
+    prompt: Optional[str] = None
+    messages: Optional[List[dict]] = None
+    add_special_tokens: bool = True
+    add_generation_prompt: bool = True
+
+
+class DetokenizeRequest(BaseModel):
+    model: str
+    tokens: List[int]
+
+
+class CompletionRequest(BaseModel):
+    model: str
+    prompt: Union[str, List[str]]
+    max_tokens: int = 16
+    temperature: float = 1.0
+    top_k: Optional[int] = None
+    logprobs: Optional[int] = None
+    prompt_logprobs: Optional[int] = None
+    add_special_tokens: bool = True
+
+
+def create_app(model: str = "stub", latency_ms: float = 0, latency_per_token_us: float = 0) -> FastAPI:
+    app = FastAPI(title="Stub vLLM server")
+    calls: Counter = Counter()
+
+    async def _simulate_latency(number_of_tokens: int = 0) -> None:
+        delay = latency_ms / 1000 + number_of_tokens * latency_per_token_us / 1_000_000
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @app.get("/")
+    @app.get("/health")
+    async def health() -> dict:
+        return {}
+
+    @app.get("/v1/models")
+    async def models() -> dict:
+        return {"object": "list", "data": [{"id": model, "object": "model", "max_model_len": MAX_MODEL_LEN}]}
+
+    @app.get("/stats")
+    async def stats() -> Dict[str, int]:
+        """Requests served per endpoint, so benchmarks can count upstream calls"""
+        return dict(calls)
+
+    @app.post("/tokenize")
+    async def tokenize_endpoint(request: TokenizeRequest) -> dict:
+        calls["/tokenize"] += 1
+        if request.messages is not None:
+            tokens = tokenize(render_chat(request.messages, request.add_generation_prompt), add_special_tokens=False)
+        else:
+            tokens = tokenize(request.prompt or "", request.add_special_tokens)
+        await _simulate_latency()
+        return {"tokens": tokens, "count": len(tokens), "max_model_len": MAX_MODEL_LEN}
+
+    @app.post("/detokenize")
+    async def detokenize_endpoint(request: DetokenizeRequest) -> dict:
+        calls["/detokenize"] += 1
+        await _simulate_latency()
+        return {"prompt": detokenize(request.tokens)}
+
+    @app.post("/v1/completions")
+    async def completions(request: CompletionRequest) -> Response:
+        calls["/v1/completions"] += 1
+        prompts = [request.prompt] if isinstance(request.prompt, str) else request.prompt
+        choices = []
+        total_tokens = 0
+        prompt_token_ids = [tokenize(prompt, request.add_special_tokens) for prompt in prompts]
+        for token_ids in prompt_token_ids:
+            # Like vLLM, one prompt too long for the model fails the whole request
+            if len(token_ids) + request.max_tokens > MAX_MODEL_LEN:
+                message = f"This model's maximum context length is {MAX_MODEL_LEN} tokens, {len(token_ids) + request.max_tokens} were requested"
+                body = {"object": "error", "message": message, "type": "BadRequestError", "code": 400}
+                return Response(json.dumps(body), status_code=400, media_type="application/json")
+        for index, token_ids in enumerate(prompt_token_ids):
+            total_tokens += len(token_ids)
+            # Greedy: the stub always continues with its likeliest token
+            next_token_id, next_logprob = distribution(token_ids)[0]
+            text = detokenize([next_token_id])
+            choice = {"index": index, "text": text, "logprobs": None, "finish_reason": "length", "prompt_logprobs": None}
+            if request.logprobs is not None:
+                choice["logprobs"] = {
+                    "text_offset": [0],
+                    "token_logprobs": [next_logprob],
+                    "tokens": [text],
+                    "top_logprobs": [_top_logprobs(token_ids, request.top_k, max(request.logprobs, 1))],
+                }
+            if request.prompt_logprobs is not None:
+                choice["prompt_logprobs"] = _prompt_logprobs(token_ids, request.prompt_logprobs)
+            choices.append(choice)
+
+        await _simulate_latency(total_tokens)
+        body = {"id": f"cmpl-{calls['/v1/completions']}", "object": "text_completion", "model": request.model, "choices": choices}
+        # Prompt logprobs are big, skip FastAPI's (slow) encoding of them so the stub isn't what's being benchmarked
+        return Response(json.dumps(body), media_type="application/json")
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6919)
+    parser.add_argument("--model", default="stub")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Added to every response")
+    parser.add_argument("--latency-per-token-us", type=float, default=0, help="Added to completions, per prompt token")
+    args = parser.parse_args()
+    app = create_app(args.model, args.latency_ms, args.latency_per_token_us)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
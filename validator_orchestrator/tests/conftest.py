@@ -0,0 +1,136 @@
+"""
+Shared fixtures. Run the tests from `validator_orchestrator/` with `python -m pytest tests`.
+
+Modules that import the task manager need an event loop when they're imported, so tests import them inside
+async tests & fixtures rather than at the top of the file.
+"""
+
+import asyncio
+import math
+import random
+from collections import Counter
+from uuid import uuid4
+from typing import Dict, List, Set
+import httpx
+import pytest
+from benchmarks import stub_vllm
+from app.core import models
+
+MODEL = "stub/llama-3-8b-instruct"
+LOAD_MODEL_CONFIG = {"model": MODEL, "tokenizer": MODEL, "eos_token_id": stub_vllm.EOS_TOKEN_ID}
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+class StubLLMTransport(httpx.AsyncBaseTransport):
+    """
+    The stub vLLM server in process, counting the requests to each path, refusing the connection for the ones in
+    `failing`, timing out the ones in `timing_out` and slowing down the ones in `delays` by that many seconds
+    """
+
+    def __init__(self) -> None:
+        self._transport = httpx.ASGITransport(app=stub_vllm.create_app(MODEL))
+        self.calls: Counter[str] = Counter()
+        self.failing: Set[str] = set()
+        self.timing_out: Set[str] = set()
+        self.delays: Dict[str, float] = {}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.calls[request.url.path] += 1
+        await asyncio.sleep(self.delays.get(request.url.path, 0))
+        if request.url.path in self.failing:
+            raise httpx.ConnectError("The stub refused the connection", request=request)
+        if request.url.path in self.timing_out:
+            raise httpx.ReadTimeout("The stub timed out", request=request)
+        return await self._transport.handle_async_request(request)
+
+
+@pytest.fixture
+def llm_server(monkeypatch: pytest.MonkeyPatch):
+    """Point the LLM checkers at the stub vLLM server, which tokenises too"""
+    from app.checking.model_metadata import model_metadata_cache
+    from app.checking.registry import checker_registry
+    from app.checking.score_memo import score_memo
+    from app.core.http_clients import http_clients
+    from app.settings import TokenizerMode, settings
+
+    checker_registry.load()
+    monkeypatch.setattr(settings, "tokenizer_mode", TokenizerMode.SERVER)
+    transport = StubLLMTransport()
+    # Each test has its own event loop, which the caches' locks can't outlive
+    monkeypatch.setattr(model_metadata_cache, "_lock", asyncio.Lock())
+    monkeypatch.setitem(http_clients._clients, models.ServerType.LLM.value, httpx.AsyncClient(transport=transport))
+    model_metadata_cache.invalidate()
+    score_memo.clear()
+    yield transport
+    model_metadata_cache.invalidate()
+    score_memo.clear()
+
+
+def honest_response(context: List[int], number_of_tokens: int, rng: random.Random) -> List[tuple[str, float]]:
+    """Tokens the stub model would sample after `context`, with top k = 5, and their logprobs"""
+    response = []
+    for _ in range(number_of_tokens):
+        top = stub_vllm.distribution(context)[:5]
+        candidates = [(token_id, logprob) for token_id, logprob in top if token_id != stub_vllm.EOS_TOKEN_ID]
+        normaliser = math.log(sum(math.exp(logprob) for _, logprob in top))
+        token_id, logprob = rng.choices(candidates, weights=[math.exp(logprob) for _, logprob in candidates])[0]
+        response.append((stub_vllm.detokenize([token_id]), logprob - normaliser))
+        context = [*context, token_id]
+    return response
+
+
+def garbage_response(number_of_tokens: int, rng: random.Random) -> List[tuple[str, float]]:
+    return [(rng.choice(stub_vllm.VOCABULARY), -0.1) for _ in range(number_of_tokens)]
+
+
+def chat_chunks(response: List[tuple[str, float]]) -> List[dict]:
+    chunks = [{"choices": [{"delta": {"role": "assistant", "content": ""}, "logprobs": None}]}]
+    for token, logprob in response:
+        chunks.append({"choices": [{"delta": {"content": token}, "logprobs": {"content": [{"token": token, "logprob": logprob}]}}]})
+    return chunks
+
+
+def chat_check_request(
+    number_of_tokens: int = 32, honest: bool = True, seed: int = 0, node_id: int = 1, **server_config
+) -> models.CheckResultsRequest:
+    """A `check_text_result` check of a chat response, honest or garbage"""
+    rng = random.Random(seed)
+    messages = [{"role": "user", "content": "Write a short story about a river."}]
+    payload = {"messages": messages, "temperature": 0.5, "seed": seed, "max_tokens": number_of_tokens + 16, "top_p": 1.0, "model": MODEL}
+    if honest:
+        context = stub_vllm.tokenize(stub_vllm.render_chat(messages), add_special_tokens=False)
+        response = honest_response(context, number_of_tokens, rng)
+    else:
+        response = garbage_response(number_of_tokens, rng)
+    return models.CheckResultsRequest(
+        server_config=models.OrchestratorServerConfig(
+            server_needed=models.ServerType.LLM,
+            load_model_config=LOAD_MODEL_CONFIG,
+            checking_function="check_text_result",
+            task="chat-test",
+            endpoint="/generate_text",
+            **server_config,
+        ),
+        result=models.QueryResult(formatted_response=chat_chunks(response), node_id=node_id, response_time=1.0),
+        payload=payload,
+    )
+
+
+async def process_check(request: models.CheckResultsRequest) -> tuple[models.TaskStatus, models.TaskResult]:
+    """Run a check the way a worker does, with the server it needs already up"""
+    from app import server_management
+    from app.checking.endpoints import process_check_result
+    from app.checking.task_manager import task_manager
+
+    # The stub is already serving the model, so the gate never swaps
+    server_manager = server_management.ServerManager()
+    key = server_management.server_key(request.server_config)
+    server_manager.server_gates[key[0]].current_key = key
+    task_id = str(uuid4())
+    task_manager.add_task(task_id, request)
+    await process_check_result(task_id, request, server_manager)
+    return task_manager.clear_and_return_task_status_and_result(task_id)
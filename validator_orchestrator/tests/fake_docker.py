@@ -0,0 +1,344 @@
+"""
+An in-memory stand-in for the Docker Engine API on a unix socket, for testing the server manager without docker.
+
+It serves the calls `app.core.docker_client` makes: listing, inspecting, creating, starting, stopping, removing &
+waiting for containers, pulling images, and the event stream. Containers don't run anything, they're just state;
+`FakeDockerEngine.crash` makes one die like a real container would.
+
+    async with serve("/tmp/docker.sock") as engine:
+        client = DockerClient(socket_path="/tmp/docker.sock")
+        ...
+
+or run it on its own with `python tests/fake_docker.py --socket /tmp/docker.sock`.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterator, List, Set
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class FakeContainer:
+    id: str
+    name: str
+    config: Dict[str, Any]
+    running: bool = False
+    exit_code: int | None = None
+    exited: asyncio.Event = field(default_factory=asyncio.Event)
+    removed: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @property
+    def host_ports(self) -> Set[str]:
+        bindings = self.config.get("HostConfig", {}).get("PortBindings") or {}
+        return {binding["HostPort"] for port_bindings in bindings.values() for binding in port_bindings or []}
+
+    def summary(self) -> Dict[str, Any]:
+        """As in `GET /containers/json`"""
+        return {
+            "Id": self.id,
+            "Names": [f"/{self.name}"],
+            "Image": self.config.get("Image"),
+            "Labels": self.config.get("Labels") or {},
+            "State": "running" if self.running else "exited",
+            "Ports": [{"PublicPort": int(port), "Type": "tcp"} for port in sorted(self.host_ports)],
+        }
+
+
+class FakeDockerEngine:
+    """The daemon's state. `images` are the ones already pulled, pulls of anything in `missing_images` fail"""
+
+    def __init__(self, images: Set[str] | None = None, missing_images: Set[str] | None = None):
+        self.images: Set[str] = set(images or ())
+        self.missing_images: Set[str] = set(missing_images or ())
+        self.containers: Dict[str, FakeContainer] = {}
+        # Calls served, as "METHOD /path", so tests can check what was asked for
+        self.calls: List[str] = []
+        self._subscribers: List[asyncio.Queue] = []
+        self._event_times = itertools.count()
+        # Set when the server stops, to end the long polls of clients that went away
+        self.shutting_down = asyncio.Event()
+
+    async def wait_for(self, event: asyncio.Event) -> bool:
+        """Wait for `event`, or for the server to stop. Returns whether `event` happened"""
+        waits = [asyncio.create_task(event.wait()), asyncio.create_task(self.shutting_down.wait())]
+        try:
+            await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for wait in waits:
+                wait.cancel()
+        return event.is_set()
+
+    def find(self, container: str) -> FakeContainer | None:
+        """By id, id prefix or name, like the daemon"""
+        for candidate in self.containers.values():
+            if container in (candidate.id, candidate.name, f"/{candidate.name}") or (len(container) >= 12 and candidate.id.startswith(container)):
+                return candidate
+        return None
+
+    def _event(self, container: FakeContainer, action: str, **attributes: str) -> None:
+        event = {
+            "Type": "container",
+            "Action": action,
+            "status": action,
+            "id": container.id,
+            "from": container.config.get("Image"),
+            "Actor": {"ID": container.id, "Attributes": {"name": container.name, "image": container.config.get("Image"), **attributes}},
+            "time": int(time.time()),
+            "timeNano": time.time_ns() + next(self._event_times),
+        }
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    def create(self, name: str, config: Dict[str, Any]) -> FakeContainer:
+        container = FakeContainer(id=uuid.uuid4().hex + uuid.uuid4().hex, name=name, config=config)
+        self.containers[container.id] = container
+        self._event(container, "create")
+        return container
+
+    def start(self, container: FakeContainer) -> None:
+        container.running = True
+        container.exit_code = None
+        container.exited.clear()
+        self._event(container, "start")
+
+    def _exit(self, container: FakeContainer, exit_code: int) -> None:
+        container.running = False
+        container.exit_code = exit_code
+        container.exited.set()
+        self._event(container, "die", exitCode=str(exit_code))
+        if container.config.get("HostConfig", {}).get("AutoRemove"):
+            self.remove(container)
+
+    def stop(self, container: FakeContainer) -> None:
+        self._exit(container, 0)
+
+    def crash(self, container: str, exit_code: int = 137) -> None:
+        """Make a running container die on its own, e.g. out of memory"""
+        found = self.find(container)
+        if found is None or not found.running:
+            raise KeyError(f"No running container {container}")
+        self._exit(found, exit_code)
+
+    def remove(self, container: FakeContainer) -> None:
+        self.containers.pop(container.id, None)
+        container.removed.set()
+        self._event(container, "destroy")
+
+    @contextlib.contextmanager
+    def subscribe(self) -> Iterator[asyncio.Queue]:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.append(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers.remove(queue)
+
+
+def _error(status_code: int, message: str) -> JSONResponse:
+    return JSONResponse({"message": message}, status_code=status_code)
+
+
+def _filters(request: Request) -> Dict[str, List[str]]:
+    raw = request.query_params.get("filters")
+    if not raw:
+        return {}
+    # Old clients send {"key": {"value": true}}
+    return {key: list(values) for key, values in json.loads(raw).items()}
+
+
+def _image_name(image: str) -> str:
+    return image if ":" in image.rsplit("/", 1)[-1] else f"{image}:latest"
+
+
+class _UnversionedPaths:
+    """Serves /v1.41/containers/json as /containers/json, and records the calls"""
+
+    def __init__(self, app, engine: FakeDockerEngine):
+        self.app = app
+        self.engine = engine
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "http":
+            scope = {**scope, "path": re.sub(r"^/v[\d.]+(?=/)", "", scope["path"])}
+            self.engine.calls.append(f"{scope['method']} {scope['path']}")
+        await self.app(scope, receive, send)
+
+
+def create_app(engine: FakeDockerEngine) -> FastAPI:
+    app = FastAPI(title="Fake Docker Engine")
+    app.add_middleware(_UnversionedPaths, engine=engine)
+
+    def not_found(container: str) -> JSONResponse:
+        return _error(404, f"No such container: {container}")
+
+    @app.get("/_ping")
+    async def ping() -> Response:
+        return Response("OK", media_type="text/plain")
+
+    @app.get("/containers/json")
+    async def list_containers(request: Request) -> List[Dict[str, Any]]:
+        filters = _filters(request)
+        show_all = request.query_params.get("all") in ("1", "true", "True")
+        containers = []
+        for container in engine.containers.values():
+            if not show_all and not container.running:
+                continue
+            if "name" in filters and not any(name in container.name for name in filters["name"]):
+                continue
+            if "publish" in filters and not container.host_ports & {port.split("/")[0] for port in filters["publish"]}:
+                continue
+            containers.append(container.summary())
+        return containers
+
+    @app.get("/containers/{container}/json")
+    async def inspect(container: str) -> Response:
+        found = engine.find(container)
+        if found is None:
+            return not_found(container)
+        return JSONResponse(
+            {
+                "Id": found.id,
+                "Name": f"/{found.name}",
+                "Config": {key: value for key, value in found.config.items() if key != "HostConfig"},
+                "HostConfig": found.config.get("HostConfig", {}),
+                "State": {"Running": found.running, "Status": "running" if found.running else "exited", "ExitCode": found.exit_code or 0},
+            }
+        )
+
+    @app.post("/images/create")
+    async def pull(fromImage: str, tag: str = "latest") -> Response:
+        image = f"{fromImage}:{tag}"
+
+        async def progress() -> AsyncIterator[bytes]:
+            yield json.dumps({"status": f"Pulling from {fromImage}", "id": tag}).encode() + b"\n"
+            if image in engine.missing_images:
+                yield json.dumps({"error": f"manifest for {image} not found", "errorDetail": {"message": "manifest unknown"}}).encode() + b"\n"
+                return
+            engine.images.add(image)
+            yield json.dumps({"status": f"Downloaded newer image for {image}"}).encode() + b"\n"
+
+        return StreamingResponse(progress(), media_type="application/json")
+
+    @app.post("/containers/create")
+    async def create(name: str, request: Request) -> Response:
+        config = await request.json()
+        if _image_name(config["Image"]) not in engine.images:
+            return _error(404, f"No such image: {config['Image']}")
+        existing = engine.find(name)
+        if existing is not None:
+            return _error(409, f'Conflict. The container name "/{name}" is already in use by container "{existing.id}"')
+        container = engine.create(name, config)
+        return JSONResponse({"Id": container.id, "Warnings": []}, status_code=201)
+
+    @app.post("/containers/{container}/start")
+    async def start(container: str) -> Response:
+        found = engine.find(container)
+        if found is None:
+            return not_found(container)
+        if found.running:
+            return Response(status_code=304)
+        engine.start(found)
+        return Response(status_code=204)
+
+    @app.post("/containers/{container}/stop")
+    async def stop(container: str) -> Response:
+        found = engine.find(container)
+        if found is None:
+            return not_found(container)
+        if not found.running:
+            return Response(status_code=304)
+        engine.stop(found)
+        return Response(status_code=204)
+
+    @app.delete("/containers/{container}")
+    async def remove(container: str, force: bool = False) -> Response:
+        found = engine.find(container)
+        if found is None:
+            return not_found(container)
+        if found.running:
+            if not force:
+                return _error(409, f"You cannot remove a running container {found.id}. Stop the container before attempting removal or force remove")
+            engine.stop(found)
+        if not found.removed.is_set():
+            engine.remove(found)
+        return Response(status_code=204)
+
+    @app.post("/containers/{container}/wait")
+    async def wait(container: str, condition: str = "not-running") -> Response:
+        found = engine.find(container)
+        if found is None:
+            return not_found(container)
+        if condition == "next-exit":
+            found.exited.clear()
+        happened = await engine.wait_for(found.removed if condition == "removed" else found.exited)
+        if not happened:
+            return _error(503, "The daemon is shutting down")
+        return JSONResponse({"StatusCode": found.exit_code or 0, "Error": None})
+
+    @app.get("/events")
+    async def events(request: Request) -> StreamingResponse:
+        filters = _filters(request)
+
+        def matches(event: Dict[str, Any]) -> bool:
+            if "type" in filters and event["Type"] not in filters["type"]:
+                return False
+            if "event" in filters and event["Action"] not in filters["event"]:
+                return False
+            if "container" in filters:
+                name = event["Actor"]["Attributes"]["name"]
+                return any(wanted in (name, event["id"]) or event["id"].startswith(wanted) for wanted in filters["container"])
+            return True
+
+        async def stream() -> AsyncIterator[bytes]:
+            with engine.subscribe() as queue:
+                while True:
+                    event = await queue.get()
+                    if matches(event):
+                        yield json.dumps(event).encode() + b"\n"
+
+        return StreamingResponse(stream(), media_type="application/json")
+
+    return app
+
+
+@contextlib.asynccontextmanager
+async def serve(socket_path: str, engine: FakeDockerEngine | None = None) -> AsyncIterator[FakeDockerEngine]:
+    """Serve a fake daemon on `socket_path` for the duration of the block"""
+    engine = engine or FakeDockerEngine()
+    server = uvicorn.Server(uvicorn.Config(create_app(engine), uds=socket_path, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    try:
+        yield engine
+    finally:
+        engine.shutting_down.set()
+        server.should_exit = True
+        # Event streams never end by themselves
+        server.force_exit = True
+        await task
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default="/tmp/fake-docker.sock")
+    parser.add_argument("--image", action="append", default=[], help="An image that's already pulled, can be given several times")
+    args = parser.parse_args()
+    app = create_app(FakeDockerEngine(images={_image_name(image) for image in args.image}))
+    uvicorn.run(app, uds=args.socket, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
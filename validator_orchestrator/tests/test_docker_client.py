@@ -0,0 +1,133 @@
+import asyncio
+import os
+import tempfile
+import pytest
+from app.core.docker_client import DockerClient, DockerConflict, DockerError, DockerNotFound
+from tests.fake_docker import FakeDockerEngine, serve
+
+pytestmark = pytest.mark.anyio
+
+IMAGE = "corcelio/vision:llm_server-latest"
+MISSING_IMAGE = "corcelio/vision:gone"
+CONFIG = {"Image": IMAGE, "HostConfig": {"PortBindings": {"6919/tcp": [{"HostPort": "6919"}]}}}
+
+
+@pytest.fixture
+async def docker():
+    # Unix socket paths can't be long, so not under pytest's tmp_path
+    with tempfile.TemporaryDirectory(dir="/tmp") as directory:
+        socket_path = os.path.join(directory, "docker.sock")
+        async with serve(socket_path, FakeDockerEngine(missing_images={MISSING_IMAGE})) as engine:
+            client = DockerClient(socket_path=socket_path, api_version="1.41")
+            try:
+                yield client, engine
+            finally:
+                await client.close()
+
+
+async def test_ping(docker):
+    client, _ = docker
+    assert await client.ping()
+
+    unreachable = DockerClient(socket_path="/tmp/no-docker-here.sock")
+    assert not await unreachable.ping()
+    with pytest.raises(DockerError) as error:
+        await unreachable.inspect_container("llm_server")
+    assert error.value.status_code is None
+    await unreachable.close()
+
+
+async def test_container_lifecycle(docker):
+    client, engine = docker
+
+    container_id = await client.create_container("llm_server", CONFIG)
+    # The image wasn't there, so it was pulled & the create retried
+    assert engine.calls[:3] == ["POST /containers/create", "POST /images/create", "POST /containers/create"]
+    assert (await client.inspect_container("llm_server"))["Id"] == container_id
+
+    await client.start_container(container_id)
+    await client.start_container(container_id)
+    assert (await client.inspect_container(container_id))["State"]["Running"]
+    assert [container["Id"] for container in await client.list_containers(filters={"publish": ["6919"]})] == [container_id]
+
+    await client.stop_container(container_id)
+    assert not (await client.inspect_container(container_id))["State"]["Running"]
+    assert await client.list_containers() == []
+    assert len(await client.list_containers(all=True)) == 1
+
+    await client.remove_container(container_id)
+    with pytest.raises(DockerNotFound):
+        await client.inspect_container(container_id)
+
+
+async def test_errors(docker):
+    client, _ = docker
+
+    container_id = await client.create_container("llm_server", CONFIG)
+    with pytest.raises(DockerConflict):
+        await client.create_container("llm_server", CONFIG)
+
+    await client.start_container(container_id)
+    with pytest.raises(DockerConflict):
+        await client.remove_container(container_id)
+
+    with pytest.raises(DockerError) as error:
+        await client.create_container("image_server", {"Image": MISSING_IMAGE})
+    assert not isinstance(error.value, DockerNotFound)
+    assert error.value.operation == f"pull {MISSING_IMAGE}"
+
+    with pytest.raises(DockerNotFound):
+        await client.start_container("missing")
+
+
+async def test_stop_and_remove_container(docker):
+    client, engine = docker
+
+    container_id = await client.create_container("llm_server", CONFIG)
+    await client.start_container(container_id)
+    await client.stop_and_remove_container("llm_server")
+    assert engine.containers == {}
+
+    # Auto-removed containers are already on their way out once stopped
+    auto_removed = await client.create_container("llm_server", {**CONFIG, "HostConfig": {**CONFIG["HostConfig"], "AutoRemove": True}})
+    await client.start_container(auto_removed)
+    await client.stop_and_remove_container(auto_removed)
+    assert engine.containers == {}
+
+    await client.stop_and_remove_container("never-existed")
+
+
+async def test_crash_is_seen_by_waits_and_events(docker):
+    client, engine = docker
+    container_id = await client.create_container("llm_server", CONFIG)
+    await client.start_container(container_id)
+
+    async def first_death() -> dict:
+        async for event in client.events(filters={"type": ["container"], "event": ["die"], "container": ["llm_server"]}):
+            return event
+
+    death = asyncio.create_task(first_death())
+    wait = asyncio.create_task(client.wait_container(container_id))
+    # Let the event stream & the wait connect before the crash
+    while "GET /events" not in engine.calls or f"POST /containers/{container_id}/wait" not in engine.calls:
+        await asyncio.sleep(0.01)
+    engine.crash("llm_server")
+
+    assert (await asyncio.wait_for(wait, timeout=5))["StatusCode"] == 137
+    event = await asyncio.wait_for(death, timeout=5)
+    assert event["id"] == container_id
+    assert event["Actor"]["Attributes"]["exitCode"] == "137"
+
+
+async def test_only_checking_servers_are_cleared_off_a_port(docker, monkeypatch: pytest.MonkeyPatch):
+    from app import server_management
+
+    client, engine = docker
+    monkeypatch.setattr(server_management, "docker_client", client)
+    port_config = {"HostConfig": {"PortBindings": {"6921/tcp": [{"HostPort": "6921"}]}}}
+    for name, labels in [("orchestrator", {}), ("old_server", {server_management.CHECKING_SERVER_LABEL: "image_server"}), ("image_server", {})]:
+        await client.start_container(await client.create_container(name, {"Image": IMAGE, "Labels": labels, **port_config}))
+
+    await server_management.ServerManager()._kill_process_on_port(6921)
+
+    assert [container.name for container in engine.containers.values()] == ["orchestrator"]
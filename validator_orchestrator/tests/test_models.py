@@ -0,0 +1,41 @@
+import pytest
+from pydantic import ValidationError
+from app.core import models
+
+
+def test_packed_text_response_round_trips():
+    tokens, logprobs = ["The", " river", "."], [-0.25, -1.5, -3.0]
+    packed = models.PackedTextResponse.pack(tokens, logprobs)
+
+    result = models.QueryResult.model_validate({"formatted_response": packed.model_dump(), "node_id": 1, "response_time": 1.0})
+
+    assert isinstance(result.formatted_response, models.PackedTextResponse)
+    messages = result.formatted_response.messages()
+    assert [message.content for message in messages] == tokens
+    assert [message.logprob for message in messages] == pytest.approx(logprobs)
+    assert all(isinstance(message.logprob, float) for message in messages)
+
+
+def test_packed_text_response_needs_a_logprob_per_token():
+    with pytest.raises(ValidationError):
+        models.PackedTextResponse(tokens=["a", "b"], logprobs=models.PackedTextResponse.pack(["a"], [-1.0]).logprobs)
+    with pytest.raises(ValidationError):
+        models.PackedTextResponse(tokens=["a"], logprobs="not base64!")
+
+
+def test_distance_sampling_default_scale_can_stop_after_one_check():
+    from app.checking.functions import text
+
+    sampling = models.DistanceSamplingConfig()
+    assert text._verdict_is_certain([0.0], sampling)
+    assert text._verdict_is_certain([1.0], sampling)
+    assert not text._verdict_is_certain([0.2], sampling)
+
+
+@pytest.mark.parametrize(
+    "config",
+    [{"min_checks": 3, "max_checks": 2}, {"error_rate": 0}, {"error_rate": 1}, {"sub_gaussian_scale": 0.6}, {"min_checks": 0}],
+)
+def test_distance_sampling_rejects_bad_configs(config: dict):
+    with pytest.raises(ValidationError):
+        models.DistanceSamplingConfig(**config)
@@ -0,0 +1,84 @@
+import pytest
+from app.core.models import ServerType
+from app.placement import Gpu, PlacementError, PlacementPlanner, Plan, Resident, StaticGpuInventory
+from app.settings import settings
+
+pytestmark = pytest.mark.anyio
+
+GPU_MIB = 80_000
+# vLLM pre-allocates half of each GPU for this one
+HALF_GPU_LLM = {"model": "stub/llama-3-8b-instruct", "gpu_memory_utilization": 0.5}
+
+
+def _planner(*gpus: Gpu) -> PlacementPlanner:
+    return PlacementPlanner(inventory=StaticGpuInventory(list(gpus)), co_resident=True)
+
+
+def _resident(planner: PlacementPlanner, server: str, gpu_ids: tuple[int, ...], vram_mib: int, last_used: float) -> None:
+    planner.residents[server] = Resident(server=server, key=(server, None), gpu_ids=gpu_ids, vram_mib=vram_mib, last_used=last_used)
+
+
+async def test_tightest_fit():
+    planner = _planner(Gpu(index=0, total_mib=GPU_MIB), Gpu(index=1, total_mib=GPU_MIB))
+    _resident(planner, "image_server", (0,), 30_000, last_used=1)
+
+    plan = await planner.plan("llm_server", ("llm_server", "a"), ServerType.LLM, HALF_GPU_LLM)
+
+    # Both GPUs fit, the emptier one is kept for something bigger
+    assert plan == Plan(gpu_ids=(0,), vram_mib=40_000, evict=[])
+
+
+async def test_least_recently_used_are_evicted_first():
+    planner = _planner(Gpu(index=0, total_mib=GPU_MIB))
+    _resident(planner, "image_server", (0,), 25_000, last_used=2)
+    _resident(planner, "other_server", (0,), 25_000, last_used=1)
+    _resident(planner, "llm_server", (0,), 30_000, last_used=3)
+
+    # The old llm_server container always goes, so only one of the others has to
+    plan = await planner.plan("llm_server", ("llm_server", "b"), ServerType.LLM, HALF_GPU_LLM)
+    assert plan.evict == ["other_server"]
+
+    plan = await planner.plan("llm_server", ("llm_server", "b"), ServerType.LLM, {**HALF_GPU_LLM, "gpu_memory_utilization": 0.9})
+    assert plan.evict == ["other_server", "image_server"]
+
+    with pytest.raises(PlacementError):
+        await planner.plan("llm_server", ("llm_server", "b"), ServerType.LLM, {**HALF_GPU_LLM, "tensor_parallel_size": 2})
+
+
+async def test_no_gpus_evicts_everything_else():
+    planner = _planner()
+    _resident(planner, "image_server", (), 0, last_used=2)
+    _resident(planner, "other_server", (), 0, last_used=1)
+
+    plan = await planner.plan("llm_server", ("llm_server", "a"), ServerType.LLM, HALF_GPU_LLM)
+
+    assert plan == Plan(gpu_ids=None, vram_mib=0, evict=["other_server", "image_server"])
+
+
+async def test_usage_that_isnt_ours_is_taken():
+    # 20 GB of GPU 0 is the resident's, 30 GB more is someone else's
+    planner = _planner(Gpu(index=0, total_mib=GPU_MIB, used_mib=50_000), Gpu(index=1, total_mib=GPU_MIB, used_mib=45_000))
+    _resident(planner, "image_server", (0,), 20_000, last_used=1)
+
+    plan = await planner.plan("llm_server", ("llm_server", "a"), ServerType.LLM, {**HALF_GPU_LLM, "gpu_memory_utilization": 0.4})
+    assert plan == Plan(gpu_ids=(1,), vram_mib=32_000, evict=[])
+
+    plan = await planner.plan("llm_server", ("llm_server", "a"), ServerType.LLM, HALF_GPU_LLM)
+    assert plan == Plan(gpu_ids=(0,), vram_mib=40_000, evict=["image_server"])
+
+    # Evicting all of ours still leaves too little anywhere
+    with pytest.raises(PlacementError):
+        await planner.plan("llm_server", ("llm_server", "a"), ServerType.LLM, {**HALF_GPU_LLM, "gpu_memory_utilization": 0.7})
+
+
+async def test_measurements_only_ever_raise_the_estimate():
+    planner = _planner(Gpu(index=0, total_mib=GPU_MIB))
+    key = ("llm_server", "a")
+    plan = await planner.plan("llm_server", key, ServerType.LLM, HALF_GPU_LLM)
+
+    # Measured while it was still loading
+    planner.placed("llm_server", key, plan, {0: 0}, {0: 1_000})
+    assert planner.vram_mib(key, ServerType.LLM, HALF_GPU_LLM, GPU_MIB) == 40_000
+
+    planner.placed("llm_server", key, plan, {0: 0}, {0: 60_000})
+    assert planner.vram_mib(key, ServerType.LLM, HALF_GPU_LLM, GPU_MIB) == int(60_000 * settings.measured_vram_headroom)
@@ -0,0 +1,75 @@
+import asyncio
+import pytest
+from app.core import models
+from tests.conftest import chat_check_request, process_check
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_upstream_failure_fails_the_check_and_is_not_memoised(llm_server):
+    from app.checking.score_memo import request_key, score_memo
+
+    request = chat_check_request()
+    llm_server.failing.add("/v1/completions")
+
+    status, result = await process_check(request)
+
+    assert status == models.TaskStatus.Failed
+    assert result.node_scores is None
+    assert score_memo.get(request_key(request)) is None
+
+    llm_server.failing.clear()
+    status, result = await process_check(request)
+
+    assert status == models.TaskStatus.Success
+    assert result.node_scores == {1: 1.0}
+    assert score_memo.get(request_key(request)).node_scores == {1: 1.0}
+
+
+async def test_garbage_response_is_scored_and_memoised(llm_server):
+    from app.checking.score_memo import request_key, score_memo
+
+    request = chat_check_request(honest=False)
+
+    status, result = await process_check(request)
+
+    assert status == models.TaskStatus.Success
+    assert result.node_scores == {1: 0.0}
+    assert score_memo.get(request_key(request)).node_scores == {1: 0.0}
+
+
+async def test_cancelled_check_releases_its_followers(llm_server):
+    from app import server_management
+    from app.checking.endpoints import process_check_result
+    from app.checking.score_memo import request_key, score_memo
+    from app.checking.task_manager import task_manager
+
+    request = chat_check_request(seed=7)
+    server_manager = server_management.ServerManager()
+    key = server_management.server_key(request.server_config)
+    server_manager.server_gates[key[0]].current_key = key
+    llm_server.delays["/v1/completions"] = 10
+
+    task_manager.add_task("leader", request)
+    task_manager.add_task("follower", request)
+    leader = asyncio.create_task(process_check_result("leader", request, server_manager))
+    while not llm_server.calls["/v1/completions"]:
+        await asyncio.sleep(0.01)
+    await process_check_result("follower", request, server_manager)
+    assert task_manager.task_is_processing("follower")
+
+    # E.g. the worker pool stopping
+    leader.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+
+    status, result = task_manager.clear_and_return_task_status_and_result("follower")
+    assert status == models.TaskStatus.Failed
+    assert result.node_scores is None
+    task_manager.clear_and_return_task_status_and_result("leader")
+
+    # Later identical checks run rather than join the cancelled one
+    llm_server.delays.clear()
+    status, result = await process_check(request)
+    assert status == models.TaskStatus.Success
+    assert score_memo.get(request_key(request)).node_scores == {1: 1.0}
@@ -0,0 +1,37 @@
+import asyncio
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+LLM_A = ("llm_server", "model-a")
+LLM_B = ("llm_server", "model-b")
+
+
+async def test_not_warm_while_another_key_waits():
+    from app.server_management import ServerGate
+
+    gate = ServerGate()
+    gate.current_key = LLM_A
+    swapped = asyncio.Event()
+
+    async def swap() -> None:
+        swapped.set()
+
+    async with gate.use(LLM_A, swap):
+        assert gate.is_warm(LLM_A)
+        waiting = asyncio.create_task(_use(gate, LLM_B, swap))
+        while not gate._waiting:
+            await asyncio.sleep(0)
+        # More work for A now would only hold up B's swap, then need A swapped back in
+        assert not gate.is_warm(LLM_A)
+        assert not gate.is_warm(LLM_B)
+
+    await waiting
+    assert swapped.is_set()
+    assert gate.is_warm(LLM_B)
+    assert not gate.is_warm(LLM_A)
+
+
+async def _use(gate, key, swap) -> None:
+    async with gate.use(key, swap):
+        pass
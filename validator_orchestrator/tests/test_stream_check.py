@@ -0,0 +1,150 @@
+import asyncio
+import json
+import math
+import httpx
+import pytest
+from app.core import models
+from tests.conftest import chat_check_request
+
+pytestmark = pytest.mark.anyio
+
+# Fine grained distance checks a check runs, each one a completions request
+DISTANCE_CHECKS = 5
+
+
+async def _stream(request, window_tokens: int = 16):
+    from app.checking.functions import text
+
+    check = text.StreamingTextCheck(request.payload, request.server_config, window_tokens=window_tokens)
+    for chunk in request.result.formatted_response:
+        if not check.add_chunk(chunk) or (check.window_ready and not await check.verify_window()):
+            break
+    return check, await check.finish()
+
+
+async def test_windows_grow_with_the_response(llm_server):
+    number_of_tokens = 512
+    check, score = await _stream(chat_check_request(number_of_tokens=number_of_tokens))
+
+    assert score == 1.0
+    assert check.tokens_verified == number_of_tokens + 1
+    # Windows double, so there are about log2(tokens / window) of them plus the final one, not tokens / window
+    windows = llm_server.calls["/v1/completions"] - DISTANCE_CHECKS
+    assert windows <= math.log2(number_of_tokens / 16) + 2
+
+
+async def test_garbage_is_rejected_in_the_first_window(llm_server):
+    check, score = await _stream(chat_check_request(number_of_tokens=512, honest=False))
+
+    assert score == 0.0
+    assert check.rejected
+    assert llm_server.calls["/v1/completions"] == 1
+
+
+class _Upload:
+    """The ndjson body of a streamed check, pausing after `pause_after` chunks until `resume` is set"""
+
+    def __init__(self, request, pause_after: int | None = None):
+        self.request = request
+        self.pause_after = pause_after
+        self.paused = asyncio.Event()
+        self.resume = asyncio.Event()
+
+    async def __aiter__(self):
+        header = {"server_config": self.request.server_config.model_dump(mode="json"), "payload": self.request.payload, "node_id": 1}
+        yield (json.dumps(header) + "\n").encode()
+        for index, chunk in enumerate(self.request.result.formatted_response):
+            if index == self.pause_after:
+                self.paused.set()
+                await self.resume.wait()
+            yield (json.dumps(chunk) + "\n").encode()
+
+
+@pytest.fixture
+async def orchestrator(llm_server):
+    from fastapi import FastAPI
+    from app import server_management
+    from app.checking.endpoints import router
+    from app.checking.worker_pool import CheckWorkerPool
+
+    async def handler(task_id, request) -> None:
+        pass
+
+    app = FastAPI()
+    app.include_router(router)
+    app.state.server_manager = server_management.ServerManager()
+    # The stub is already serving the model, so the gate never swaps
+    key = server_management.server_key(chat_check_request().server_config)
+    app.state.server_manager.server_gates[key[0]].current_key = key
+    # Workers aren't started, so queued checks stay queued
+    app.state.check_worker_pool = CheckWorkerPool(handler, num_workers=1, max_queue_size=2, max_group_wait_seconds=60)
+    return app
+
+
+async def _post_stream(app, upload: _Upload) -> dict:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://orchestrator") as client:
+        response = await client.post("/check-result-stream", content=upload)
+    response.raise_for_status()
+    return response.json()
+
+
+async def test_upload_is_read_without_holding_the_server(orchestrator):
+    pool = orchestrator.state.check_worker_pool
+    gate = orchestrator.state.server_manager.server_gates[models.ServerType.LLM.value]
+    upload = _Upload(chat_check_request(number_of_tokens=128), pause_after=64)
+
+    posting = asyncio.create_task(_post_stream(orchestrator, upload))
+    await upload.paused.wait()
+    # Windows were verified before the pause, but the server isn't held while the miner's upload stalls
+    assert gate.active_checks == 0
+    assert pool.status().streaming_checks == 1
+    upload.resume.set()
+    response = await posting
+
+    assert response["status"] == models.TaskStatus.Success.value
+    assert response["result"]["node_scores"] == {"1": 1.0}
+    assert 0 < response["tokens_verified"]
+    assert pool.status().streaming_checks == 0
+
+
+async def test_streamed_checks_count_against_the_queue(orchestrator):
+    pool = orchestrator.state.check_worker_pool
+    request = chat_check_request()
+    assert pool.submit("queued", request)
+
+    # One queued check and one streaming fill the queue
+    upload = _Upload(request, pause_after=8)
+    posting = asyncio.create_task(_post_stream(orchestrator, upload))
+    await upload.paused.wait()
+    assert not pool.submit("rejected", request)
+    assert (await _post_stream(orchestrator, _Upload(request)))["status"] == models.TaskStatus.Busy.value
+
+    upload.resume.set()
+    assert (await posting)["status"] == models.TaskStatus.Success.value
+    assert pool.submit("queued-again", request)
+
+
+async def test_rejected_streams_dont_take_the_server_to_finish(orchestrator, monkeypatch: pytest.MonkeyPatch):
+    server_manager = orchestrator.state.server_manager
+    use_server = server_manager.use_server
+    uses = []
+
+    def counting_use_server(task_config, swap):
+        uses.append(task_config)
+        return use_server(task_config, swap)
+
+    monkeypatch.setattr(server_manager, "use_server", counting_use_server)
+
+    # Over max_tokens before a window is ready: rejected without the server at all
+    request = chat_check_request(number_of_tokens=12)
+    request.payload["max_tokens"] = 8
+    response = await _post_stream(orchestrator, _Upload(request))
+    assert response["result"]["node_scores"] == {"1": 0.0}
+    assert response["rejected_early"]
+    assert uses == []
+
+    # Garbage fails its first window, and that's the only time the server is taken
+    response = await _post_stream(orchestrator, _Upload(chat_check_request(number_of_tokens=128, honest=False)))
+    assert response["result"]["node_scores"] == {"1": 0.0}
+    assert response["rejected_early"]
+    assert len(uses) == 1
@@ -0,0 +1,73 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import List
+from uuid import uuid4
+import httpx
+import pytest
+from fastapi import FastAPI
+from app.core import models
+
+pytestmark = pytest.mark.anyio
+
+
+async def _task_events(task_ids: List[str]) -> List[tuple[str, dict]]:
+    from app.checking.endpoints import router
+
+    app = FastAPI()
+    app.include_router(router)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://orchestrator") as client:
+        response = await client.get("/task-events", params={"task_ids": task_ids})
+    events = []
+    for event in response.text.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in event.splitlines() if not line.startswith(":"))
+        if fields:
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def _result(score: float) -> models.TaskResult:
+    return models.TaskResult(node_scores={1: score}, timestamp=datetime.now())
+
+
+async def test_finished_task_is_sent_with_its_result():
+    from app.checking.task_manager import task_manager
+
+    task_id = str(uuid4())
+    task_manager.add_task(task_id)
+    task_manager.complete_task(task_id, models.TaskStatus.Success, _result(0.5))
+
+    events = await _task_events([task_id])
+
+    assert len(events) == 1
+    event, data = events[0]
+    assert event == "Success"
+    assert data["result"]["node_scores"] == {"1": 0.5}
+    assert task_id not in task_manager.task_status
+
+
+async def test_pending_task_is_sent_when_it_finishes():
+    from app.checking.task_manager import task_manager
+
+    finished_id, pending_id = str(uuid4()), str(uuid4())
+    for task_id in (finished_id, pending_id):
+        task_manager.add_task(task_id)
+    task_manager.complete_task(finished_id, models.TaskStatus.Failed, models.TaskResult(error_message="boom", timestamp=datetime.now()))
+
+    async def finish_later() -> None:
+        await asyncio.sleep(0.05)
+        task_manager.complete_task(pending_id, models.TaskStatus.Success, _result(1.0))
+
+    finishing = asyncio.create_task(finish_later())
+    events = await _task_events([finished_id, pending_id, "unknown"])
+    await finishing
+
+    assert [(event, data["task_id"]) for event, data in events] == [
+        ("Failed", finished_id),
+        ("Processing", pending_id),
+        ("Missing", "unknown"),
+        ("Success", pending_id),
+    ]
+    assert events[0][1]["result"]["error_message"] == "boom"
+    assert events[1][1]["result"] is None
+    assert events[3][1]["result"]["node_scores"] == {"1": 1.0}
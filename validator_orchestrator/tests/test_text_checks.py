@@ -0,0 +1,93 @@
+import dataclasses
+import pytest
+from benchmarks import stub_vllm
+from app.core import models
+from tests.conftest import LOAD_MODEL_CONFIG, chat_check_request
+
+pytestmark = pytest.mark.anyio
+
+
+async def _full_prompt_tokens(request: models.CheckResultsRequest) -> list[int]:
+    from app.checking.functions import text
+
+    messages = text._extract_messages(request.result, is_completions_payload=False)
+    input_content, _, eos_token = await text._input_prompt(request.payload, LOAD_MODEL_CONFIG, False)
+    _, all_tokens = await text._full_prompt(messages, request.payload, LOAD_MODEL_CONFIG, input_content, eos_token, stub_vllm.EOS_TOKEN_ID, False)
+    return all_tokens
+
+
+async def test_prompt_filling_the_context_is_not_scored(llm_server):
+    from app.checking import model_metadata
+    from app.checking.functions import text
+
+    request = chat_check_request()
+    number_of_tokens = len(await _full_prompt_tokens(request))
+    metadata = await model_metadata.model_metadata_cache.get(LOAD_MODEL_CONFIG)
+    key = model_metadata._key(LOAD_MODEL_CONFIG)
+
+    # The completion's 1 generated token has to fit too
+    model_metadata.model_metadata_cache._metadata[key] = dataclasses.replace(metadata, max_model_len=number_of_tokens)
+    assert await text.check_text_result(request.result, request.payload, request.server_config) is None
+    assert llm_server.calls["/v1/completions"] == 0
+
+    model_metadata.model_metadata_cache._metadata[key] = dataclasses.replace(metadata, max_model_len=number_of_tokens + 1)
+    assert await text.check_text_result(request.result, request.payload, request.server_config) == 1.0
+
+
+async def test_rejected_prompt_does_not_fail_the_batch(llm_server, monkeypatch: pytest.MonkeyPatch):
+    from app.checking.functions import text
+    from app.checking.model_metadata import model_metadata_cache
+
+    short_request = chat_check_request(number_of_tokens=8, seed=1, node_id=1)
+    long_request = chat_check_request(number_of_tokens=64, seed=2, node_id=2)
+    number_of_tokens = len(await _full_prompt_tokens(short_request))
+    # The llm_server takes shorter prompts than we think it does, e.g. it was restarted with a smaller max_model_len
+    await model_metadata_cache.get(LOAD_MODEL_CONFIG)
+    monkeypatch.setattr(stub_vllm, "MAX_MODEL_LEN", number_of_tokens + 8)
+
+    scores = await text.check_text_results([short_request.result, long_request.result], long_request.payload, long_request.server_config)
+
+    assert scores == {1: 1.0}
+
+
+
+async def test_model_metadata_is_looked_up_once(llm_server):
+    from app.checking.model_metadata import model_metadata_cache
+
+    metadata = await model_metadata_cache.build(LOAD_MODEL_CONFIG)
+
+    assert (metadata.eos_token_id, metadata.eos_token, metadata.max_model_len) == (stub_vllm.EOS_TOKEN_ID, stub_vllm.EOS_TOKEN, stub_vllm.MAX_MODEL_LEN)
+    assert dict(llm_server.calls) == {"/detokenize": 1, "/v1/models": 1}
+
+    request = chat_check_request()
+    await model_metadata_cache.get(request.server_config.load_model_config)
+    assert llm_server.calls["/detokenize"] == 1
+
+
+@pytest.mark.parametrize(
+    "sampling, distance_checks",
+    [
+        (models.DistanceSamplingConfig(), 1),
+        # No verdict can be certain before the last check at this scale, so they all run at once
+        (models.DistanceSamplingConfig(sub_gaussian_scale=0.5), 5),
+    ],
+    ids=["default", "always-valid-scale"],
+)
+async def test_honest_responses_stop_sampling_once_certain(llm_server, monkeypatch: pytest.MonkeyPatch, sampling, distance_checks: int):
+    from app.checking.functions import text
+
+    checked = []
+    distances = text._distances
+
+    async def counting_distances(task_config, payload, messages, prompt_logprobs, indices, *args):
+        checked.append(len(indices))
+        return await distances(task_config, payload, messages, prompt_logprobs, indices, *args)
+
+    monkeypatch.setattr(text, "_distances", counting_distances)
+    request = chat_check_request(distance_sampling=sampling)
+
+    score = await text.check_text_result(request.result, request.payload, request.server_config)
+
+    assert score == 1.0
+    assert sum(checked) == distance_checks
+    assert len(checked) == 1
@@ -0,0 +1,68 @@
+import asyncio
+import math
+import random
+import pytest
+from benchmarks import stub_vllm
+from app.core import models
+from tests.conftest import chat_check_request, chat_chunks, honest_response
+
+pytestmark = pytest.mark.anyio
+
+
+def _sloppy_request(seed: int, probability_scale: float) -> models.CheckResultsRequest:
+    """An honest response whose logprobs are off by a factor, so its distances are neither 0 nor 1"""
+    request = chat_check_request(seed=seed)
+    context = stub_vllm.tokenize(stub_vllm.render_chat(request.payload["messages"]), add_special_tokens=False)
+    response = [(token, logprob + math.log(probability_scale)) for token, logprob in honest_response(context, 32, random.Random(seed))]
+    return request.model_copy(update={"result": request.result.model_copy(update={"formatted_response": chat_chunks(response)})})
+
+
+async def test_single_pass_distances_match_multi_pass(llm_server):
+    from app.checking.functions import text
+    from app.settings import settings
+
+    request = _sloppy_request(seed=1, probability_scale=0.7)
+    task_config, payload = request.server_config, request.payload
+    load_model_config = task_config.load_model_config
+    messages = text._extract_messages(request.result, is_completions_payload=False)
+    eos_token_id = stub_vllm.EOS_TOKEN_ID
+
+    input_content, num_input_tokens, eos_token = await text._input_prompt(payload, load_model_config, False)
+    full_prompt, all_tokens = await text._full_prompt(messages, payload, load_model_config, input_content, eos_token, eos_token_id, False)
+    [prompt_logprobs] = await text._fetch_prompt_logprobs([(full_prompt, all_tokens)], payload, load_model_config)
+    prompt_logprobs = prompt_logprobs[num_input_tokens:]
+
+    indices = list(range(len(messages)))
+    fan_out = asyncio.Semaphore(settings.distance_check_fan_out)
+    multi_pass = await text._multi_pass_distances(task_config, payload, messages, indices, False, fan_out)
+    single_pass = text._single_pass_distances(prompt_logprobs, messages, indices)
+
+    assert single_pass == pytest.approx(multi_pass, abs=1e-6)
+    assert 0 < sum(multi_pass) / len(multi_pass) < 1
+
+
+@pytest.mark.parametrize(
+    "request_factory, partial_score",
+    [
+        (lambda: chat_check_request(seed=2), False),
+        (lambda: _sloppy_request(seed=3, probability_scale=0.6), True),
+        (lambda: _sloppy_request(seed=4, probability_scale=0.45), True),
+        (lambda: chat_check_request(seed=5, honest=False), False),
+    ],
+    ids=["honest", "slightly-off", "far-off", "garbage"],
+)
+async def test_single_pass_scores_match_multi_pass(llm_server, monkeypatch: pytest.MonkeyPatch, request_factory, partial_score: bool):
+    from app.checking.functions import text
+    from app.settings import TextVerificationMode, settings
+
+    request = request_factory()
+    scores = {}
+    for mode in (TextVerificationMode.MULTI_PASS, TextVerificationMode.SINGLE_PASS):
+        monkeypatch.setattr(settings, "text_verification_mode", mode)
+        # The same tokens are picked to check in both modes
+        random.seed(0)
+        scores[mode] = await text.check_text_result(request.result, request.payload, request.server_config)
+
+    assert scores[TextVerificationMode.SINGLE_PASS] == pytest.approx(scores[TextVerificationMode.MULTI_PASS], abs=text.SINGLE_PASS_SCORE_TOLERANCE)
+    # The sloppy responses land between the thresholds, where the scores are most sensitive to the distances
+    assert (0 < scores[TextVerificationMode.MULTI_PASS] < 1) == partial_score
@@ -0,0 +1,60 @@
+import time
+import pytest
+from app.core import models
+from app.core import timeouts
+from tests.conftest import chat_check_request, process_check
+
+
+def test_latencies_are_kept_per_size_class():
+    latency_model = timeouts.LatencyModel(window=100, min_samples=5, multiplier=3, min_timeout_seconds=1)
+    for _ in range(5):
+        latency_model.observe("llm_server", "/v1/completions", 0.05)
+        latency_model.observe("llm_server", "/v1/completions", 5, size=4000)
+
+    # Quick 1 token calls don't shrink the timeout of long prompts, and long prompts don't stretch theirs
+    assert latency_model.timeout("llm_server", "/v1/completions", default=20) == 1
+    assert latency_model.timeout("llm_server", "/v1/completions", default=20, size=3000) == 15
+    # No samples yet for prompts twice as long
+    assert latency_model.timeout("llm_server", "/v1/completions", default=20, size=5000) == 20
+    assert set(latency_model.timeouts()) == {("llm_server", "/v1/completions", size) for size in (1, 4096, 8192)}
+
+
+@pytest.mark.parametrize("size, expected", [(0, 1), (1, 1), (2, 2), (3, 4), (4096, 4096), (4097, 8192)])
+def test_size_class(size: int, expected: int):
+    assert timeouts.size_class(size) == expected
+
+
+@pytest.mark.anyio
+async def test_upstream_too_slow_for_the_deadline_expires_the_check(llm_server):
+    from app.checking.score_memo import request_key, score_memo
+
+    request = chat_check_request()
+    request.deadline = time.time() + 0.2
+    llm_server.delays["/v1/completions"] = 5
+
+    status, result = await process_check(request)
+
+    assert status == models.TaskStatus.Expired
+    assert result.node_scores is None
+    assert score_memo.get(request_key(request)) is None
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "upstream_error, status, invalidated",
+    [("timing_out", models.TaskStatus.Expired, False), ("failing", models.TaskStatus.Failed, True)],
+    ids=["timeout", "connection-refused"],
+)
+async def test_only_a_server_that_may_be_down_is_invalidated(llm_server, monkeypatch: pytest.MonkeyPatch, upstream_error: str, status, invalidated: bool):
+    from app import server_management
+
+    invalidations = []
+    monkeypatch.setattr(server_management.ServerManager, "invalidate", lambda self, server_name: invalidations.append(server_name))
+    getattr(llm_server, upstream_error).add("/v1/completions")
+
+    # A slow upstream is up, so the check expires without draining the gate & swapping the server back in
+    check_status, result = await process_check(chat_check_request())
+
+    assert check_status == status
+    assert result.node_scores is None
+    assert bool(invalidations) == invalidated
@@ -0,0 +1,239 @@
+"""
+In-process tokenising must give exactly what the llm_server's /tokenize & /detokenize give.
+
+The stub tests always run, with the stub vLLM tokenizer behind the HF interface `LocalTokenizer` wraps. The real
+tokenizer tests run when `TOKENIZER_PARITY_TOKENIZER` names one (a hub name, or a directory under
+`LOCAL_TOKENIZERS_DIR`) and transformers is installed; set `TOKENIZER_PARITY_LLM_SERVER_URL` to a vLLM server
+serving that tokenizer to compare with its endpoints too.
+"""
+
+import asyncio
+import os
+import re
+from typing import List
+import pytest
+from benchmarks import stub_vllm
+from app.checking import prompt_cache as prompt_cache_module
+from app.checking.tokenization import LocalTokenizer
+from tests.conftest import LOAD_MODEL_CONFIG, MODEL
+
+pytestmark = pytest.mark.anyio
+
+REAL_TOKENIZER = os.environ.get("TOKENIZER_PARITY_TOKENIZER")
+REAL_LLM_SERVER_URL = os.environ.get("TOKENIZER_PARITY_LLM_SERVER_URL")
+
+CONVERSATION = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "Write a short story about a river, in two sentences."},
+    {"role": "assistant", "content": "The river was small.\n\nIt grew into the sea!"},
+    {"role": "user", "content": "Make it longer, with a city ( and a   film )."},
+    {"role": "assistant", "content": " Known  to the world, the city had a river..."},
+    {"role": "user", "content": "Qu'est-ce que c'est? 日本語も。 🙂"},
+]
+PROMPTS = ["The river was small.", " leading space", "two  spaces\nand a newline", "", "Qu'est-ce que c'est? 日本語も。 🙂"]
+
+
+def _conversations() -> List[List[dict]]:
+    """Every start of `CONVERSATION`, in order, so later ones can reuse the cached tokens of earlier ones"""
+    return [CONVERSATION[:length] for length in range(1, len(CONVERSATION) + 1)]
+
+
+class _StubHFTokenizer:
+    """The stub vLLM tokenizer, behind the part of the HF fast tokenizer interface `LocalTokenizer` uses"""
+
+    all_special_ids = list(stub_vllm.SPECIAL_TOKEN_IDS.values())
+    added_tokens_decoder: dict = {}
+    is_fast = True
+
+    def __call__(self, text: str, add_special_tokens: bool = True, return_offsets_mapping: bool = False) -> dict:
+        encoding = {"input_ids": stub_vllm.tokenize(text, add_special_tokens)}
+        if return_offsets_mapping:
+            offsets = [match.span() for match in stub_vllm._TOKEN_PATTERN.finditer(text)]
+            encoding["offset_mapping"] = [(0, 0)] * (len(encoding["input_ids"]) - len(offsets)) + offsets
+        return encoding
+
+    def apply_chat_template(self, messages: List[dict], tokenize: bool = False, add_generation_prompt: bool = True) -> str:
+        return stub_vllm.render_chat(messages, add_generation_prompt)
+
+    def decode(self, token_ids: List[int]) -> str:
+        return stub_vllm.detokenize(token_ids)
+
+
+@pytest.fixture
+def local_stub_tokenizer(llm_server, monkeypatch: pytest.MonkeyPatch):
+    from app.checking.prompt_cache import PromptCache
+    from app.checking.tokenization import tokenizer_cache
+    from app.settings import TokenizerMode, settings
+
+    monkeypatch.setattr(settings, "tokenizer_mode", TokenizerMode.LOCAL)
+    monkeypatch.setitem(tokenizer_cache._tokenizers, MODEL, LocalTokenizer(MODEL, _StubHFTokenizer()))
+    monkeypatch.setattr(prompt_cache_module, "prompt_cache", PromptCache())
+    return llm_server
+
+
+async def test_local_tokenizing_matches_the_server(local_stub_tokenizer):
+    from app.checking.functions import text
+
+    for prompt in PROMPTS:
+        for add_special_tokens in (True, False):
+            assert await text._tokenize(prompt, LOAD_MODEL_CONFIG, add_special_tokens) == await text._server_tokenize(prompt, MODEL, add_special_tokens)
+
+    for messages in _conversations():
+        tokens = await text._tokenize_chat(messages, LOAD_MODEL_CONFIG)
+        assert tokens == await text._server_tokenize_chat(messages, MODEL)
+        assert await text._detokenize(tokens, LOAD_MODEL_CONFIG) == await text._server_detokenize(tokens, MODEL)
+
+    # Only the parity checks went to the server, the checks' own tokenising stayed in process
+    assert local_stub_tokenizer.calls["/tokenize"] == 2 * len(PROMPTS) + len(CONVERSATION)
+    assert local_stub_tokenizer.calls["/detokenize"] == len(CONVERSATION)
+
+
+async def test_prompt_cache_prefixes_are_reused(local_stub_tokenizer):
+    from app.checking.functions import text
+    from app.core import metrics
+
+    def prefix_hits() -> float:
+        return metrics.prompt_cache_lookups_total._values.get(("prefix",), 0)
+
+    hits_before = prefix_hits()
+    for messages in _conversations():
+        await text._tokenize_chat(messages, LOAD_MODEL_CONFIG)
+
+    # Every conversation after the first only tokenised what followed the one before it
+    assert prefix_hits() - hits_before == len(CONVERSATION) - 1
+
+
+@pytest.fixture(scope="module")
+def real_tokenizer() -> LocalTokenizer:
+    if not REAL_TOKENIZER:
+        pytest.skip("Set TOKENIZER_PARITY_TOKENIZER to test a real tokenizer")
+    pytest.importorskip("transformers")
+    from app.checking.tokenization import _load
+
+    return _load(REAL_TOKENIZER)
+
+
+def test_prompt_cache_matches_real_tokenizer(real_tokenizer: LocalTokenizer, monkeypatch: pytest.MonkeyPatch):
+    from app.checking.prompt_cache import PromptCache
+
+    monkeypatch.setattr(prompt_cache_module, "prompt_cache", PromptCache())
+    for messages in _conversations():
+        assert prompt_cache_module.tokenize_chat(real_tokenizer, messages) == real_tokenizer.tokenize_chat(messages)
+    # Cut down templates can't always be reused, but llama 3 style ones end every message in a special token
+    if real_tokenizer.is_special(real_tokenizer.tokenize_chat(CONVERSATION[:1], add_generation_prompt=False)[-1]):
+        assert len(prompt_cache_module.prompt_cache) > 1
+
+
+@pytest.mark.skipif(not REAL_LLM_SERVER_URL, reason="Set TOKENIZER_PARITY_LLM_SERVER_URL to compare with a real llm_server")
+async def test_real_tokenizer_matches_llm_server(real_tokenizer: LocalTokenizer, monkeypatch: pytest.MonkeyPatch):
+    from app.checking.functions import text
+    from app.checking.prompt_cache import PromptCache
+    from app.checking.tokenization import tokenizer_cache
+    from app.core.http_clients import http_clients
+    from app.settings import TokenizerMode, settings
+
+    load_model_config = {"model": REAL_TOKENIZER, "tokenizer": REAL_TOKENIZER}
+    monkeypatch.setattr(text, "BASE_URL", REAL_LLM_SERVER_URL.rstrip("/"))
+    monkeypatch.setattr(settings, "tokenizer_mode", TokenizerMode.LOCAL)
+    monkeypatch.setitem(tokenizer_cache._tokenizers, REAL_TOKENIZER, real_tokenizer)
+    monkeypatch.setattr(prompt_cache_module, "prompt_cache", PromptCache())
+    try:
+        for prompt in PROMPTS:
+            for add_special_tokens in (True, False):
+                assert await text._tokenize(prompt, load_model_config, add_special_tokens) == await text._server_tokenize(
+                    prompt, REAL_TOKENIZER, add_special_tokens
+                )
+        for messages in _conversations():
+            tokens = await text._tokenize_chat(messages, load_model_config)
+            assert tokens == await text._server_tokenize_chat(messages, REAL_TOKENIZER)
+            assert await text._detokenize(tokens, load_model_config) == await text._server_detokenize(tokens, REAL_TOKENIZER)
+    finally:
+        await http_clients.close()
+
+
+async def test_failed_tokenizer_loads_are_retried_after_a_backoff(monkeypatch: pytest.MonkeyPatch):
+    from app.checking import tokenization
+    from app.settings import settings
+
+    loads = []
+
+    def load(name: str) -> LocalTokenizer:
+        loads.append(name)
+        if len(loads) == 1:
+            raise OSError("The hub is unreachable")
+        return LocalTokenizer(name, _StubHFTokenizer())
+
+    monkeypatch.setattr(tokenization, "_load", load)
+    monkeypatch.setattr(settings, "tokenizer_load_retry_seconds", 0.05)
+    cache = tokenization.TokenizerCache()
+
+    assert await cache.get(LOAD_MODEL_CONFIG) is None
+    # Backing off: the server tokenises meanwhile
+    assert await cache.get(LOAD_MODEL_CONFIG) is None
+    assert len(loads) == 1
+
+    await asyncio.sleep(0.06)
+    assert (await cache.get(LOAD_MODEL_CONFIG)).name == MODEL
+    assert len(loads) == 2
+
+
+class _StubSentencePieceTokenizer:
+    """
+    A SentencePiece style tokenizer, like llama 2's & mistral's: spaces become "▁" and the start of the input gets a
+    leading "▁", but text after a special token doesn't. With a mistral style template, where [INST] isn't special
+    """
+
+    SPECIAL_TOKENS = {"<s>": 1, "</s>": 2}
+    all_special_ids = list(SPECIAL_TOKENS.values())
+    added_tokens_decoder: dict = {}
+    is_fast = True
+
+    def __init__(self) -> None:
+        self._pieces = {**self.SPECIAL_TOKENS}
+
+    def _id(self, piece: str) -> int:
+        return self._pieces.setdefault(piece, len(self._pieces) + 1)
+
+    def __call__(self, text: str, add_special_tokens: bool = True, return_offsets_mapping: bool = False) -> dict:
+        token_ids, offsets = [], []
+        for segment in re.finditer(r"<s>|</s>|(?:(?!<s>|</s>).)+", text, re.DOTALL):
+            if segment.group() in self.SPECIAL_TOKENS:
+                token_ids.append(self.SPECIAL_TOKENS[segment.group()])
+                offsets.append(segment.span())
+                continue
+            leading_space = segment.start() == 0
+            pieces = ("▁" if leading_space else "") + segment.group().replace(" ", "▁")
+            for piece in re.finditer(r"▁*[^▁]+|▁+", pieces):
+                token_ids.append(self._id(piece.group()))
+                start, end = (segment.start() + position - leading_space for position in piece.span())
+                offsets.append((max(start, segment.start()), end))
+        if add_special_tokens:
+            token_ids, offsets = [1, *token_ids], [(0, 0), *offsets]
+        return {"input_ids": token_ids, "offset_mapping": offsets} if return_offsets_mapping else {"input_ids": token_ids}
+
+    def apply_chat_template(self, messages: List[dict], tokenize: bool = False, add_generation_prompt: bool = True) -> str:
+        prompt = "<s>"
+        for message in messages:
+            prompt += f"[INST] {message['content']} [/INST]" if message["role"] != "assistant" else f" {message['content']}</s>"
+        return prompt
+
+    def decode(self, token_ids: List[int]) -> str:
+        pieces = {token_id: piece for piece, token_id in self._pieces.items()}
+        return "".join(pieces[token_id] for token_id in token_ids).replace("▁", " ")
+
+
+def test_prompt_cache_matches_sentencepiece_tokenizer(monkeypatch: pytest.MonkeyPatch):
+    from app.checking.prompt_cache import PromptCache
+    from app.core import metrics
+
+    tokenizer = LocalTokenizer("stub/mistral", _StubSentencePieceTokenizer())
+    monkeypatch.setattr(prompt_cache_module, "prompt_cache", PromptCache())
+    conversations = [CONVERSATION[1 : length + 1] for length in range(1, len(CONVERSATION))]
+
+    # The text after a cached </s> gets no leading space in the full prompt, but would on its own
+    assert tokenizer.tokenize("[INST]", add_special_tokens=False) != tokenizer.tokenize("</s>[INST]", add_special_tokens=False)[1:]
+    hits_before = metrics.prompt_cache_lookups_total._values.get(("prefix",), 0)
+    for messages in conversations:
+        assert prompt_cache_module.tokenize_chat(tokenizer, messages) == tokenizer.tokenize_chat(messages)
+    # Conversations continuing one that ended in an assistant message (and so in </s>) reused its tokens
+    assert metrics.prompt_cache_lookups_total._values.get(("prefix",), 0) > hits_before